@@ -0,0 +1,210 @@
+"""
+Background removal for animated GIF / WebP and short MP4 clips
+
+Frames are decoded, processed and encoded one at a time. The model only
+runs on keyframes: every ANIMATION_KEYFRAME_INTERVAL frames, or earlier
+when a frame differs too much from the last keyframe (scene change). The
+frames in between reuse the keyframe's mask.
+
+The result is an animated PNG (APNG), which keeps a full alpha channel.
+PIL's save_all collects every frame before writing, so ApngWriter writes
+each frame as soon as it is added instead.
+"""
+import io
+import logging
+import struct
+import tempfile
+import zlib
+from typing import BinaryIO, Dict, Iterator, Tuple
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from config import Config
+from metrics import ANIMATION_FRAMES, track_stage
+from quotas import charge_megapixels
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def is_video(data: bytes) -> bool:
+    """Whether the bytes look like an MP4/MOV container"""
+    return data[4:8] == b'ftyp'
+
+
+def is_animated_image(data: bytes) -> bool:
+    """Whether the bytes are a GIF or WebP with more than one frame"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format in ('GIF', 'WEBP') and getattr(image, 'is_animated', False)
+    except Exception:
+        return False
+
+
+def iter_frames(data: bytes) -> Iterator[Tuple[Image.Image, int]]:
+    """Yield (RGB frame, duration in ms) of an animated image or video, decoding lazily"""
+    if is_video(data):
+        yield from _iter_video_frames(data)
+        return
+
+    with Image.open(io.BytesIO(data)) as image:
+        for frame in ImageSequence.Iterator(image):
+            yield frame.convert('RGB'), int(frame.info.get('duration', 100)) or 100
+
+
+def _iter_video_frames(data: bytes) -> Iterator[Tuple[Image.Image, int]]:
+    try:
+        import cv2
+    except ImportError:
+        raise ValueError("Video support needs opencv-python")
+
+    # OpenCV only reads videos from files
+    with tempfile.NamedTemporaryFile(suffix='.mp4') as video_file:
+        video_file.write(data)
+        video_file.flush()
+        capture = cv2.VideoCapture(video_file.name)
+        try:
+            fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+            duration = max(1, round(1000 / fps))
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), duration
+        finally:
+            capture.release()
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _png_chunks(png: bytes) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield (type, data) of every chunk of a PNG file"""
+    offset = len(PNG_SIGNATURE)
+    while offset < len(png):
+        length, chunk_type = struct.unpack('>I4s', png[offset:offset + 8])
+        yield chunk_type, png[offset + 8:offset + 8 + length]
+        offset += 12 + length
+
+
+class ApngWriter:
+    """
+    Write an animated PNG frame by frame to a seekable stream
+
+    Each frame is compressed by PIL's PNG encoder and its image data copied
+    into the animation, so only the current frame is held in memory. The
+    frame count is patched into the header when the writer is closed.
+    """
+
+    def __init__(self, fp: BinaryIO, loop: int = 0, compress_level: int = 6):
+        self.fp = fp
+        self.loop = loop
+        self.compress_level = compress_level
+        self.frames = 0
+        self.size = None
+        self._sequence = 0
+        self._actl_offset = None
+
+    def add(self, frame: Image.Image, duration_ms: int):
+        """Append an RGBA frame shown for duration_ms"""
+        if self.size is None:
+            self.size = frame.size
+        elif frame.size != self.size:
+            frame = frame.resize(self.size)
+
+        buffer = io.BytesIO()
+        frame.convert('RGBA').save(buffer, format='PNG', compress_level=self.compress_level)
+        chunks = list(_png_chunks(buffer.getvalue()))
+        image_data = b''.join(data for chunk_type, data in chunks if chunk_type == b'IDAT')
+
+        if self.frames == 0:
+            header = next(data for chunk_type, data in chunks if chunk_type == b'IHDR')
+            self.fp.write(PNG_SIGNATURE + _chunk(b'IHDR', header))
+            self._actl_offset = self.fp.tell()
+            self.fp.write(_chunk(b'acTL', struct.pack('>II', 0, self.loop)))
+
+        width, height = self.size
+        delay = min(max(int(duration_ms), 1), 65535)
+        self.fp.write(_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self._next_sequence(), width, height, 0, 0, delay, 1000,
+            0, 0  # dispose: none, blend: source (frames are complete)
+        )))
+        if self.frames == 0:
+            self.fp.write(_chunk(b'IDAT', image_data))
+        else:
+            self.fp.write(_chunk(b'fdAT', struct.pack('>I', self._next_sequence()) + image_data))
+        self.frames += 1
+
+    def _next_sequence(self) -> int:
+        sequence = self._sequence
+        self._sequence += 1
+        return sequence
+
+    def close(self):
+        """Finish the file and write the frame count into the header"""
+        if self.frames == 0:
+            raise ValueError("An animation needs at least one frame")
+        self.fp.write(_chunk(b'IEND', b''))
+        end = self.fp.tell()
+        self.fp.seek(self._actl_offset)
+        self.fp.write(_chunk(b'acTL', struct.pack('>II', self.frames, self.loop)))
+        self.fp.seek(end)
+
+
+def frame_signature(frame: Image.Image) -> np.ndarray:
+    """Small grayscale thumbnail used to detect scene changes"""
+    return np.asarray(frame.convert('L').resize((64, 64), Image.BILINEAR), dtype=np.float32) / 255.0
+
+
+def process_animation(remover, data: bytes, mode: str, opacity: int, fp: BinaryIO) -> Dict[str, int]:
+    """
+    Remove the background of every frame, writing the APNG result to fp
+
+    Args:
+        remover: BackgroundRemover providing _get_mask and _composite
+        data: GIF, animated WebP or MP4 bytes
+        mode: Transparency mode
+        opacity: Opacity level for custom mode
+        fp: Seekable output stream
+
+    Returns:
+        Counts of 'frames' and 'keyframes' (frames that ran the model)
+    """
+    writer = ApngWriter(fp)
+    max_side = Config.ANIMATION_MAX_SIDE
+    mask = keyframe_signature = None
+    since_keyframe = 0
+    keyframes = 0
+
+    for index, (frame, duration) in enumerate(iter_frames(data)):
+        if index >= Config.ANIMATION_MAX_FRAMES:
+            raise ValueError(f"Animation has more than {Config.ANIMATION_MAX_FRAMES} frames")
+        if max_side > 0:
+            frame.thumbnail((max_side, max_side))
+        charge_megapixels(*frame.size)
+
+        signature = frame_signature(frame)
+        is_keyframe = (
+            mask is None
+            or since_keyframe >= Config.ANIMATION_KEYFRAME_INTERVAL
+            or float(np.abs(signature - keyframe_signature).mean()) > Config.ANIMATION_SCENE_CHANGE_THRESHOLD
+        )
+        if is_keyframe:
+            mask = remover._get_mask(frame)
+            keyframe_signature = signature
+            since_keyframe = 0
+            keyframes += 1
+        since_keyframe += 1
+        ANIMATION_FRAMES.labels(kind='keyframe' if is_keyframe else 'reused').inc()
+
+        with track_stage('composite'):
+            result = remover._composite(frame, mask, mode, opacity)
+        with track_stage('encode'):
+            writer.add(result, duration)
+
+    writer.close()
+    logger.info(f"Processed animation: {writer.frames} frames, {keyframes} keyframes")
+    return {'frames': writer.frames, 'keyframes': keyframes}
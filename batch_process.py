@@ -0,0 +1,345 @@
+"""
+Batch background removal for directories, globs and zip archives
+
+Streams input images through a pipelined, multi-worker job:
+
+    read (1 thread) -> decode (N) -> inference (M) -> composite + encode (N) -> write
+
+Stages are connected by bounded queues, so only a handful of images are in
+memory at any time regardless of the batch size. Before an image is decoded
+its estimated memory is reserved in the memory budget (MEMORY_BUDGET_MB) until
+its result is written, and images of at least TILED_MIN_MEGAPIXELS are
+processed strip by strip (see tiled.py) in the inference stage. Every finished image is
+recorded in a manifest (manifest.jsonl in the output directory); running
+the same command again skips images that were already processed. Results are
+named after the full input name (photo.jpg -> photo.jpg.png), so inputs that
+only differ in their extension do not overwrite each other.
+
+Usage:
+    python batch_process.py photos/ out/
+    python batch_process.py "catalog/**/*.jpg" out/ --mode soft --workers 4
+    python batch_process.py products.zip out/ --inference-workers 2
+"""
+import argparse
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from PIL import Image
+
+from config import Config
+from image_processor import BackgroundRemover
+from inference_threads import resolve_thread_settings, worker_initializer
+from memory_budget import ThreadMemoryBudget, estimate_job_bytes
+from tiled import use_tiled_processing
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+_STOP = object()
+
+
+@dataclass
+class BatchItem:
+    """One image moving through the pipeline"""
+    name: str  # path relative to the source, also the manifest key
+    load: Callable[[], bytes]
+    data: Optional[bytes] = None
+    image: Optional[Image.Image] = None
+    mask: Optional[Image.Image] = None
+    output: Optional[bytes] = None
+    error: Optional[str] = None
+    reserved: int = 0  # bytes held in the memory budget
+
+
+def _is_supported(name: str) -> bool:
+    return Path(name).suffix.lower() in Config.SUPPORTED_FORMATS
+
+
+def iter_inputs(source: str) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """
+    Yield (relative name, loader) for every image in a directory, zip archive or glob
+
+    Files are listed lazily and only read when the loader is called.
+    """
+    if os.path.isfile(source) and zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        for info in archive.infolist():
+            if not info.is_dir() and _is_supported(info.filename):
+                yield info.filename, (lambda info=info: archive.read(info))
+        return
+
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                if _is_supported(file_name):
+                    path = os.path.join(root, file_name)
+                    yield os.path.relpath(path, source), (lambda path=path: Path(path).read_bytes())
+        return
+
+    # Glob pattern: names are relative to the part of the pattern before the first wildcard
+    base = source
+    while glob.has_magic(base):
+        base = os.path.dirname(base)
+    for path in sorted(glob.iglob(source, recursive=True)):
+        if os.path.isfile(path) and _is_supported(path):
+            yield os.path.relpath(path, base or '.'), (lambda path=path: Path(path).read_bytes())
+
+
+def load_manifest(path: Path) -> Dict[str, dict]:
+    """Read the manifest of a previous run, keyed by input name"""
+    entries = {}
+    if path.exists():
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    entries[entry['name']] = entry
+    return entries
+
+
+class _Stage:
+    """A pool of worker threads applying one step to items from a bounded queue"""
+
+    def __init__(self, name: str, step: Callable[[BatchItem], None], workers: int,
+                 inbox: queue.Queue, outbox: queue.Queue, initializer: Optional[Callable[[], None]] = None):
+        self.name = name
+        self.step = step
+        self.initializer = initializer
+        self.inbox = inbox
+        self.outbox = outbox
+        self._running = workers
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"batch-{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def _work(self):
+        if self.initializer is not None:
+            self.initializer()
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                # Pass the stop signal on to sibling workers, the last one closes the next stage
+                self.inbox.put(_STOP)
+                with self._lock:
+                    self._running -= 1
+                    last = self._running == 0
+                if last:
+                    self.outbox.put(_STOP)
+                return
+
+            if item.error is None:
+                try:
+                    self.step(item)
+                except Exception as e:
+                    item.error = f"{self.name}: {e}"
+            self.outbox.put(item)
+
+
+class BatchProcessor:
+    """Pipelined batch job over a BackgroundRemover"""
+
+    def __init__(self, remover: BackgroundRemover, output_dir: str, mode: str = 'full', opacity: int = 100,
+                 workers: int = 2, inference_workers: int = 1, queue_size: int = 4,
+                 progress_every: int = 50):
+        self.remover = remover
+        self.output_dir = Path(output_dir)
+        self.mode = mode
+        self.opacity = opacity
+        self.workers = workers
+        self.inference_workers = inference_workers
+        self.queue_size = queue_size
+        self.progress_every = progress_every
+        self.memory_budget = ThreadMemoryBudget(remover.memory_budget.limit)
+
+    def _decode(self, item: BatchItem):
+        item.image = self.remover._decode(item.data)
+        item.data = None
+
+    def _infer(self, item: BatchItem):
+        if use_tiled_processing(*item.image.size):
+            # Model, compositing and encoding run strip by strip in one go
+            item.output = self.remover._run_tiled(item.image, self.mode, self.opacity, None, self.remover.model_mode)
+            item.image = None
+            if item.output is None:
+                raise ValueError("tiled processing failed")
+            return
+        item.mask = self.remover._get_mask(item.image)
+
+    def _encode(self, item: BatchItem):
+        if item.output is not None:
+            return  # Already encoded by the tiled path
+        result = self.remover._composite(item.image, item.mask, self.mode, self.opacity)
+        item.image = item.mask = None
+        item.output = self.remover._encode(result)
+
+    def _output_path(self, name: str) -> Path:
+        # Keep the source extension: a.jpg and a.png must not both become a.png
+        return self.output_dir / (name + '.png')
+
+    def _check_settings(self, manifest: Dict[str, dict]):
+        """Refuse to resume into an output directory written with other settings"""
+        for entry in manifest.values():
+            if entry['status'] != 'ok' or 'mode' not in entry:
+                continue
+            if (entry['mode'], entry['opacity']) != (self.mode, self.opacity):
+                raise ValueError(
+                    f"{self.output_dir} holds results made with --mode {entry['mode']} "
+                    f"--opacity {entry['opacity']}; use another output directory or the same settings"
+                )
+
+    def run(self, source: str) -> Dict[str, float]:
+        """Process every image of a source and return run statistics"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.output_dir / MANIFEST_NAME
+        manifest = load_manifest(manifest_path)
+        self._check_settings(manifest)
+        done = {name for name, entry in manifest.items() if entry['status'] == 'ok'}
+
+        read_queue = queue.Queue(self.queue_size)
+        infer_queue = queue.Queue(self.queue_size)
+        encode_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+        # Split the cores between the inference threads instead of each using all of them
+        _, threads = resolve_thread_settings(self.inference_workers)
+        stages = [
+            _Stage('decode', self._decode, self.workers, read_queue, infer_queue),
+            _Stage('inference', self._infer, self.inference_workers, infer_queue, encode_queue,
+                   worker_initializer(self.inference_workers, threads, Config.INFERENCE_CPU_AFFINITY)),
+            _Stage('encode', self._encode, self.workers, encode_queue, write_queue),
+        ]
+        for stage in stages:
+            stage.start()
+
+        stats = {'processed': 0, 'failed': 0, 'skipped': 0}
+        reader = threading.Thread(target=self._read, args=(source, done, read_queue, stats), daemon=True)
+        start = time.perf_counter()
+        reader.start()
+
+        with open(manifest_path, 'a') as manifest:
+            while True:
+                item = write_queue.get()
+                if item is _STOP:
+                    break
+                entry = self._write(item)
+                manifest.write(json.dumps(entry) + '\n')
+                manifest.flush()
+
+                stats['processed' if item.error is None else 'failed'] += 1
+                finished = stats['processed'] + stats['failed']
+                if self.progress_every and finished % self.progress_every == 0:
+                    elapsed = time.perf_counter() - start
+                    print(f"📦 {finished} images, {finished / elapsed:.2f} img/s", flush=True)
+
+        reader.join()
+        stats['seconds'] = time.perf_counter() - start
+        stats['images_per_second'] = stats['processed'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        return stats
+
+    def _read(self, source: str, done: set, outbox: queue.Queue, stats: Dict[str, float]):
+        """Read input files into the pipeline, skipping ones finished in an earlier run"""
+        try:
+            for name, load in iter_inputs(source):
+                if name in done:
+                    stats['skipped'] += 1
+                    continue
+                item = BatchItem(name, load)
+                try:
+                    item.data = load()
+                except OSError as e:
+                    item.error = f"read: {e}"
+                else:
+                    self._reserve(item)
+                outbox.put(item)
+        finally:
+            outbox.put(_STOP)
+
+    def _reserve(self, item: BatchItem):
+        """Wait until the image fits in the memory budget, sized from its header"""
+        try:
+            width, height = self.remover.get_image_size(item.data)
+        except Exception:
+            return  # Not an image; decoding reports it
+        item.reserved = estimate_job_bytes(width, height)
+        self.memory_budget.acquire(item.reserved)
+
+    def _write(self, item: BatchItem) -> dict:
+        """Save a finished image and return its manifest entry"""
+        self.memory_budget.release(item.reserved)
+        item.reserved = 0
+        if item.error is None:
+            output_path = self._output_path(item.name)
+            try:
+                output_path.parent.mkdir(parents=True, exist_ok=True)
+                output_path.write_bytes(item.output)
+            except OSError as e:
+                item.error = f"write: {e}"
+            item.output = None
+
+        if item.error is not None:
+            print(f"❌ {item.name}: {item.error}", flush=True)
+            return {'name': item.name, 'status': 'error', 'error': item.error}
+        return {
+            'name': item.name,
+            'status': 'ok',
+            'output': str(self._output_path(item.name)),
+            'mode': self.mode,
+            'opacity': self.opacity
+        }
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Remove backgrounds from many images at once")
+    parser.add_argument('source', help="Directory, zip archive or glob pattern (quote it)")
+    parser.add_argument('output_dir', help="Where results and the resume manifest are written")
+    parser.add_argument('--mode', default='full', choices=list(Config.TRANSPARENCY_MODES), help="Transparency mode")
+    parser.add_argument('--opacity', type=int, default=75, help="Opacity for custom mode (1-99)")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Threads for decoding and for encoding")
+    parser.add_argument('--inference-workers', type=int, default=1, help="Threads running the model")
+    parser.add_argument('--queue-size', type=int, default=4, help="Images buffered between stages")
+    parser.add_argument('--progress-every', type=int, default=50, help="Print progress every N images")
+    parser.add_argument('--model-mode', default=Config.MODEL_MODE, choices=['base', 'fast', 'base-nightly'],
+                        help="InSPyReNet variant")
+    args = parser.parse_args()
+
+    print(f"🎨 Batch processing {args.source} -> {args.output_dir} ({args.mode} mode)\n")
+    processor = BatchProcessor(
+        BackgroundRemover(model_mode=args.model_mode),
+        args.output_dir,
+        mode=args.mode,
+        opacity=args.opacity,
+        workers=args.workers,
+        inference_workers=args.inference_workers,
+        queue_size=args.queue_size,
+        progress_every=args.progress_every
+    )
+    try:
+        stats = processor.run(args.source)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 2
+
+    print(f"\n✅ Processed: {stats['processed']}  ⏭️  Skipped: {stats['skipped']}  ❌ Failed: {stats['failed']}")
+    print(f"⏱️  {stats['seconds']:.1f}s, {stats['images_per_second']:.2f} images/s")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
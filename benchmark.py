@@ -0,0 +1,499 @@
+"""
+Benchmark suite for the image processing pipeline
+
+Measures latency percentiles, throughput and peak memory per transparency
+mode, per pipeline stage (decode, inference, composite, encode) and per
+InSPyReNet model mode on synthetic images, and saves the results as JSON so
+runs can be compared for regressions.
+
+Usage:
+    python benchmark.py --model-modes base fast --output results.json
+    python benchmark.py --stub --sizes 512x512,2048x1536     # no model weights needed
+    python benchmark.py --stub --compare baseline.json        # fail on regressions
+    python benchmark.py --backend onnx --compare torch.json   # ONNX Runtime against torch
+    python benchmark.py --thread-sweep --sizes 1024x768       # best workers x threads for this host
+    python benchmark.py --mask-sides 512,768,1024 --sizes 2048x1536  # low-resolution masks vs full
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from config import Config
+from image_processor import BackgroundRemover
+from inference_threads import available_cpus, create_inference_executor
+from metrics import current_rss_bytes
+
+STAGES = ['decode', 'inference', 'composite', 'encode']
+DEFAULT_SIZES = '256x256,512x512,1024x768'
+DEFAULT_MODE_OPACITY = {'custom': 75}
+
+
+class StubRemover:
+    """
+    Stand-in for transparent_background.Remover that needs no model weights
+
+    Returns an elliptical foreground mask, so everything except inference can
+    be benchmarked and tested on any machine.
+    """
+
+    def process(self, img: Image.Image, type: str = 'rgba') -> Image.Image:
+        """Mimic Remover.process for the 'map' and 'rgba' output types"""
+        width, height = img.size
+        mask = Image.new('L', img.size, 0)
+        ImageDraw.Draw(mask).ellipse([width * 0.2, height * 0.15, width * 0.8, height * 0.85], fill=255)
+
+        if type == 'map':
+            return Image.merge('RGB', (mask, mask, mask))
+
+        result = img.convert('RGBA')
+        result.putalpha(mask)
+        return result
+
+
+def make_synthetic_image(width: int, height: int, image_format: str = 'JPEG', seed: int = 0) -> bytes:
+    """Create a reproducible photo-like test image: noisy gradient background with shapes"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    background = np.stack([
+        180 * x + 40 * y,
+        120 + 60 * y + 0 * x,
+        200 - 100 * x * y
+    ], axis=-1)
+    background += rng.normal(0, 12, size=(height, width, 3))
+    image = Image.fromarray(np.clip(background, 0, 255).astype(np.uint8), 'RGB')
+
+    draw = ImageDraw.Draw(image)
+    draw.ellipse([width * 0.25, height * 0.2, width * 0.75, height * 0.8], fill=(30, 60, 200))
+    draw.rectangle([width * 0.4, height * 0.05, width * 0.6, height * 0.3], fill=(220, 180, 40))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=90)
+    return buffer.getvalue()
+
+
+def parse_sizes(sizes: str) -> List[Tuple[int, int]]:
+    """Parse '512x512,1024x768' into a list of (width, height)"""
+    result = []
+    for size in sizes.split(','):
+        width, height = size.lower().strip().split('x')
+        result.append((int(width), int(height)))
+    return result
+
+
+class PeakMemorySampler:
+    """Track the highest RSS seen while a block of code runs"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.baseline = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> 'PeakMemorySampler':
+        self.baseline = self.peak = current_rss_bytes()
+        if self.baseline is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    @property
+    def peak_mb(self) -> Optional[float]:
+        return None if self.peak is None else self.peak / 2**20
+
+    @property
+    def growth_mb(self) -> Optional[float]:
+        return None if self.peak is None else (self.peak - self.baseline) / 2**20
+
+
+def run_pipeline(remover: BackgroundRemover, image_bytes: bytes, mode: str, opacity: int) -> Dict[str, float]:
+    """Run one image through every stage and return the seconds spent in each"""
+    timings = {}
+
+    start = time.perf_counter()
+    image = remover._decode(image_bytes)
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mask = remover._get_mask(image)
+    timings['inference'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = remover._composite(image, mask, mode, opacity)
+    timings['composite'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    remover._encode(result)
+    timings['encode'] = time.perf_counter() - start
+
+    timings['total'] = sum(timings.values())
+    return timings
+
+
+def mask_metrics(reference: Image.Image, candidate: Image.Image) -> Dict[str, float]:
+    """Mean absolute error (0-255) and foreground IoU (mask >= 128) of a mask against a reference"""
+    ref = np.asarray(reference.convert('L'), dtype=np.float32)
+    cand = np.asarray(candidate.convert('L').resize(reference.size), dtype=np.float32)
+    ref_fg, cand_fg = ref >= 128, cand >= 128
+    union = np.logical_or(ref_fg, cand_fg).sum()
+    return {
+        'mae': float(np.abs(ref - cand).mean()),
+        'iou': float(np.logical_and(ref_fg, cand_fg).sum() / union) if union else 1.0
+    }
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Latency percentiles in milliseconds"""
+    values_ms = np.array(values) * 1000
+    return {
+        'mean_ms': round(float(values_ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(values_ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(values_ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(values_ms, 99)), 3),
+        'max_ms': round(float(values_ms.max()), 3)
+    }
+
+
+def benchmark_case(remover: BackgroundRemover, image_bytes: bytes, mode: str,
+                   iterations: int, warmup: int, concurrency: int) -> Dict:
+    """Benchmark one (model, mode, size) combination"""
+    opacity = DEFAULT_MODE_OPACITY.get(mode, 100)
+    for _ in range(warmup):
+        run_pipeline(remover, image_bytes, mode, opacity)
+
+    with PeakMemorySampler() as memory:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = list(executor.map(
+                lambda _: run_pipeline(remover, image_bytes, mode, opacity),
+                range(iterations)
+            ))
+        wall_seconds = time.perf_counter() - start
+
+    return {
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'latency': summarize([run['total'] for run in runs]),
+        'stages': {stage: summarize([run[stage] for run in runs]) for stage in STAGES},
+        'throughput_ips': round(iterations / wall_seconds, 3),
+        'peak_rss_mb': None if memory.peak_mb is None else round(memory.peak_mb, 1),
+        'rss_growth_mb': None if memory.growth_mb is None else round(memory.growth_mb, 1)
+    }
+
+
+def _git_commit() -> Optional[str]:
+    """Commit of the code being benchmarked, if run from a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load_remover(model_mode: str, stub: bool) -> BackgroundRemover:
+    if stub:
+        return BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    print(f"🔄 Loading model '{model_mode}'...")
+    return BackgroundRemover(model_mode=model_mode)
+
+
+def _meta(image_format: str) -> Dict:
+    """Host and settings the results were measured with"""
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'available_cpus': len(available_cpus()),
+        'image_format': image_format,
+        'inference_backend': Config.INFERENCE_BACKEND,
+        'resize_mode': Config.RESIZE_MODE,
+        'use_jit': Config.USE_JIT
+    }
+
+
+def run_benchmark(model_modes: List[str], modes: List[str], sizes: List[Tuple[int, int]],
+                  iterations: int = 5, warmup: int = 1, concurrency: int = 1,
+                  image_format: str = 'JPEG', stub: bool = False) -> Dict:
+    """Run every combination and return the results document"""
+    results = []
+    for model_mode in (['stub'] if stub else model_modes):
+        remover = _load_remover(model_mode, stub)
+
+        for width, height in sizes:
+            image_bytes = make_synthetic_image(width, height, image_format)
+            for mode in modes:
+                print(f"⏱️  {model_mode} | {mode:8} | {width}x{height}", end='', flush=True)
+                case = benchmark_case(remover, image_bytes, mode, iterations, warmup, concurrency)
+                case.update({'model_mode': model_mode, 'mode': mode, 'size': f"{width}x{height}"})
+                results.append(case)
+                print(f"  p50 {case['latency']['p50_ms']:.1f} ms, {case['throughput_ips']:.2f} img/s")
+
+    return {'meta': _meta(image_format), 'results': results}
+
+
+def compare_mask_resolutions(remover: BackgroundRemover, sizes: List[Tuple[int, int]], max_sides: List[int],
+                             methods: Tuple[str, ...] = ('guided', 'bilinear'), iterations: int = 3,
+                             image_format: str = 'JPEG') -> List[Dict]:
+    """
+    Quality and latency of low-resolution masks against full-resolution inference
+
+    For every image size the full-resolution mask is the reference. Each
+    (max side, upsampling method) case reports mask MAE/IoU against it and
+    the latency of producing the mask and of the soft-mode composite.
+    With the stub model the quality numbers only check the plumbing.
+    """
+    def measure(max_side: int, method: str, image: Image.Image):
+        remover.mask_max_side, remover.mask_upsample = max_side, method
+        mask_times, soft_times = [], []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            mask = remover._get_mask(image)
+            mask_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            remover._composite(image, mask, 'soft', 100)
+            soft_times.append(time.perf_counter() - start)
+        return mask, summarize(mask_times), summarize(soft_times)
+
+    original = remover.mask_max_side, remover.mask_upsample
+    results = []
+    try:
+        for width, height in sizes:
+            image = remover._decode(make_synthetic_image(width, height, image_format))
+            reference, reference_ms, reference_soft_ms = measure(0, 'bilinear', image)
+            results.append({
+                'size': f"{width}x{height}", 'max_side': 0, 'method': 'full',
+                'mask_latency': reference_ms, 'soft_latency': reference_soft_ms,
+                'mae': 0.0, 'iou': 1.0
+            })
+            for max_side in max_sides:
+                for method in methods:
+                    mask, mask_ms, soft_ms = measure(max_side, method, image)
+                    results.append(dict(
+                        {'size': f"{width}x{height}", 'max_side': max_side, 'method': method,
+                         'mask_latency': mask_ms, 'soft_latency': soft_ms},
+                        **{name: round(value, 4) for name, value in mask_metrics(reference, mask).items()}
+                    ))
+    finally:
+        remover.mask_max_side, remover.mask_upsample = original
+    return results
+
+
+def thread_configurations(cores: int) -> List[Tuple[int, int]]:
+    """Worker x thread splits that use every core, plus every worker using all cores"""
+    configs = []
+    workers = 1
+    while workers <= cores:
+        configs.append((workers, cores // workers))
+        workers *= 2
+    if cores > 1:
+        configs.append((cores, cores))  # oversubscribed, like the default executor without limits
+    return configs
+
+
+def run_thread_sweep(model_mode: str, size: Tuple[int, int], mode: str = 'full', iterations: int = 8,
+                     configs: Optional[List[Tuple[int, int]]] = None, pin: bool = False,
+                     image_format: str = 'JPEG', stub: bool = False) -> Dict:
+    """
+    Measure throughput and latency of each (workers, threads per worker) setting
+
+    Every setting processes at least two images per worker concurrently
+    through a dedicated inference pool, like the bot does under load.
+    """
+    configs = configs or thread_configurations(len(available_cpus()))
+    image_bytes = make_synthetic_image(*size, image_format)
+    opacity = DEFAULT_MODE_OPACITY.get(mode, 100)
+    remover = None
+    results = []
+    for workers, threads in configs:
+        if remover is None or (Config.INFERENCE_BACKEND == 'onnx' and not stub):
+            # ONNX Runtime fixes the thread count when the session is created
+            Config.ONNX_INTRA_OP_THREADS = threads
+            remover = _load_remover(model_mode, stub)
+
+        runs_count = max(iterations, 2 * workers)
+        print(f"⏱️  {workers} worker(s) x {threads} thread(s){' pinned' if pin else ''}", end='', flush=True)
+        with create_inference_executor(workers, threads, pin) as executor:
+            list(executor.map(lambda _: run_pipeline(remover, image_bytes, mode, opacity), range(workers)))
+            start = time.perf_counter()
+            runs = list(executor.map(
+                lambda _: run_pipeline(remover, image_bytes, mode, opacity),
+                range(runs_count)
+            ))
+            wall_seconds = time.perf_counter() - start
+
+        case = {
+            'workers': workers,
+            'threads_per_worker': threads,
+            'pinned': pin,
+            'iterations': runs_count,
+            'latency': summarize([run['total'] for run in runs]),
+            'throughput_ips': round(runs_count / wall_seconds, 3)
+        }
+        results.append(case)
+        print(f"  {case['throughput_ips']:.2f} img/s, p50 {case['latency']['p50_ms']:.1f} ms")
+
+    best = max(results, key=lambda case: case['throughput_ips'])
+    return {
+        'meta': dict(_meta(image_format), model_mode=model_mode, size=f"{size[0]}x{size[1]}", mode=mode),
+        'thread_sweep': results,
+        'best': best
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float = 0.10) -> List[str]:
+    """
+    Compare two result documents
+
+    Returns:
+        Descriptions of every case whose p50 latency or peak memory grew by more than threshold
+    """
+    def key(case):
+        return case['model_mode'], case['mode'], case['size']
+
+    baseline_cases = {key(case): case for case in baseline['results']}
+    regressions = []
+    for case in current['results']:
+        old = baseline_cases.get(key(case))
+        if old is None:
+            continue
+
+        name = ' | '.join(key(case))
+        checks = [('p50 latency', case['latency']['p50_ms'], old['latency']['p50_ms'], 'ms')]
+        checks += [
+            (f"{stage} p50", case['stages'][stage]['p50_ms'], old['stages'][stage]['p50_ms'], 'ms')
+            for stage in STAGES
+        ]
+        if case.get('peak_rss_mb') and old.get('peak_rss_mb'):
+            checks.append(('peak RSS', case['peak_rss_mb'], old['peak_rss_mb'], 'MB'))
+
+        for metric, new_value, old_value, unit in checks:
+            if old_value > 0 and new_value > old_value * (1 + threshold):
+                regressions.append(
+                    f"{name}: {metric} {old_value:.1f} -> {new_value:.1f} {unit} "
+                    f"(+{(new_value / old_value - 1) * 100:.0f}%)"
+                )
+    return regressions
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark the background removal pipeline")
+    parser.add_argument('--model-modes', nargs='+', default=[Config.MODEL_MODE],
+                        choices=['base', 'fast', 'base-nightly'], help="InSPyReNet variants to benchmark")
+    parser.add_argument('--modes', nargs='+', default=list(Config.TRANSPARENCY_MODES),
+                        choices=list(Config.TRANSPARENCY_MODES), help="Transparency modes to benchmark")
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help="Comma-separated WIDTHxHEIGHT list")
+    parser.add_argument('--iterations', type=int, default=5, help="Measured runs per case")
+    parser.add_argument('--warmup', type=int, default=1, help="Unmeasured runs per case")
+    parser.add_argument('--concurrency', type=int, default=1, help="Images processed in parallel")
+    parser.add_argument('--format', default='JPEG', choices=['JPEG', 'PNG', 'WEBP'], help="Input image format")
+    parser.add_argument('--backend', default=Config.INFERENCE_BACKEND, choices=['torch', 'onnx'],
+                        help="Inference backend")
+    parser.add_argument('--stub', action='store_true', help="Use a stub model (no weights, no inference cost)")
+    parser.add_argument('--output', default='benchmark_results.json', help="Where to save the results")
+    parser.add_argument('--compare', help="Baseline results file to check for regressions")
+    parser.add_argument('--thread-sweep', action='store_true',
+                        help="Find the best inference workers x threads split (first model mode, size and mode)")
+    parser.add_argument('--mask-sides',
+                        help="Compare low-resolution mask inference at these max sides (e.g. 512,1024)")
+    parser.add_argument('--pin', action='store_true', help="Pin inference workers to CPUs in the thread sweep")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Allowed slowdown before failing (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    Config.INFERENCE_BACKEND = args.backend
+    print("📊 Background Removal Benchmark\n")
+
+    if args.mask_sides:
+        remover = _load_remover(args.model_modes[0], args.stub)
+        cases = compare_mask_resolutions(
+            remover,
+            sizes=parse_sizes(args.sizes),
+            max_sides=[int(side) for side in args.mask_sides.split(',')],
+            iterations=args.iterations,
+            image_format=args.format
+        )
+        for case in cases:
+            print(f"⏱️  {case['size']:>9} | {case['method']:8} {case['max_side'] or '':>5} | "
+                  f"mask p50 {case['mask_latency']['p50_ms']:7.1f} ms | soft p50 {case['soft_latency']['p50_ms']:6.1f} ms | "
+                  f"MAE {case['mae']:.2f} IoU {case['iou']:.4f}")
+        with open(args.output, 'w') as f:
+            json.dump({'meta': _meta(args.format), 'mask_resolution': cases}, f, indent=2)
+        print(f"\n💾 Results saved to {args.output}")
+        return 0
+
+    if args.thread_sweep:
+        sweep = run_thread_sweep(
+            model_mode=args.model_modes[0],
+            size=parse_sizes(args.sizes)[0],
+            mode=args.modes[0],
+            iterations=args.iterations,
+            pin=args.pin,
+            image_format=args.format,
+            stub=args.stub
+        )
+        with open(args.output, 'w') as f:
+            json.dump(sweep, f, indent=2)
+        best = sweep['best']
+        print(f"\n🏆 Best: INFERENCE_WORKERS={best['workers']} "
+              f"INFERENCE_THREADS_PER_WORKER={best['threads_per_worker']}"
+              f"{' INFERENCE_CPU_AFFINITY=true' if best['pinned'] else ''} ({best['throughput_ips']:.2f} img/s)")
+        print(f"💾 Results saved to {args.output}")
+        return 0
+
+    results = run_benchmark(
+        model_modes=args.model_modes,
+        modes=args.modes,
+        sizes=parse_sizes(args.sizes),
+        iterations=args.iterations,
+        warmup=args.warmup,
+        concurrency=args.concurrency,
+        image_format=args.format,
+        stub=args.stub
+    )
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) against {args.compare}:")
+            for regression in regressions:
+                print(f"  • {regression}")
+            return 1
+        print(f"\n✅ No regressions against {args.compare}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
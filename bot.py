@@ -4,11 +4,16 @@ Telegram Bot for Background Removal using InSPyReNet
 import asyncio
 import logging
 import io
-from datetime import datetime, timedelta
+import math
+import signal
+import uuid
+import zipfile
+from contextlib import contextmanager
 from collections import defaultdict
-from typing import Dict, List
+from typing import Dict, Iterator, List, Optional
 
-from telegram import Update
+from telegram import InputMediaDocument, Message, Update
+from telegram.constants import ChatAction
 from telegram.ext import (
     Application, 
     CommandHandler, 
@@ -17,8 +22,26 @@ from telegram.ext import (
     ContextTypes
 )
 
+from animation import is_animated_image
 from config import Config, validate_config
-from image_processor import background_remover
+from image_processor import get_background_remover
+from job_journal import JobJournal
+from media_groups import MediaGroupBuffer
+from profiling import arm_profiling, profile_request
+from metrics import (
+    API_CALLS_PER_JOB,
+    COST_UNITS,
+    JOB_SECONDS,
+    JOBS_IN_FLIGHT,
+    MEGAPIXELS,
+    QUEUE_DEPTH,
+    QUOTA_REFUSALS,
+    start_metrics_server,
+    track_stage
+)
+from quotas import QuotaLedger, track_cost
+from telegram_request import TelegramRequest, count_api_calls
+from update_processor import ChatOrderedUpdateProcessor
 
 # Set up logging
 logging.basicConfig(
@@ -27,9 +50,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Rate limiting storage
-user_requests: Dict[int, List[datetime]] = defaultdict(list)
-
 # User settings storage
 user_settings: Dict[int, Dict] = defaultdict(lambda: {'mode': 'full', 'opacity': 100})
 
@@ -39,7 +59,28 @@ class BackgroundRemovalBot:
     def __init__(self):
         """Initialize the bot"""
         validate_config()
-        self.application = Application.builder().token(Config.BOT_TOKEN).build()
+        self.journal = None
+        if Config.JOB_JOURNAL_DIR:
+            self.journal = JobJournal(Config.JOB_JOURNAL_DIR, Config.JOB_JOURNAL_MAX_AGE_HOURS * 3600)
+        update_processor = ChatOrderedUpdateProcessor(Config.MAX_CONCURRENT_UPDATES, journal=self.journal)
+        self.application = (
+            Application.builder()
+            .token(Config.BOT_TOKEN)
+            .base_url(Config.TELEGRAM_API_BASE_URL)
+            .base_file_url(Config.TELEGRAM_API_FILE_URL)
+            .request(TelegramRequest())
+            # The updater retries getUpdates itself and needs only one connection
+            .get_updates_request(TelegramRequest(connection_pool_size=1, max_retries=0))
+            .concurrent_updates(update_processor)
+            .build()
+        )
+        QUEUE_DEPTH.labels(queue='updates').set_function(self.application.update_queue.qsize)
+        QUEUE_DEPTH.labels(queue='chat').set_function(lambda: update_processor.queued_updates)
+        QUEUE_DEPTH.labels(queue='memory').set_function(lambda: get_background_remover().memory_budget.waiting)
+        if Config.JOB_QUEUE_URL:
+            QUEUE_DEPTH.labels(queue='jobs').set_function(get_background_remover().queue.depth)
+        self.quotas = QuotaLedger(Config.USER_COST_BUDGET, Config.GLOBAL_COST_BUDGET, Config.QUOTA_WINDOW_SECONDS)
+        self.media_groups = MediaGroupBuffer(Config.MEDIA_GROUP_WAIT_SECONDS, self._process_media_group)
         self._setup_handlers()
     
     def _setup_handlers(self):
@@ -49,11 +90,19 @@ class BackgroundRemovalBot:
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("modes", self.modes_command))
         self.application.add_handler(CommandHandler("settings", self.settings_command))
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
+        self.application.add_handler(CommandHandler("usage", self.usage_command))
         
         # Message handlers
         self.application.add_handler(
             MessageHandler(filters.PHOTO, self.handle_photo)
         )
+        # Telegram sends a GIF file with both an animation and an image document, and
+        # PTB runs only the first matching handler of a group, so this one must come
+        # before the document handler or GIF documents would never reach it
+        self.application.add_handler(
+            MessageHandler(filters.ANIMATION | filters.VIDEO, self.handle_animation)
+        )
         self.application.add_handler(
             MessageHandler(filters.Document.IMAGE, self.handle_document)
         )
@@ -104,6 +153,59 @@ class BackgroundRemovalBot:
 
         await update.message.reply_text(settings_text, parse_mode='Markdown')
     
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /profile command (admins only): profile the next image jobs"""
+        if update.effective_user.id not in Config.ADMIN_USER_IDS:
+            await update.message.reply_text(Config.ERROR_MESSAGES['admin_only'])
+            return
+
+        try:
+            jobs = int(context.args[0]) if context.args else 1
+        except ValueError:
+            await update.message.reply_text("❌ Invalid count. Use: /profile 3")
+            return
+
+        arm_profiling(jobs)
+        await update.message.reply_text(
+            f"🔬 Profiling the next {jobs} image(s). Profiles are saved to {Config.PROFILE_DIR}/"
+        )
+
+    async def usage_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle /usage command (admins only): cost spent by the heaviest users, or by one user"""
+        if update.effective_user.id not in Config.ADMIN_USER_IDS:
+            await update.message.reply_text(Config.ERROR_MESSAGES['admin_only'])
+            return
+
+        try:
+            user_ids = [int(context.args[0])] if context.args else None
+        except ValueError:
+            await update.message.reply_text("❌ Invalid user id. Use: /usage 123456789")
+            return
+
+        window = round(Config.QUOTA_WINDOW_SECONDS / 60)
+        global_budget = f"{Config.GLOBAL_COST_BUDGET:.0f}" if Config.GLOBAL_COST_BUDGET > 0 else "unlimited"
+        lines = [
+            f"📊 Last {window} min: {self.quotas.spent():.1f} units spent (global budget: {global_budget}, "
+            f"per user: {Config.USER_COST_BUDGET:.0f})"
+        ]
+        if user_ids is None:
+            top_users = self.quotas.top_users()
+            user_ids = [user_id for user_id, _ in top_users]
+            lines.append("Top users:" if top_users else "No jobs in this window.")
+
+        for user_id in user_ids:
+            usage = self.quotas.usage.get(user_id)
+            if usage is None:
+                lines.append(f"• {user_id}: no jobs")
+                continue
+            lines.append(
+                f"• {user_id}: {self.quotas.spent(user_id):.1f} units now; total {usage.jobs} jobs, "
+                f"{usage.units:.1f} units, {usage.megapixels:.1f} MP, {usage.cpu_seconds:.1f} CPU s, "
+                f"{usage.refused} refused"
+            )
+
+        await update.message.reply_text("\n".join(lines))
+
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages and mode commands"""
         user_id = update.effective_user.id
@@ -160,61 +262,162 @@ class BackgroundRemovalBot:
     
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo messages (compressed images)"""
+        if update.message.media_group_id:
+            # Album items are handled together once the whole album has arrived
+            self._add_album_item(update)
+            return
+
         user_id = update.effective_user.id
         
-        # Check rate limiting
-        if not self._check_rate_limit(user_id):
-            await update.message.reply_text(Config.ERROR_MESSAGES['rate_limit'])
+        # Check the user's cost budget
+        refusal = self._check_quota(user_id)
+        if refusal:
+            await update.message.reply_text(refusal)
             return
         
-        try:
-            # Get the largest photo size
-            photo = update.message.photo[-1]
-            
-            # Download photo
-            file = await context.bot.get_file(photo.file_id)
-            image_bytes = await file.download_as_bytearray()
-            
-            await self._process_and_send_image(update, bytes(image_bytes))
-            
-        except Exception as e:
-            logger.error(f"Error handling photo: {e}")
-            await update.message.reply_text(Config.ERROR_MESSAGES['download_error'])
+        with self._track_job(user_id):
+            try:
+                # Get the largest photo size
+                photo = update.message.photo[-1]
+
+                # Download photo
+                with track_stage('download', cpu_profile=False):
+                    file = await context.bot.get_file(photo.file_id)
+                    image_bytes = await file.download_as_bytearray()
+
+                await self._process_and_send_image(update, bytes(image_bytes))
+
+            except Exception as e:
+                logger.error(f"Error handling photo: {e}")
+                await update.message.reply_text(Config.ERROR_MESSAGES['download_error'])
     
     async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle document messages (uncompressed images)"""
+        if update.message.media_group_id:
+            self._add_album_item(update)
+            return
+
         user_id = update.effective_user.id
         
-        # Check rate limiting
-        if not self._check_rate_limit(user_id):
-            await update.message.reply_text(Config.ERROR_MESSAGES['rate_limit'])
+        # Check the user's cost budget
+        refusal = self._check_quota(user_id)
+        if refusal:
+            await update.message.reply_text(refusal)
             return
         
+        with self._track_job(user_id):
+            try:
+                document = update.message.document
+
+                # Check file size
+                if document.file_size and document.file_size > Config.MAX_FILE_SIZE_BYTES:
+                    await update.message.reply_text(Config.ERROR_MESSAGES['file_too_large'])
+                    return
+
+                # Download document
+                with track_stage('download', cpu_profile=False):
+                    file = await context.bot.get_file(document.file_id)
+                    image_bytes = await file.download_as_bytearray()
+
+                await self._process_and_send_image(update, bytes(image_bytes))
+
+            except Exception as e:
+                logger.error(f"Error handling document: {e}")
+                await update.message.reply_text(Config.ERROR_MESSAGES['download_error'])
+    
+    async def handle_animation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle GIF animations and short videos"""
+        user_id = update.effective_user.id
+
+        # Check the user's cost budget
+        refusal = self._check_quota(user_id)
+        if refusal:
+            await update.message.reply_text(refusal)
+            return
+
+        with self._track_job(user_id):
+            try:
+                media = update.message.animation or update.message.video
+
+                # Check file size
+                if media.file_size and media.file_size > Config.MAX_FILE_SIZE_BYTES:
+                    await update.message.reply_text(Config.ERROR_MESSAGES['file_too_large'])
+                    return
+
+                # Download animation
+                with track_stage('download', cpu_profile=False):
+                    file = await context.bot.get_file(media.file_id)
+                    data = await file.download_as_bytearray()
+
+                await self._process_and_send_animation(update, bytes(data))
+
+            except Exception as e:
+                logger.error(f"Error handling animation: {e}")
+                await update.message.reply_text(Config.ERROR_MESSAGES['download_error'])
+
+    async def _process_and_send_animation(self, update: Update, data: bytes):
+        """Process an animation frame by frame and send the animated PNG back"""
         try:
-            document = update.message.document
-            
-            # Check file size
-            if document.file_size > Config.MAX_FILE_SIZE_BYTES:
-                await update.message.reply_text(Config.ERROR_MESSAGES['file_too_large'])
+            user_id = update.effective_user.id
+
+            with track_stage('validate'):
+                is_valid, error_message = get_background_remover().validate_animation(data)
+            if not is_valid:
+                await update.message.reply_text(error_message)
+                return
+
+            mode = user_settings[user_id]['mode']
+            opacity = user_settings[user_id]['opacity']
+
+            # Animations always take a while, so they get a status message in auto mode
+            status_mode = 'message' if Config.STATUS_MESSAGE_MODE == 'auto' else None
+            processing_msg = await self._send_processing_status(update, data, mode, status_mode=status_mode)
+
+            try:
+                processed_bytes = await asyncio.wait_for(
+                    get_background_remover().process_animation(data, mode=mode, opacity=opacity),
+                    timeout=Config.PROCESSING_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                await self._reply_error(update, processing_msg, Config.ERROR_MESSAGES['timeout'])
                 return
-            
-            # Download document
-            file = await context.bot.get_file(document.file_id)
-            image_bytes = await file.download_as_bytearray()
-            
-            await self._process_and_send_image(update, bytes(image_bytes))
-            
+
+            if processed_bytes is None:
+                await self._reply_error(update, processing_msg, Config.ERROR_MESSAGES['processing_error'])
+                return
+
+            caption = f"✅ Transparency applied with **{mode}** mode to your animation! 🎞️"
+            if mode == 'custom':
+                caption += f"\nOpacity: {opacity}%"
+
+            with track_stage('upload', cpu_profile=False):
+                await update.message.reply_document(
+                    document=io.BytesIO(processed_bytes),
+                    filename=f"transparent_{mode}.png",
+                    caption=caption,
+                    parse_mode='Markdown'
+                )
+
+            if processing_msg is not None:
+                await processing_msg.delete()
+
         except Exception as e:
-            logger.error(f"Error handling document: {e}")
-            await update.message.reply_text(Config.ERROR_MESSAGES['download_error'])
-    
+            logger.error(f"Error processing animation: {e}")
+            await update.message.reply_text(Config.ERROR_MESSAGES['general_error'])
+
     async def _process_and_send_image(self, update: Update, image_bytes: bytes):
         """Process image and send result back to user"""
         try:
             user_id = update.effective_user.id
 
+            # Animated GIF/WebP documents go through the frame pipeline
+            if is_animated_image(image_bytes):
+                await self._process_and_send_animation(update, image_bytes)
+                return
+
             # Validate image
-            is_valid, error_message = background_remover.validate_image(image_bytes)
+            with track_stage('validate'):
+                is_valid, error_message = get_background_remover().validate_image(image_bytes)
             if not is_valid:
                 await update.message.reply_text(error_message)
                 return
@@ -223,22 +426,47 @@ class BackgroundRemovalBot:
             mode = user_settings[user_id]['mode']
             opacity = user_settings[user_id]['opacity']
 
-            # Send processing message with mode info
-            processing_text = f"🔄 Processing with **{mode}** mode...\n{Config.PROCESSING_MESSAGE}"
-            processing_msg = await update.message.reply_text(processing_text, parse_mode='Markdown')
+            # Start the full-resolution job; a preview (if wanted) is queued ahead of it
+            preview = self._wants_preview(image_bytes)
+            preview_task = None
+            if preview:
+                preview_task = asyncio.ensure_future(asyncio.wait_for(
+                    get_background_remover().process_image(
+                        image_bytes, mode=mode, opacity=opacity, preview_side=Config.PREVIEW_MAX_SIDE
+                    ),
+                    timeout=Config.PROCESSING_TIMEOUT_SECONDS
+                ))
+            full_task = asyncio.ensure_future(asyncio.wait_for(
+                get_background_remover().process_image(image_bytes, mode=mode, opacity=opacity),
+                timeout=Config.PROCESSING_TIMEOUT_SECONDS
+            ))
 
-            # Process image with timeout and user settings
             try:
-                processed_bytes = await asyncio.wait_for(
-                    background_remover.process_image(image_bytes, mode=mode, opacity=opacity),
-                    timeout=Config.PROCESSING_TIMEOUT_SECONDS
+                # Let the user know the image is being processed; the preview itself is the
+                # feedback in progressive mode, so only a chat action is sent then
+                processing_msg = await self._send_processing_status(
+                    update, image_bytes, mode, status_mode='chat_action' if preview else None
                 )
-            except asyncio.TimeoutError:
-                await processing_msg.edit_text(Config.ERROR_MESSAGES['timeout'])
-                return
+                preview_msg = await self._send_preview(update, preview_task, mode) if preview_task else None
+
+                # Wait for the full result with timeout and user settings
+                try:
+                    processed_bytes = await full_task
+                    error = Config.ERROR_MESSAGES['processing_error']
+                except asyncio.TimeoutError:
+                    processed_bytes, error = None, Config.ERROR_MESSAGES['timeout']
+            finally:
+                # Nobody waits for the jobs any more if sending the status or preview failed
+                for task in (preview_task, full_task):
+                    if task is not None:
+                        task.cancel()
 
             if processed_bytes is None:
-                await processing_msg.edit_text(Config.ERROR_MESSAGES['processing_error'])
+                if preview_msg is not None:
+                    # The preview stays, but must not pass for the result still to come
+                    await preview_msg.edit_caption(error)
+                else:
+                    await self._reply_error(update, processing_msg, error)
                 return
 
             # Create caption with mode info
@@ -246,58 +474,343 @@ class BackgroundRemovalBot:
             if mode == 'custom':
                 caption += f"\nOpacity: {opacity}%"
 
-            # Send processed image
+            # Send processed image, replacing the preview if there is one
+            with track_stage('upload', cpu_profile=False):
+                if preview_msg is not None:
+                    await preview_msg.edit_media(InputMediaDocument(
+                        media=io.BytesIO(processed_bytes),
+                        filename=f"transparent_{mode}.png",
+                        caption=caption,
+                        parse_mode='Markdown'
+                    ))
+                else:
+                    await update.message.reply_document(
+                        document=io.BytesIO(processed_bytes),
+                        filename=f"transparent_{mode}.png",
+                        caption=caption,
+                        parse_mode='Markdown'
+                    )
+
+            # Delete processing message
+            if processing_msg is not None:
+                await processing_msg.delete()
+
+        except Exception as e:
+            logger.error(f"Error processing image: {e}")
+            await update.message.reply_text(Config.ERROR_MESSAGES['general_error'])
+
+    def _add_album_item(self, update: Update):
+        """Buffer an album item; its journal entry is completed by the album job"""
+        if self.journal is not None:
+            self.journal.hold(update.update_id)
+        self.media_groups.add(update)
+
+    async def _process_media_group(self, updates: List[Update]):
+        """Process a complete album in order with its chat's other updates, then remove it from the journal"""
+        try:
+            # Like single images, so a user's next job is only checked after the album was charged
+            await self.application.update_processor.run_in_chat(updates[0], self._process_album(updates))
+        except Exception as e:
+            logger.error(f"Error processing album: {e}")
+        # Not reached when cancelled at shutdown, so the album is replayed
+        if self.journal is not None:
+            for update in updates:
+                self.journal.complete(update.update_id)
+
+    async def _process_album(self, updates: List[Update]):
+        """Process an album as one job and answer with a single media group"""
+        first = updates[0]
+        user_id = first.effective_user.id
+
+        # One quota check, status message and reply for the whole album
+        refusal = self._check_quota(user_id)
+        if refusal:
+            await first.message.reply_text(refusal)
+            return
+
+        with self._track_job(user_id):
+            mode = user_settings[user_id]['mode']
+            opacity = user_settings[user_id]['opacity']
+            status_mode = 'message' if Config.STATUS_MESSAGE_MODE == 'auto' else None
+            processing_msg = await self._send_processing_status(first, b'', mode, status_mode=status_mode)
+
+            with track_stage('download', cpu_profile=False):
+                downloads = await asyncio.gather(
+                    *(self._download_image(update) for update in updates), return_exceptions=True
+                )
+
+            # Images left out are reported with the reason, by their position in the album
+            images = {}
+            skipped: Dict[int, str] = {}
+            for index, image_bytes in enumerate(downloads, 1):
+                if isinstance(image_bytes, Exception):
+                    logger.error(f"Error downloading album item: {image_bytes}")
+                    skipped[index] = Config.ERROR_MESSAGES['download_error']
+                    continue
+                with track_stage('validate'):
+                    is_valid, error_message = get_background_remover().validate_image(image_bytes)
+                if is_valid:
+                    images[index] = image_bytes
+                else:
+                    skipped[index] = error_message
+
+            # The images run through the inference pool side by side
+            outcomes = await asyncio.gather(*(
+                asyncio.wait_for(
+                    get_background_remover().process_image(image_bytes, mode=mode, opacity=opacity),
+                    timeout=Config.PROCESSING_TIMEOUT_SECONDS
+                )
+                for image_bytes in images.values()
+            ), return_exceptions=True)
+            results = []
+            for index, outcome in zip(images, outcomes):
+                if isinstance(outcome, bytes):
+                    results.append(outcome)
+                elif isinstance(outcome, asyncio.TimeoutError):
+                    skipped[index] = Config.ERROR_MESSAGES['timeout']
+                else:
+                    skipped[index] = Config.ERROR_MESSAGES['processing_error']
+
+            skipped_note = ""
+            if skipped:
+                skipped_note = f"\n⚠️ {len(skipped)} image(s) skipped:" + "".join(
+                    f"\nImage {index}: {skipped[index].replace('❌ ', '')}" for index in sorted(skipped)
+                )
+
+            if not results:
+                await self._reply_error(
+                    first, processing_msg, Config.ERROR_MESSAGES['processing_error'] + skipped_note
+                )
+                return
+
+            caption = f"✅ Transparency applied with **{mode}** mode to {len(results)} images! 🎨"
+            if mode == 'custom':
+                caption += f"\nOpacity: {opacity}%"
+            caption += skipped_note
+
+            with track_stage('upload', cpu_profile=False):
+                await self._send_album_results(first, results, mode, caption)
+
+            if processing_msg is not None:
+                await processing_msg.delete()
+
+    async def _download_image(self, update: Update) -> bytes:
+        """Download the photo or image document of a message"""
+        if update.message.photo:
+            file_id = update.message.photo[-1].file_id
+        else:
+            document = update.message.document
+            if document.file_size and document.file_size > Config.MAX_FILE_SIZE_BYTES:
+                raise ValueError(f"document of {document.file_size} bytes is too large")
+            file_id = document.file_id
+
+        file = await self.application.bot.get_file(file_id)
+        return bytes(await file.download_as_bytearray())
+
+    async def _send_album_results(self, update: Update, results: List[bytes], mode: str, caption: str):
+        """Reply with all results of an album at once, as a media group or a zip archive"""
+        if len(results) == 1:
             await update.message.reply_document(
-                document=io.BytesIO(processed_bytes),
+                document=io.BytesIO(results[0]),
                 filename=f"transparent_{mode}.png",
                 caption=caption,
                 parse_mode='Markdown'
             )
+        elif Config.ALBUM_REPLY == 'zip':
+            archive = io.BytesIO()
+            # PNGs are already compressed
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zip_file:
+                for index, result in enumerate(results, 1):
+                    zip_file.writestr(f"transparent_{mode}_{index}.png", result)
+            await update.message.reply_document(
+                document=archive.getvalue(),
+                filename=f"transparent_{mode}.zip",
+                caption=caption,
+                parse_mode='Markdown'
+            )
+        else:
+            await update.message.reply_media_group(
+                media=[
+                    InputMediaDocument(media=io.BytesIO(result), filename=f"transparent_{mode}_{index}.png")
+                    for index, result in enumerate(results, 1)
+                ],
+                caption=caption,
+                parse_mode='Markdown'
+            )
 
-            # Delete processing message
-            await processing_msg.delete()
+    def _wants_preview(self, image_bytes: bytes) -> bool:
+        """Whether an image is large enough to get a quick preview before the full result"""
+        if not Config.PROGRESSIVE_PREVIEW:
+            return False
+        width, height = get_background_remover().get_image_size(image_bytes)
+        return width * height >= Config.PREVIEW_MIN_MEGAPIXELS * 1_000_000
 
+    async def _send_preview(self, update: Update, preview_task: asyncio.Future, mode: str) -> Optional[Message]:
+        """
+        Send the downscaled preview once it is ready
+
+        Returns:
+            The preview message, to be replaced by the full result, or None if
+            the preview failed (the full result is then sent as a new message)
+        """
+        try:
+            preview_bytes = await preview_task
+            if preview_bytes is None:
+                return None
+            with track_stage('upload', cpu_profile=False):
+                return await update.message.reply_document(
+                    document=io.BytesIO(preview_bytes),
+                    filename=f"preview_{mode}.png",
+                    caption=Config.PREVIEW_CAPTION
+                )
         except Exception as e:
-            logger.error(f"Error processing image: {e}")
-            await update.message.reply_text(Config.ERROR_MESSAGES['general_error'])
-    
-    def _check_rate_limit(self, user_id: int) -> bool:
-        """Check if user is within rate limits"""
-        now = datetime.now()
-        minute_ago = now - timedelta(minutes=1)
-        
-        # Clean old requests
-        user_requests[user_id] = [
-            req_time for req_time in user_requests[user_id] 
-            if req_time > minute_ago
-        ]
-        
-        # Check if under limit
-        if len(user_requests[user_id]) >= Config.MAX_REQUESTS_PER_USER_PER_MINUTE:
-            return False
-        
-        # Add current request
-        user_requests[user_id].append(now)
-        return True
+            logger.warning(f"Could not send preview: {e}")
+            return None
+
+    async def _send_processing_status(self, update: Update, image_bytes: bytes, mode: str,
+                                      status_mode: Optional[str] = None) -> Optional[Message]:
+        """
+        Show that the image is being processed
+
+        A status message costs two API calls (send and delete), a chat action
+        only one, so the message is reserved for jobs expected to take a while.
+
+        Args:
+            status_mode: Overrides Config.STATUS_MESSAGE_MODE
+
+        Returns:
+            The status message to edit or delete later, or None if no message was sent
+        """
+        status_mode = status_mode or Config.STATUS_MESSAGE_MODE
+        if status_mode == 'auto':
+            width, height = get_background_remover().get_image_size(image_bytes)
+            is_fast_job = width * height <= Config.FAST_JOB_MAX_MEGAPIXELS * 1_000_000
+            status_mode = 'chat_action' if is_fast_job else 'message'
+
+        if status_mode == 'message':
+            processing_text = f"🔄 Processing with **{mode}** mode...\n{Config.PROCESSING_MESSAGE}"
+            return await update.message.reply_text(processing_text, parse_mode='Markdown')
+
+        if status_mode == 'chat_action':
+            await update.message.reply_chat_action(ChatAction.UPLOAD_DOCUMENT)
+
+        return None
+
+    async def _reply_error(self, update: Update, processing_msg: Optional[Message], text: str):
+        """Report an error in the status message if there is one, otherwise as a reply"""
+        if processing_msg is not None:
+            await processing_msg.edit_text(text)
+        else:
+            await update.message.reply_text(text)
+
+    @contextmanager
+    def _track_job(self, user_id: int) -> Iterator[str]:
+        """
+        Measure one image job (latency, API calls, cost, optional profile) and yield its request id
+
+        The job's cost is charged to the user's quota even if it failed, the work was done anyway.
+        """
+        request_id = uuid.uuid4().hex[:12]
+        with track_cost() as cost:
+            try:
+                with count_api_calls() as api_calls, JOBS_IN_FLIGHT.track_inprogress(), JOB_SECONDS.time(), \
+                        profile_request(request_id):
+                    yield request_id
+            finally:
+                units = self.quotas.charge(user_id, cost)
+                COST_UNITS.inc(units)
+                MEGAPIXELS.inc(cost.megapixels)
+
+        API_CALLS_PER_JOB.observe(api_calls.count)
+        logger.info(
+            f"Request {request_id} from user {user_id} used {api_calls.count} API calls, "
+            f"{cost.megapixels:.1f} MP and {cost.total_cpu_seconds:.1f} CPU s ({units:.1f} units)"
+        )
     
-    async def run(self):
-        """Start the bot"""
+    def _check_quota(self, user_id: int) -> Optional[str]:
+        """Check the user's and the global cost budget, returning the refusal message if one is spent"""
+        scope, retry_after = self.quotas.check(user_id)
+        if scope is None:
+            return None
+
+        QUOTA_REFUSALS.labels(scope=scope).inc()
+        logger.info(f"Refused a job of user {user_id}: {scope} budget spent, room again in {retry_after:.0f}s")
+        message = 'capacity' if scope == 'global' else 'rate_limit'
+        return Config.ERROR_MESSAGES[message].format(minutes=max(1, math.ceil(retry_after / 60)))
+
+    async def start(self):
+        """Connect to Telegram and start handling updates"""
         logger.info("Starting Background Removal Bot...")
+        start_metrics_server()
         await self.application.initialize()
         await self.application.start()
+        if self.journal is not None:
+            await self._replay_journal()
         await self.application.updater.start_polling()
+
+    async def _replay_journal(self):
+        """Queue the jobs the previous run left unfinished, ahead of new updates"""
+        updates = self.journal.replay()
+        if updates:
+            logger.info(f"Replaying {len(updates)} unfinished job(s) from the journal")
+        for data in updates:
+            await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+    async def stop(self):
+        """
+        Drain and shut down
+
+        Polling stops first, so no new updates are accepted. Updates already
+        received get Config.DRAIN_TIMEOUT_SECONDS to finish; whatever is still
+        running then stays in the journal and is replayed on the next start.
+        """
+        await self.application.updater.stop()
+        drained = True
+        try:
+            await asyncio.wait_for(self._drain(), timeout=Config.DRAIN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            drained = False
+            # Abandoned jobs must not reply with errors once the connection is closed
+            self.application.update_processor.cancel()
+            self.media_groups.cancel()
+            if self.journal is not None:
+                self.journal.close()
+                logger.warning(
+                    f"Drain deadline of {Config.DRAIN_TIMEOUT_SECONDS}s passed, "
+                    f"{len(self.journal)} job(s) will be replayed on the next start"
+                )
+            else:
+                logger.warning(f"Drain deadline of {Config.DRAIN_TIMEOUT_SECONDS}s passed, dropping unfinished jobs")
+        await self.application.shutdown()
+        if get_background_remover().worker_pool is not None:
+            # Jobs still running after the deadline are replayed, so don't wait for them.
+            # Waiting joins the worker processes, which must not block the event loop.
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, get_background_remover().worker_pool.shutdown, drained)
+
+    async def _drain(self):
+        """Finish every received update, including albums still being collected"""
+        # Application.stop handles the queued updates and waits for the running handlers
+        await asyncio.gather(self.media_groups.flush(), self.application.stop())
+        # Album items among those updates started new groups after the first flush
+        await self.media_groups.flush()
+
+    async def run(self):
+        """Start the bot"""
+        await self.start()
         
         logger.info("Bot is running! Press Ctrl+C to stop.")
         
-        # Keep running until interrupted
+        # Keep running until interrupted; deploys send SIGTERM, both drain the bot
+        stop_requested = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop_requested.set)
         try:
-            await asyncio.Event().wait()
-        except KeyboardInterrupt:
+            await stop_requested.wait()
             logger.info("Stopping bot...")
         finally:
-            await self.application.updater.stop()
-            await self.application.stop()
-            await self.application.shutdown()
+            await self.stop()
 
 async def main():
     """Main function to run the bot"""
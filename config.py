@@ -16,6 +16,7 @@ class Config:
     # File Processing Settings
     MAX_FILE_SIZE_MB = 20  # Maximum file size in MB
     MAX_FILE_SIZE_BYTES = MAX_FILE_SIZE_MB * 1024 * 1024
+    MAX_IMAGE_DIMENSION = int(os.getenv('MAX_IMAGE_DIMENSION', '12288'))  # Longest allowed side in pixels
     
     # Supported image formats
     SUPPORTED_FORMATS = ['.jpg', '.jpeg', '.png', '.webp']
@@ -25,6 +26,54 @@ class Config:
     USE_JIT = True  # Enable TorchScript for better performance
     RESIZE_MODE = 'static'  # Options: 'static', 'dynamic'
 
+    # Adaptive model selection: load several variants (e.g. 'base,fast') and pick one per
+    # request. Large images and idle periods get the best variant, under load a faster one
+    # is used when the best would miss the latency target.
+    MODEL_VARIANTS = [variant.strip() for variant in os.getenv('MODEL_VARIANTS', MODEL_MODE).split(',') if variant.strip()]
+    ADAPTIVE_LATENCY_TARGET_SECONDS = float(os.getenv('ADAPTIVE_LATENCY_TARGET_SECONDS', '10'))
+    ADAPTIVE_LARGE_IMAGE_MEGAPIXELS = float(os.getenv('ADAPTIVE_LARGE_IMAGE_MEGAPIXELS', '4'))
+
+    # Inference worker threads and torch/BLAS threads per worker (0 = auto: about one
+    # worker per 4 cores, cores split evenly). Optionally pin each worker to its own cores.
+    INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '0'))
+    INFERENCE_THREADS_PER_WORKER = int(os.getenv('INFERENCE_THREADS_PER_WORKER', '0'))
+    INFERENCE_CPU_AFFINITY = os.getenv('INFERENCE_CPU_AFFINITY', 'false').lower() == 'true'
+
+    # Memory budget: jobs only start while the estimated memory of all running jobs fits
+    # (0 = half of the container/machine memory, -1 = no limit). A job is estimated at
+    # JOB_BYTES_PER_PIXEL per image pixel plus INFERENCE_MEMORY_MB of model activations.
+    MEMORY_BUDGET_MB = int(os.getenv('MEMORY_BUDGET_MB', '0'))
+    JOB_BYTES_PER_PIXEL = int(os.getenv('JOB_BYTES_PER_PIXEL', '24'))
+    INFERENCE_MEMORY_MB = int(os.getenv('INFERENCE_MEMORY_MB', '512'))
+    # Run inference in this many worker processes instead of threads (0 = threads). Workers
+    # are restarted after WORKER_MAX_JOBS jobs and replaced above WORKER_MAX_RSS_MB (0 = never).
+    INFERENCE_PROCESSES = int(os.getenv('INFERENCE_PROCESSES', '0'))
+    WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', '200'))
+    WORKER_MAX_RSS_MB = int(os.getenv('WORKER_MAX_RSS_MB', '0'))
+
+    # Inference backend: 'torch' (transparent_background) or 'onnx' (ONNX Runtime, CPU).
+    # ONNX models are exported to ONNX_MODEL_DIR on first use.
+    INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch').lower()
+    ONNX_MODEL_DIR = os.getenv('ONNX_MODEL_DIR', 'models')
+    ONNX_QUANTIZE = os.getenv('ONNX_QUANTIZE', 'false').lower() == 'true'
+    ONNX_INTRA_OP_THREADS = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))  # 0 = ONNX Runtime default
+    ONNX_INTER_OP_THREADS = int(os.getenv('ONNX_INTER_OP_THREADS', '0'))
+    # Low-resolution masks: run the model with the longest side scaled down to this many pixels
+    # (0 = full resolution) and upsample the mask with a guided filter ('guided') or plainly
+    # ('bilinear'). Soft-mode feathering is then also done at the low resolution.
+    MASK_INFERENCE_MAX_SIDE = int(os.getenv('MASK_INFERENCE_MAX_SIDE', '0'))
+    MASK_UPSAMPLE_METHOD = os.getenv('MASK_UPSAMPLE_METHOD', 'guided').lower()
+    GUIDED_FILTER_RADIUS = int(os.getenv('GUIDED_FILTER_RADIUS', '2'))
+    GUIDED_FILTER_EPS = float(os.getenv('GUIDED_FILTER_EPS', '1e-4'))
+    # Tiled processing: images of at least TILED_MIN_MEGAPIXELS (0 = never) get their mask at
+    # TILED_MASK_MAX_SIDE and are composited and PNG-encoded TILED_STRIP_ROWS rows at a time
+    TILED_MIN_MEGAPIXELS = float(os.getenv('TILED_MIN_MEGAPIXELS', '20'))
+    TILED_MASK_MAX_SIDE = int(os.getenv('TILED_MASK_MAX_SIDE', '2048'))
+    TILED_STRIP_ROWS = int(os.getenv('TILED_STRIP_ROWS', '256'))
+    # Masks of recently processed images kept in memory (0 disables the cache). Each mask takes
+    # one byte per pixel outside MEMORY_BUDGET_MB, so the cache is opt-in.
+    MASK_CACHE_SIZE = int(os.getenv('MASK_CACHE_SIZE', '0'))
+
     # Transparency Options
     TRANSPARENCY_MODES = {
         'full': 'Complete background removal (transparent)',
@@ -34,11 +83,91 @@ class Config:
         'custom': 'Custom opacity level'
     }
     
-    # Rate Limiting Settings
-    MAX_REQUESTS_PER_USER_PER_MINUTE = 5
+    # Cost-based quotas: a job costs COST_PER_JOB units, plus COST_PER_MEGAPIXEL per megapixel and
+    # one unit per CPU-second of processing. Each user may spend USER_COST_BUDGET units per
+    # QUOTA_WINDOW_SECONDS, all users together GLOBAL_COST_BUDGET (0 = unlimited).
+    COST_PER_JOB = float(os.getenv('COST_PER_JOB', '2'))
+    COST_PER_MEGAPIXEL = float(os.getenv('COST_PER_MEGAPIXEL', '1'))
+    QUOTA_WINDOW_SECONDS = float(os.getenv('QUOTA_WINDOW_SECONDS', '600'))
+    USER_COST_BUDGET = float(os.getenv('USER_COST_BUDGET', '600'))
+    GLOBAL_COST_BUDGET = float(os.getenv('GLOBAL_COST_BUDGET', '0'))
     
     # Processing Settings
     PROCESSING_TIMEOUT_SECONDS = 60
+
+    # Shutdown Settings
+    # On SIGTERM the bot stops fetching updates and gives received ones this long to finish.
+    # Unfinished jobs stay in the journal and are replayed on the next start ('' disables it).
+    DRAIN_TIMEOUT_SECONDS = float(os.getenv('DRAIN_TIMEOUT_SECONDS', '25'))
+    JOB_JOURNAL_DIR = os.getenv('JOB_JOURNAL_DIR', 'journal')
+    JOB_JOURNAL_MAX_AGE_HOURS = float(os.getenv('JOB_JOURNAL_MAX_AGE_HOURS', '24'))
+
+    # Split Deployment
+    # With a job queue, the bot only talks to Telegram and `python worker.py` processes run the
+    # model: 'sqlite:///path/jobs.db' for workers on the same host, 'redis://host:6379/0' for
+    # workers on other hosts. Workers renew the lease of running jobs every third of it, so a
+    # job whose worker died is retried after the lease, well before PROCESSING_TIMEOUT_SECONDS.
+    JOB_QUEUE_URL = os.getenv('JOB_QUEUE_URL', '')
+    JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '20'))
+    JOB_RESULT_TTL_SECONDS = float(os.getenv('JOB_RESULT_TTL_SECONDS', '3600'))
+    JOB_QUEUE_POLL_SECONDS = float(os.getenv('JOB_QUEUE_POLL_SECONDS', '0.05'))
+
+    # Concurrency Settings
+    # Updates from different chats run in parallel, updates from one chat in order
+    MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '8'))
+
+    # Telegram API Client Settings
+    # Bot API endpoints; point these at a local Bot API server or the load-test fake
+    TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
+    TELEGRAM_API_FILE_URL = os.getenv('TELEGRAM_API_FILE_URL', 'https://api.telegram.org/file/bot')
+    TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '64'))
+    TELEGRAM_KEEPALIVE_SECONDS = float(os.getenv('TELEGRAM_KEEPALIVE_SECONDS', '30'))
+    TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+    TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '10'))
+    TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', '10'))
+    TELEGRAM_MEDIA_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_MEDIA_WRITE_TIMEOUT', '60'))
+    TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '5'))
+    TELEGRAM_MAX_RETRIES = int(os.getenv('TELEGRAM_MAX_RETRIES', '3'))
+    TELEGRAM_RETRY_BACKOFF_SECONDS = float(os.getenv('TELEGRAM_RETRY_BACKOFF_SECONDS', '0.5'))
+    # Flood-control waits longer than this are not retried
+    TELEGRAM_MAX_RETRY_AFTER_SECONDS = int(os.getenv('TELEGRAM_MAX_RETRY_AFTER_SECONDS', '30'))
+
+    # Status Feedback Settings
+    # 'message': status message (2 API calls), 'chat_action': "sending file..." indicator (1 call),
+    # 'none': no feedback (0 calls), 'auto': chat action for small images, message for large ones
+    STATUS_MESSAGE_MODE = os.getenv('STATUS_MESSAGE_MODE', 'auto')
+    FAST_JOB_MAX_MEGAPIXELS = float(os.getenv('FAST_JOB_MAX_MEGAPIXELS', '1.0'))
+
+    # Animation Settings (GIF, animated WebP, short MP4 clips)
+    # The model runs on every Nth frame, or earlier when the mean difference of a frame to
+    # the last keyframe (0-1) exceeds the scene-change threshold; other frames reuse its mask
+    ANIMATION_MAX_FRAMES = int(os.getenv('ANIMATION_MAX_FRAMES', '300'))
+    ANIMATION_MAX_SIDE = int(os.getenv('ANIMATION_MAX_SIDE', '720'))  # 0 keeps the frame size
+    ANIMATION_KEYFRAME_INTERVAL = int(os.getenv('ANIMATION_KEYFRAME_INTERVAL', '12'))
+    ANIMATION_SCENE_CHANGE_THRESHOLD = float(os.getenv('ANIMATION_SCENE_CHANGE_THRESHOLD', '0.08'))
+
+    # Album Settings
+    # Album images are collected until none arrived for this long, then processed as one job
+    MEDIA_GROUP_WAIT_SECONDS = float(os.getenv('MEDIA_GROUP_WAIT_SECONDS', '1.0'))
+    ALBUM_REPLY = os.getenv('ALBUM_REPLY', 'media_group')  # 'media_group' or 'zip'
+
+    # Progressive Delivery Settings
+    # Images of at least PREVIEW_MIN_MEGAPIXELS first get a small preview from the fastest
+    # loaded model variant (add 'fast' to MODEL_VARIANTS); the full result replaces it
+    PROGRESSIVE_PREVIEW = os.getenv('PROGRESSIVE_PREVIEW', 'false').lower() == 'true'
+    PREVIEW_MIN_MEGAPIXELS = float(os.getenv('PREVIEW_MIN_MEGAPIXELS', '2.0'))
+    PREVIEW_MAX_SIDE = int(os.getenv('PREVIEW_MAX_SIDE', '512'))
+
+    # Metrics Settings
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))  # 0 disables the metrics endpoint
+
+    # Profiling Settings
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # Fraction of jobs to profile
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    PROFILE_TORCH = os.getenv('PROFILE_TORCH', 'false').lower() == 'true'  # Also run the torch profiler
+
+    # Admin users (comma-separated Telegram user ids) allowed to use admin commands
+    ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()]
     
     # Messages
     WELCOME_MESSAGE = """
@@ -91,7 +220,7 @@ Type /help for more options and /modes to see all transparency effects.
 **Limitations:**
 • Maximum file size: {max_size}MB
 • Processing time: 10-60 seconds
-• Rate limit: {rate_limit} images per minute
+• Fair use: {budget} processing units every {window} minutes; an image costs {job_cost:g} units, plus {megapixel_cost:g} per megapixel and 1 per second of processing
 
 **✨ Pro Tips:**
 • High-quality images = better results
@@ -99,7 +228,10 @@ Type /help for more options and /modes to see all transparency effects.
 • Try different modes for creative effects
 
 **Powered by InSPyReNet AI Model**
-    """.format(max_size=MAX_FILE_SIZE_MB, rate_limit=MAX_REQUESTS_PER_USER_PER_MINUTE)
+    """.format(
+        max_size=MAX_FILE_SIZE_MB, window=round(QUOTA_WINDOW_SECONDS / 60), budget=round(USER_COST_BUDGET),
+        job_cost=COST_PER_JOB, megapixel_cost=COST_PER_MEGAPIXEL
+    )
     
     MODES_MESSAGE = """
 🎨 **Transparency Modes Available:**
@@ -136,16 +268,20 @@ Type /help for more options and /modes to see all transparency effects.
     """
 
     PROCESSING_MESSAGE = "🔄 Processing your image... This may take 10-60 seconds depending on image size."
+    PREVIEW_CAPTION = "👀 Quick preview, the full-resolution result will replace it shortly..."
     
     ERROR_MESSAGES = {
         'no_token': '❌ Bot token not found. Please set BOT_TOKEN environment variable.',
         'file_too_large': f'❌ File too large! Maximum size is {MAX_FILE_SIZE_MB}MB.',
         'unsupported_format': f'❌ Unsupported format! Please send: {", ".join(SUPPORTED_FORMATS)}',
         'processing_error': '❌ Error processing image. Please try again with a different image.',
-        'rate_limit': f'❌ Too many requests! Please wait before sending another image. Limit: {MAX_REQUESTS_PER_USER_PER_MINUTE} per minute.',
+        'rate_limit': '❌ You have used up your processing budget for now. Please try again in {minutes} minute(s).',
+        'capacity': '❌ The bot is at capacity right now. Please try again in {minutes} minute(s).',
         'timeout': '❌ Processing timeout. Please try with a smaller image.',
         'download_error': '❌ Failed to download image. Please try again.',
-        'general_error': '❌ An unexpected error occurred. Please try again later.'
+        'general_error': '❌ An unexpected error occurred. Please try again later.',
+        'admin_only': '❌ This command is only available to admins.',
+        'animation_too_long': f'❌ Animation too long! Maximum is {ANIMATION_MAX_FRAMES} frames.'
     }
 
 # Validate configuration
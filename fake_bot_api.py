@@ -0,0 +1,241 @@
+"""
+Local fake of the Telegram Bot API for offline load testing
+
+Serves getUpdates / getFile / file downloads from an in-memory queue of
+updates and records everything the bot sends back (sendDocument,
+sendMessage, editMessageText, ...), so that BackgroundRemovalBot can be
+driven with synthetic traffic without touching real Telegram.
+
+Point the bot at it with TELEGRAM_API_BASE_URL=<server.base_url> and
+TELEGRAM_API_FILE_URL=<server.base_file_url>.
+"""
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1000, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_bot'}
+
+
+@dataclass
+class SentRequest:
+    """A call the bot made to the fake API"""
+    method: str
+    params: Dict[str, str]
+    timestamp: float
+    files: Dict[str, bytes] = field(default_factory=dict)
+
+    @property
+    def chat_id(self) -> Optional[int]:
+        chat_id = self.params.get('chat_id')
+        return int(chat_id) if chat_id is not None else None
+
+
+class FakeBotApi:
+    """In-memory Bot API state behind a threaded HTTP server"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, poll_timeout: float = 1.0):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port to listen on, 0 picks a free one
+            poll_timeout: Longest time getUpdates blocks, whatever the bot asks for.
+                Kept short so the bot stops quickly.
+        """
+        self.poll_timeout = poll_timeout
+        self.requests: List[SentRequest] = []
+        self.on_request: Optional[Callable[[SentRequest], None]] = None
+
+        self._updates: List[dict] = []
+        self._files: Dict[str, bytes] = {}
+        self._condition = threading.Condition()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+        handler = type('FakeBotApiHandler', (_Handler,), {'api': self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/file/bot"
+
+    def start(self):
+        """Serve requests in a background thread"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        with self._condition:
+            self._condition.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def next_message_id(self) -> int:
+        return next(self._message_ids)
+
+    def add_file(self, file_id: str, content: bytes):
+        """Make a file downloadable through getFile"""
+        self._files[file_id] = content
+
+    def get_file(self, file_id: str) -> bytes:
+        """Content of a registered file"""
+        return self._files[file_id]
+
+    def push_update(self, update: dict) -> int:
+        """Queue an update for getUpdates and return its update_id"""
+        with self._condition:
+            update_id = next(self._update_ids)
+            self._updates.append(dict(update, update_id=update_id))
+            self._condition.notify_all()
+        return update_id
+
+    def _get_updates(self, offset: int, timeout: float) -> List[dict]:
+        """Return updates from offset on, waiting up to timeout for new ones"""
+        deadline = time.monotonic() + min(timeout, self.poll_timeout)
+        with self._condition:
+            # Updates below the offset are confirmed by the bot and can be dropped
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return list(self._updates[:100])
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        """Build the Message object returned for a sent message"""
+        return {
+            'message_id': self.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **fields
+        }
+
+    def handle(self, method: str, params: Dict[str, str], files: Dict[str, bytes]):
+        """Answer one Bot API call, returning the 'result' value"""
+        request = SentRequest(method, params, time.monotonic(), files)
+        if method != 'getUpdates':
+            self.requests.append(request)
+            if self.on_request is not None:
+                self.on_request(request)
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return self._get_updates(int(params.get('offset', 0)), float(params.get('timeout', 0)))
+        if method == 'getFile':
+            file_id = params['file_id']
+            if file_id not in self._files:
+                raise KeyError(file_id)
+            return {
+                'file_id': file_id,
+                'file_unique_id': file_id,
+                'file_size': len(self._files[file_id]),
+                'file_path': f"files/{file_id}"
+            }
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(request.chat_id or 0, text=params.get('text', ''))
+        if method == 'editMessageCaption':
+            return self._message(request.chat_id or 0, caption=params.get('caption', ''))
+        if method in ('sendDocument', 'editMessageMedia'):
+            return self._message(request.chat_id or 0, document={
+                'file_id': f"out-{self.next_message_id()}",
+                'file_unique_id': f"out-{self.next_message_id()}"
+            })
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media', '[]'))
+            return [self._message(request.chat_id or 0, document={
+                'file_id': f"out-{self.next_message_id()}",
+                'file_unique_id': f"out-{self.next_message_id()}"
+            }) for _ in media]
+        # deleteWebhook, sendChatAction, deleteMessage, ...
+        return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """HTTP front end of FakeBotApi"""
+
+    api: FakeBotApi = None
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        if self.path.startswith('/file/bot'):
+            file_id = self.path.rsplit('/', 1)[-1]
+            self.api.requests.append(SentRequest('downloadFile', {'file_id': file_id}, time.monotonic()))
+            content = self.api._files.get(file_id)
+            if content is None:
+                self._send(404, b'Not Found')
+            else:
+                self._send(200, content, 'application/octet-stream')
+            return
+        self._dispatch({}, {})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', '')
+
+        if content_type.startswith('multipart/form-data'):
+            params, files = self._parse_multipart(content_type, body)
+        else:
+            params, files = dict(parse_qsl(body.decode())), {}
+        self._dispatch(params, files)
+
+    @staticmethod
+    def _parse_multipart(content_type: str, body: bytes):
+        """Split a multipart body into text parameters and uploaded files"""
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        params, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename() is not None:
+                files[name] = payload
+            else:
+                params[name] = payload.decode()
+        return params, files
+
+    def _dispatch(self, params: Dict[str, str], files: Dict[str, bytes]):
+        method = self.path.rsplit('/', 1)[-1]
+        try:
+            result = self.api.handle(method, params, files)
+            body = {'ok': True, 'result': result}
+            status = 200
+        except KeyError:
+            body = {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid file_id'}
+            status = 400
+        self._send(status, json.dumps(body).encode(), 'application/json')
+
+    def _send(self, status: int, body: bytes, content_type: str = 'text/plain'):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The bot gave up on the request, e.g. a long poll cancelled on shutdown
+            pass
@@ -2,43 +2,212 @@
 Image processing module for background removal using InSPyReNet
 """
 import io
+import hashlib
 import logging
 import asyncio
-from typing import Optional, Tuple
+import threading
+import contextvars
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 from PIL import Image
 
-from transparent_background import Remover
+from animation import is_video, process_animation
 from config import Config
+from inference_threads import create_inference_executor, resolve_thread_settings
+from mask_upsampling import inference_size, upsample_mask
+from memory_budget import MemoryBudget, default_budget_bytes, estimate_job_bytes
+from metrics import INFERENCE_SECONDS, MODEL_REQUESTS, record_cache_lookup, track_stage
+from model_selector import ModelSelector
+from quotas import charge_megapixels
+from tiled import process_tiled, use_tiled_processing
+from worker_pool import WorkerPool
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class BackgroundRemover:
+# PIL refuses to decode images above MAX_IMAGE_PIXELS as a decompression bomb; allow the configured cap
+if Image.MAX_IMAGE_PIXELS is not None:
+    Image.MAX_IMAGE_PIXELS = max(Image.MAX_IMAGE_PIXELS, Config.MAX_IMAGE_DIMENSION ** 2)
+
+class ImageValidator:
+    """
+    Checks of uploads that need no model, shared by BackgroundRemover and the
+    job queue frontend (QueuedRemover)
+    """
+
+    def get_image_size(self, image_bytes: bytes) -> Tuple[int, int]:
+        """Read image dimensions from the header without decoding the pixels"""
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return image.size
+
+    def validate_image(self, image_bytes: bytes) -> Tuple[bool, str]:
+        """
+        Validate image format and size
+        
+        Args:
+            image_bytes: Raw image bytes
+            
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        try:
+            # Check file size
+            if len(image_bytes) > Config.MAX_FILE_SIZE_BYTES:
+                return False, Config.ERROR_MESSAGES['file_too_large']
+            
+            # Try to open image to validate format
+            image = Image.open(io.BytesIO(image_bytes))
+            
+            # Check if it's a valid image format
+            if image.format.lower() not in ['jpeg', 'png', 'webp']:
+                return False, Config.ERROR_MESSAGES['unsupported_format']
+            
+            # Additional validation - check if image can be processed
+            if image.size[0] < 10 or image.size[1] < 10:
+                return False, "❌ Image too small. Minimum size is 10x10 pixels."
+            
+            max_side = Config.MAX_IMAGE_DIMENSION
+            if image.size[0] > max_side or image.size[1] > max_side:
+                return False, f"❌ Image too large. Maximum size is {max_side}x{max_side} pixels."
+            
+            return True, ""
+            
+        except Exception as e:
+            logger.error(f"Error validating image: {e}")
+            return False, "❌ Invalid image file. Please send a valid image."
+
+    def validate_animation(self, data: bytes) -> Tuple[bool, str]:
+        """
+        Validate the size and frame count of an animation or video
+
+        Returns:
+            Tuple of (is_valid, error_message)
+        """
+        if len(data) > Config.MAX_FILE_SIZE_BYTES:
+            return False, Config.ERROR_MESSAGES['file_too_large']
+        if is_video(data):
+            # The frame count of a video is only known once decoded, process_animation enforces it
+            return True, ""
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                frames = getattr(image, 'n_frames', 1)
+        except Exception as e:
+            logger.error(f"Error validating animation: {e}")
+            return False, Config.ERROR_MESSAGES['unsupported_format']
+        if frames > Config.ANIMATION_MAX_FRAMES:
+            return False, Config.ERROR_MESSAGES['animation_too_long']
+        return True, ""
+
+
+class BackgroundRemover(ImageValidator):
     """
     Background removal processor using InSPyReNet model
     """
     
-    def __init__(self):
-        """Initialize the background remover with InSPyReNet model"""
-        self.remover = None
-        self._initialize_model()
+    def __init__(self, remover: Any = None, model_mode: Optional[str] = None,
+                 variants: Optional[List[str]] = None):
+        """
+        Initialize the background remover with InSPyReNet model
+
+        Args:
+            remover: Ready-made model with the Remover.process interface (e.g. a
+                stub for benchmarks), used for every variant. If None, the
+                InSPyReNet models are loaded.
+            model_mode: Default InSPyReNet variant, defaults to Config.MODEL_MODE
+            variants: Variants to load for adaptive selection. Defaults to
+                Config.MODEL_VARIANTS, or only model_mode if that is given.
+        """
+        self.model_mode = model_mode or Config.MODEL_MODE
+        self.variants = list(variants or ([model_mode] if model_mode else Config.MODEL_VARIANTS))
+        if self.model_mode not in self.variants:
+            self.variants.insert(0, self.model_mode)
+
+        self.removers: Dict[str, Any] = {}
+        if Config.INFERENCE_PROCESSES > 0:
+            # The models live in recyclable worker processes, this process only plans the jobs
+            self.inference_workers, self.inference_threads = resolve_thread_settings(Config.INFERENCE_PROCESSES)
+            self.executor = None
+            self.worker_pool = WorkerPool(
+                self.inference_workers,
+                max_jobs=Config.WORKER_MAX_JOBS,
+                max_rss_bytes=Config.WORKER_MAX_RSS_MB * 2**20,
+                remover=remover,
+                model_mode=self.model_mode,
+                variants=self.variants,
+                threads=self.inference_threads,
+                on_inference=self._record_inference
+            )
+        else:
+            # Created before the model is loaded: it sets the OpenMP/BLAS thread limits
+            self.inference_workers, self.inference_threads = resolve_thread_settings()
+            self.executor = create_inference_executor(self.inference_workers, self.inference_threads)
+            self.worker_pool = None
+            if remover is not None:
+                self.removers = {variant: remover for variant in self.variants}
+            else:
+                self._initialize_model()
+        self.remover = self.removers.get(self.model_mode)
+
+        self.selector = ModelSelector(
+            self.variants,
+            latency_target=Config.ADAPTIVE_LATENCY_TARGET_SECONDS,
+            large_image_megapixels=Config.ADAPTIVE_LARGE_IMAGE_MEGAPIXELS,
+            workers=self.inference_workers
+        )
+        # Longest side the model sees (0 = full resolution) and how its mask is scaled back
+        self.mask_max_side = Config.MASK_INFERENCE_MAX_SIDE
+        self.mask_upsample = Config.MASK_UPSAMPLE_METHOD
+        # Estimated memory of running jobs (MEMORY_BUDGET_MB: 0 = half the memory, < 0 = no limit)
+        if Config.MEMORY_BUDGET_MB > 0:
+            self.memory_budget = MemoryBudget(Config.MEMORY_BUDGET_MB * 2**20)
+        else:
+            self.memory_budget = MemoryBudget(default_budget_bytes() if Config.MEMORY_BUDGET_MB == 0 else 0)
+        # Jobs between decoding and encoding, the load seen by the selector
+        self._active_jobs = 0
+        # Model runs of the current job, set in worker processes to report them to the parent
+        self.inference_log: Optional[List[Tuple[str, float]]] = None
+        # Recently computed masks, so re-sending an image in another mode skips inference
+        self._mask_cache: "OrderedDict[str, Image.Image]" = OrderedDict()
+        self._mask_cache_lock = threading.Lock()
     
     def _initialize_model(self):
-        """Initialize the InSPyReNet model with tracer_b7 configuration"""
+        """Initialize the InSPyReNet models with tracer_b7 configuration"""
+        if Config.INFERENCE_BACKEND == 'onnx':
+            self._initialize_onnx_model()
+            return
         try:
-            logger.info("Initializing InSPyReNet model...")
-            self.remover = Remover(
-                mode=Config.MODEL_MODE,  # 'base' uses tracer_b7 variant
-                jit=Config.USE_JIT,
-                resize=Config.RESIZE_MODE
-            )
+            # Imported here so the module can be used without torch (stub models)
+            from transparent_background import Remover
+
+            for variant in self.variants:
+                logger.info(f"Initializing InSPyReNet model ({variant})...")
+                self.removers[variant] = Remover(
+                    mode=variant,  # 'base' uses tracer_b7 variant
+                    jit=Config.USE_JIT,
+                    resize=Config.RESIZE_MODE
+                )
             logger.info("Model initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize model: {e}")
             raise
+
+    def _initialize_onnx_model(self):
+        """Load the InSPyReNet models exported to ONNX, exporting them on first use"""
+        try:
+            from onnx_backend import OnnxRemover
+
+            for variant in self.variants:
+                logger.info(f"Initializing ONNX Runtime model ({variant}, int8={Config.ONNX_QUANTIZE})...")
+                self.removers[variant] = OnnxRemover.for_variant(variant)
+            logger.info("Model initialized successfully")
+        except Exception as e:
+            logger.error(f"Failed to initialize ONNX model: {e}")
+            raise
     
-    async def process_image(self, image_bytes: bytes, mode: str = 'full', opacity: int = 100) -> Optional[bytes]:
+    async def process_image(self, image_bytes: bytes, mode: str = 'full', opacity: int = 100,
+                            preview_side: int = 0) -> Optional[bytes]:
         """
         Process image with transparency effects
 
@@ -46,39 +215,177 @@ class BackgroundRemover:
             image_bytes: Raw image bytes
             mode: Transparency mode ('full', 'semi', 'soft', 'subject', 'custom')
             opacity: Opacity level for custom mode (1-100)
+            preview_side: If set, make a quick preview instead: the image is shrunk
+                to this longest side and run through the fastest loaded variant
 
         Returns:
             Processed image bytes with transparency effects, or None if failed
         """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-            logger.info(f"Processing image of size: {image.size}")
-            
-            # Process in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            processed_image = await loop.run_in_executor(
-                None,
-                self._apply_transparency_effect,
-                image, mode, opacity
-            )
-            
-            if processed_image is None:
+            # Plan the job from the image header, before any pixels are decoded
+            width, height = self.get_image_size(image_bytes)
+            if preview_side:
+                # Previews are small and not cached, so they never stand in for a full-size mask
+                model, reason = self.selector.variants[-1], 'preview'
+                scale = min(1.0, preview_side / max(width, height))
+                width, height = max(1, int(width * scale)), max(1, int(height * scale))
+            else:
+                model, reason = self.selector.choose(width, height, self._active_jobs)
+            MODEL_REQUESTS.labels(model=model, reason=reason).inc()
+            charge_megapixels(width, height)
+            logger.info(f"Processing image of size: {(width, height)} with model {model} ({reason})")
+
+            # Wait until the job fits in the memory budget, then process it in the inference
+            # pool to avoid blocking, keeping the job's context (profiling)
+            async def run():
+                if self.worker_pool is not None:
+                    # Inference is timed in the worker and reported back (_record_inference)
+                    return await self.worker_pool.run('process', image_bytes, mode, opacity, preview_side, model)
+                loop = asyncio.get_event_loop()
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(
+                    self.executor,
+                    context.run,
+                    self._run_job,
+                    image_bytes, mode, opacity, preview_side, model
+                )
+
+            output_bytes = await self._run_in_budget(estimate_job_bytes(width, height), run)
+
+            if output_bytes is None:
                 return None
-            
-            # Convert back to bytes
-            output_buffer = io.BytesIO()
-            processed_image.save(output_buffer, format='PNG')
-            output_bytes = output_buffer.getvalue()
-            
+
             logger.info(f"Successfully processed image. Output size: {len(output_bytes)} bytes")
             return output_bytes
             
         except Exception as e:
             logger.error(f"Error processing image: {e}")
             return None
+
+    async def _run_in_budget(self, nbytes: int, run: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[bytes]:
+        """
+        Run a job once it fits in the memory budget, counting it as active while it runs
+
+        Cancelling the caller (e.g. a timeout in the bot) can not stop an executor
+        thread or a worker process, so the job's reservation and active slot are
+        kept until the job has really finished. A job still waiting for the budget
+        is dropped.
+        """
+        started = False
+
+        async def reserved():
+            nonlocal started
+            async with self.memory_budget.reserve(nbytes):
+                started = True
+                self._active_jobs += 1
+                try:
+                    return await run()
+                finally:
+                    self._active_jobs -= 1
+
+        task = asyncio.ensure_future(reserved())
+        # The result of a job nobody waits for any more is dropped
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not started:
+                task.cancel()
+            raise
+
+    def _run_job(self, image_bytes: bytes, mode: str, opacity: int, preview_side: int,
+                 model: str) -> Optional[bytes]:
+        """Decode, process and encode one image (runs in the inference pool or a worker process)"""
+        # Convert bytes to PIL Image
+        with track_stage('decode'):
+            image = self._decode(image_bytes)
+
+        if preview_side:
+            image.thumbnail((preview_side, preview_side))
+            cache_key = None
+        else:
+            cache_key = hashlib.sha1(image_bytes).hexdigest() if Config.MASK_CACHE_SIZE > 0 else None
+            if use_tiled_processing(*image.size):
+                return self._run_tiled(image, mode, opacity, cache_key, model)
+
+        processed_image = self._apply_transparency_effect(image, mode, opacity, cache_key, model)
+        if processed_image is None:
+            return None
+
+        # Convert back to bytes
+        with track_stage('encode'):
+            return self._encode(processed_image)
     
-    def _apply_transparency_effect(self, image: Image.Image, mode: str = 'full', opacity: int = 100) -> Optional[Image.Image]:
+    def _run_tiled(self, image: Image.Image, mode: str, opacity: int, cache_key: Optional[str],
+                   model: str) -> Optional[bytes]:
+        """Process a very large image strip by strip (see tiled.py)"""
+        if self.remover is None:
+            logger.error("Model not initialized")
+            return None
+        try:
+            output = io.BytesIO()
+            process_tiled(self, image, mode, opacity, output, cache_key, model)
+            return output.getvalue()
+        except Exception as e:
+            logger.error(f"Error in tiled processing: {e}")
+            return None
+
+    async def process_animation(self, data: bytes, mode: str = 'full', opacity: int = 100) -> Optional[bytes]:
+        """
+        Process an animated GIF/WebP or short MP4 frame by frame
+
+        Args:
+            data: Raw animation or video bytes
+            mode: Transparency mode
+            opacity: Opacity level for custom mode (1-100)
+
+        Returns:
+            Animated PNG bytes, or None if failed
+        """
+        try:
+            # One frame is in flight at a time; video sizes are unknown until decoded
+            if is_video(data):
+                width = height = Config.ANIMATION_MAX_SIDE or 1920
+            else:
+                width, height = self.get_image_size(data)
+
+            async def run():
+                if self.worker_pool is not None:
+                    return await self.worker_pool.run('animation', data, mode, opacity)
+                loop = asyncio.get_event_loop()
+                context = contextvars.copy_context()
+                return await loop.run_in_executor(
+                    self.executor,
+                    context.run,
+                    self._run_animation,
+                    data, mode, opacity
+                )
+
+            return await self._run_in_budget(estimate_job_bytes(width, height), run)
+
+        except Exception as e:
+            logger.error(f"Error processing animation: {e}")
+            return None
+
+    def _run_animation(self, data: bytes, mode: str, opacity: int) -> bytes:
+        """Process an animation into animated PNG bytes (runs in the inference pool or a worker process)"""
+        output = io.BytesIO()
+        process_animation(self, data, mode, opacity, output)
+        return output.getvalue()
+
+    def _decode(self, image_bytes: bytes) -> Image.Image:
+        """Decode image bytes to an RGB image"""
+        return Image.open(io.BytesIO(image_bytes)).convert('RGB')
+
+    def _encode(self, image: Image.Image) -> bytes:
+        """Encode a processed image as PNG"""
+        output_buffer = io.BytesIO()
+        image.save(output_buffer, format='PNG')
+        return output_buffer.getvalue()
+
+    def _apply_transparency_effect(self, image: Image.Image, mode: str = 'full', opacity: int = 100,
+                                   cache_key: Optional[str] = None,
+                                   model: Optional[str] = None) -> Optional[Image.Image]:
         """
         Apply transparency effects to PIL Image using InSPyReNet
 
@@ -86,6 +393,8 @@ class BackgroundRemover:
             image: PIL Image object
             mode: Transparency mode
             opacity: Opacity level (1-100)
+            cache_key: Key of the source image in the mask cache, or None to skip the cache
+            model: Model variant to use, defaults to self.model_mode
 
         Returns:
             Processed PIL Image with transparency effects
@@ -96,39 +405,97 @@ class BackgroundRemover:
                 return None
 
             # Get the mask first
-            mask = self.remover.process(image, type='map')
+            mask = self._get_mask(image, cache_key, model)
 
-            # Apply different transparency effects based on mode
-            if mode == 'full':
-                # Standard transparent background
-                result = self.remover.process(image, type='rgba')
+            with track_stage('composite'):
+                return self._composite(image, mask, mode, opacity)
 
-            elif mode == 'semi':
-                # Semi-transparent background
-                result = self._create_semi_transparent(image, mask, 0.5)
+        except Exception as e:
+            logger.error(f"Error in transparency processing: {e}")
+            return None
 
-            elif mode == 'soft':
-                # Soft edge transparency
-                result = self._create_soft_edges(image, mask)
+    def _get_mask(self, image: Image.Image, cache_key: Optional[str] = None,
+                  model: Optional[str] = None) -> Image.Image:
+        """Predict the foreground mask of an image, reusing a cached mask when possible"""
+        model = model or self.model_mode
+        if cache_key is not None:
+            cache_key = f"{model}:{cache_key}"
+            with self._mask_cache_lock:
+                mask = self._mask_cache.get(cache_key)
+                if mask is not None:
+                    self._mask_cache.move_to_end(cache_key)
+            record_cache_lookup('mask', mask is not None)
+            if mask is not None:
+                return mask
 
-            elif mode == 'subject':
-                # Semi-transparent subject
-                result = self._create_transparent_subject(image, mask, 0.7)
+        # Large images can be run through the model at a reduced size
+        size = inference_size(image.size, self.mask_max_side)
+        model_input = image if size == image.size else image.resize(size, Image.BILINEAR)
 
-            elif mode == 'custom':
-                # Custom opacity
-                alpha_value = opacity / 100.0
-                result = self._create_semi_transparent(image, mask, 1.0 - alpha_value)
+        start = time.perf_counter()
+        with track_stage('inference', cpu_threads=self.inference_threads):
+            mask = self.removers[model].process(model_input, type='map').convert('L')
+        self._record_inference(model, time.perf_counter() - start)
 
-            else:
-                # Default to full transparency
-                result = self.remover.process(image, type='rgba')
+        if mask.size != image.size:
+            with track_stage('upsample'):
+                mask = upsample_mask(
+                    mask, image, self.mask_upsample,
+                    radius=Config.GUIDED_FILTER_RADIUS, eps=Config.GUIDED_FILTER_EPS
+                )
 
-            return result
+        if cache_key is not None:
+            with self._mask_cache_lock:
+                self._mask_cache[cache_key] = mask
+                while len(self._mask_cache) > Config.MASK_CACHE_SIZE:
+                    self._mask_cache.popitem(last=False)
 
-        except Exception as e:
-            logger.error(f"Error in transparency processing: {e}")
-            return None
+        return mask
+
+    def _record_inference(self, model: str, seconds: float):
+        """Feed one model run to the adaptive selector and the metrics, in this or a worker process"""
+        if self.inference_log is not None:
+            # In a worker process: the parent's selector gets it (see worker_pool)
+            self.inference_log.append((model, seconds))
+            return
+        self.selector.record(model, seconds)
+        INFERENCE_SECONDS.labels(model=model).observe(seconds)
+
+    def _composite(self, image: Image.Image, mask: Image.Image, mode: str, opacity: int) -> Image.Image:
+        """Combine an image and its mask according to the transparency mode"""
+        # Apply different transparency effects based on mode
+        if mode == 'full':
+            # Standard transparent background
+            result = self._create_full_transparent(image, mask)
+
+        elif mode == 'semi':
+            # Semi-transparent background
+            result = self._create_semi_transparent(image, mask, 0.5)
+
+        elif mode == 'soft':
+            # Soft edge transparency
+            result = self._create_soft_edges(image, mask)
+
+        elif mode == 'subject':
+            # Semi-transparent subject
+            result = self._create_transparent_subject(image, mask, 0.7)
+
+        elif mode == 'custom':
+            # Custom opacity
+            alpha_value = opacity / 100.0
+            result = self._create_semi_transparent(image, mask, 1.0 - alpha_value)
+
+        else:
+            # Default to full transparency
+            result = self._create_full_transparent(image, mask)
+
+        return result
+
+    def _create_full_transparent(self, image: Image.Image, mask: Image.Image) -> Image.Image:
+        """Remove the background, using the mask as alpha channel (same as Remover's 'rgba' output)"""
+        image_rgba = image.convert('RGBA')
+        image_rgba.putalpha(mask.convert('L'))
+        return image_rgba
 
     def _create_semi_transparent(self, image: Image.Image, mask: Image.Image, bg_alpha: float) -> Image.Image:
         """Create semi-transparent background effect"""
@@ -136,15 +503,9 @@ class BackgroundRemover:
         image_rgba = image.convert('RGBA')
         mask_gray = mask.convert('L')
 
-        # Create alpha channel
-        alpha = Image.new('L', image.size, 255)
-
-        # Apply transparency to background areas
-        for x in range(image.width):
-            for y in range(image.height):
-                mask_val = mask_gray.getpixel((x, y))
-                if mask_val < 128:  # Background area
-                    alpha.putpixel((x, y), int(255 * bg_alpha))
+        # Background areas (mask below 128) get the background alpha, the rest stays opaque
+        background = int(255 * bg_alpha)
+        alpha = mask_gray.point([background] * 128 + [255] * 128)
 
         # Apply alpha channel
         image_rgba.putalpha(alpha)
@@ -159,7 +520,14 @@ class BackgroundRemover:
         mask_gray = mask.convert('L')
 
         # Apply gaussian blur to mask for soft edges
-        soft_mask = mask_gray.filter(ImageFilter.GaussianBlur(radius=3))
+        size = inference_size(image.size, self.mask_max_side)
+        if size == image.size:
+            soft_mask = mask_gray.filter(ImageFilter.GaussianBlur(radius=3))
+        else:
+            # Blur at the inference resolution; the blurred mask is smooth, so scaling it up loses nothing
+            scale = size[0] / image.width
+            soft_mask = mask_gray.resize(size, Image.BILINEAR).filter(ImageFilter.GaussianBlur(radius=3 * scale))
+            soft_mask = soft_mask.resize(image.size, Image.BILINEAR)
 
         # Use the blurred mask as alpha channel
         image_rgba.putalpha(soft_mask)
@@ -171,56 +539,47 @@ class BackgroundRemover:
         image_rgba = image.convert('RGBA')
         mask_gray = mask.convert('L')
 
-        # Create alpha channel
-        alpha = Image.new('L', image.size, 255)
-
-        # Apply transparency to subject areas
-        for x in range(image.width):
-            for y in range(image.height):
-                mask_val = mask_gray.getpixel((x, y))
-                if mask_val >= 128:  # Subject area
-                    alpha.putpixel((x, y), int(255 * subject_alpha))
-                else:  # Background - make fully transparent
-                    alpha.putpixel((x, y), 0)
+        # Subject areas (mask from 128) get the subject alpha, the background becomes fully transparent
+        subject = int(255 * subject_alpha)
+        alpha = mask_gray.point([0] * 128 + [subject] * 128)
 
         # Apply alpha channel
         image_rgba.putalpha(alpha)
         return image_rgba
-    
-    def validate_image(self, image_bytes: bytes) -> Tuple[bool, str]:
-        """
-        Validate image format and size
-        
-        Args:
-            image_bytes: Raw image bytes
-            
-        Returns:
-            Tuple of (is_valid, error_message)
-        """
-        try:
-            # Check file size
-            if len(image_bytes) > Config.MAX_FILE_SIZE_BYTES:
-                return False, Config.ERROR_MESSAGES['file_too_large']
-            
-            # Try to open image to validate format
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Check if it's a valid image format
-            if image.format.lower() not in ['jpeg', 'png', 'webp']:
-                return False, Config.ERROR_MESSAGES['unsupported_format']
-            
-            # Additional validation - check if image can be processed
-            if image.size[0] < 10 or image.size[1] < 10:
-                return False, "❌ Image too small. Minimum size is 10x10 pixels."
-            
-            if image.size[0] > 4096 or image.size[1] > 4096:
-                return False, "❌ Image too large. Maximum size is 4096x4096 pixels."
-            
-            return True, ""
-            
-        except Exception as e:
-            logger.error(f"Error validating image: {e}")
-            return False, "❌ Invalid image file. Please send a valid image."
 
-# Global instance
-background_remover = BackgroundRemover()
+# Global instance, created on first use so that importing this module does not load the model
+_background_remover: Optional[BackgroundRemover] = None
+_background_remover_lock = threading.Lock()
+
+
+def get_background_remover() -> BackgroundRemover:
+    """
+    Return the shared BackgroundRemover, loading the model on first call
+
+    With Config.JOB_QUEUE_URL set this is a QueuedRemover instead, which hands
+    the jobs to worker.py processes and loads no model.
+    """
+    global _background_remover
+    with _background_remover_lock:
+        if _background_remover is None:
+            if Config.JOB_QUEUE_URL:
+                from job_queue import QueuedRemover, open_job_queue
+                _background_remover = QueuedRemover(open_job_queue(Config.JOB_QUEUE_URL))
+            else:
+                _background_remover = BackgroundRemover()
+    return _background_remover
+
+
+def set_background_remover(remover: BackgroundRemover):
+    """Replace the shared BackgroundRemover, e.g. with a stub model for load tests"""
+    global _background_remover
+    with _background_remover_lock:
+        _background_remover = remover
+
+
+def __getattr__(name: str):
+    """Keep `from image_processor import background_remover` working"""
+    if name == 'background_remover':
+        return get_background_remover()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
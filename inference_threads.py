@@ -0,0 +1,109 @@
+"""
+Thread budget and CPU affinity of the inference workers
+
+Running several inferences at once while every torch/BLAS call uses all
+cores oversubscribes the CPU. The worker count and the intra-op threads per
+worker are chosen together here, so that workers x threads matches the
+cores available to the process, and each worker can optionally be pinned
+to its own slice of cores.
+"""
+import itertools
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Environment variables read by the OpenMP / BLAS runtimes when torch or numpy load them
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def resolve_thread_settings(workers: Optional[int] = None, threads: Optional[int] = None,
+                            cores: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Inference workers and intra-op threads per worker
+
+    Zero or None means automatic: about one worker per 4 cores, and the
+    cores split evenly between the workers.
+
+    Returns:
+        Tuple of (workers, threads_per_worker)
+    """
+    cores = cores or len(available_cpus())
+    workers = workers if workers is not None else Config.INFERENCE_WORKERS
+    threads = threads if threads is not None else Config.INFERENCE_THREADS_PER_WORKER
+    if workers <= 0:
+        workers = max(1, cores // 4)
+    if threads <= 0:
+        threads = max(1, cores // workers)
+    return workers, threads
+
+
+def configure_process_threads(threads: int):
+    """
+    Limit the OpenMP/BLAS thread pools to the threads of one worker
+
+    Environment variables only take effect if set before torch is imported,
+    so this is called before the model is loaded. Values set explicitly in
+    the environment win.
+    """
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def cpu_slices(workers: int, threads: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """Split the available CPUs into one slice of `threads` cores per worker (wrapping around)"""
+    cpus = cpus or available_cpus()
+    return [
+        [cpus[(worker * threads + i) % len(cpus)] for i in range(threads)]
+        for worker in range(workers)
+    ]
+
+
+def worker_initializer(workers: int, threads: int, pin: bool) -> Callable[[], None]:
+    """Return a thread initializer that applies the thread count (and affinity) to each worker"""
+    slices = cpu_slices(workers, threads)
+    slots = itertools.count()
+
+    def initialize():
+        slot = next(slots) % workers
+        torch = sys.modules.get('torch')
+        if torch is not None:
+            torch.set_num_threads(threads)
+        if pin and hasattr(os, 'sched_setaffinity'):
+            # pid 0 is the calling thread on Linux; OpenMP threads it starts inherit the mask
+            try:
+                os.sched_setaffinity(0, slices[slot])
+            except OSError as e:
+                logger.warning(f"Could not pin inference worker {slot} to CPUs {slices[slot]}: {e}")
+
+    return initialize
+
+
+def create_inference_executor(workers: Optional[int] = None, threads: Optional[int] = None,
+                              pin: Optional[bool] = None) -> ThreadPoolExecutor:
+    """Dedicated thread pool for inference with the configured thread budget"""
+    workers, threads = resolve_thread_settings(workers, threads)
+    pin = Config.INFERENCE_CPU_AFFINITY if pin is None else pin
+    configure_process_threads(threads)
+    logger.info(f"Inference pool: {workers} worker(s) x {threads} thread(s){', pinned' if pin else ''}")
+    return ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix='inference',
+        initializer=worker_initializer(workers, threads, pin)
+    )
@@ -0,0 +1,138 @@
+"""
+Durable journal of image jobs across restarts
+
+Every update carrying media is written to JOB_JOURNAL_DIR as soon as the bot
+receives it, before it waits for a free slot, and removed once its handler
+finished. Updates still in the journal when the bot stops (the drain deadline
+passed, or the process was killed) are replayed on the next start, so a
+deploy delays jobs instead of dropping them. Telegram file ids stay valid, so
+a replayed update downloads its image again. After a crash Telegram delivers
+the updates it never saw acknowledged once more; those already replayed from
+the journal are dropped, so a job is not run (and charged) twice.
+"""
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Set
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+def is_job_update(update: object) -> bool:
+    """Whether an update starts an image job (photo, image document, animation or video)"""
+    message = getattr(update, 'message', None)
+    if message is None:
+        return False
+    return bool(message.photo or message.document or message.animation or message.video)
+
+
+class JobJournal:
+    """One JSON file per received job update, deleted when the job is finished"""
+
+    def __init__(self, directory: str, max_age_seconds: float = 24 * 3600):
+        """
+        Args:
+            directory: Journal directory, created if missing
+            max_age_seconds: Older entries are dropped instead of replayed
+        """
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        # Updates whose completion was taken over by a later job (album items)
+        self._held: Set[int] = set()
+        # Updates queued from the journal, and those of them already received again
+        self._replaying: Set[int] = set()
+        self._replayed: Set[int] = set()
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, update_id: int) -> str:
+        return os.path.join(self.directory, f"{update_id}.json")
+
+    def __len__(self) -> int:
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+    def record(self, update: Update) -> bool:
+        """
+        Persist a job update; written atomically and synced so a crash leaves no partial entry
+
+        Returns:
+            False if the update is a second delivery of one replayed from the
+            journal, which must not be processed again
+        """
+        if update.update_id in self._replayed:
+            return False
+        if update.update_id in self._replaying:
+            # The replayed update itself, keep its original receive time
+            self._replaying.discard(update.update_id)
+            self._replayed.add(update.update_id)
+            return True
+        path = self._path(update.update_id)
+        if os.path.exists(path):
+            return True
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'received': time.time(), 'update': update.to_dict()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        return True
+
+    def hold(self, update_id: int):
+        """Keep an entry after its handler returned; whoever holds it calls complete()"""
+        self._held.add(update_id)
+
+    def finish(self, update_id: int):
+        """Handler of an update returned: complete the entry unless it is held"""
+        if update_id not in self._held:
+            self.complete(update_id)
+
+    def complete(self, update_id: int):
+        """Remove a finished job"""
+        if self.closed:
+            return
+        self._held.discard(update_id)
+        try:
+            os.remove(self._path(update_id))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        """
+        Stop completing entries
+
+        Called when the drain deadline passed: jobs still running then may
+        fail as the bot shuts down, so they are all left for the replay.
+        """
+        self.closed = True
+
+    def replay(self) -> List[Dict]:
+        """Pending updates to queue again on start; deliveries of them from Telegram are dropped"""
+        updates = self.pending()
+        self._replaying = {update['update_id'] for update in updates}
+        return updates
+
+    def pending(self) -> List[Dict]:
+        """Journaled updates (as dicts) in the order they were received, dropping stale ones"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Dropping unreadable journal entry {name}: {e}")
+                os.remove(path)
+                continue
+            if now - entry['received'] > self.max_age_seconds:
+                logger.info(f"Dropping journal entry {name} older than {self.max_age_seconds:.0f}s")
+                os.remove(path)
+                continue
+            entries.append(entry)
+        entries.sort(key=lambda entry: (entry['received'], entry['update']['update_id']))
+        return [entry['update'] for entry in entries]
@@ -0,0 +1,402 @@
+"""
+Job queue between the Telegram frontend and inference workers
+
+With JOB_QUEUE_URL set, the bot keeps downloading, validating and replying,
+but instead of running the model it puts each job on a queue. Stateless
+inference workers (worker.py), on the same host or others, take jobs, run
+them and publish the results, which the bot collects. Inference capacity then
+scales by starting workers, and only one process polls Telegram.
+
+Backends:
+- sqlite:///path/jobs.db (or a plain path): a local SQLite database, for
+  workers on the same host
+- redis://host:6379/0: Redis (needs the redis package), for workers on
+  other hosts
+
+Workers renew the lease of the jobs they run every third of
+JOB_LEASE_SECONDS, so a job taken by a worker that dies is handed out again
+after at most JOB_LEASE_SECONDS, while slow jobs of live workers are not.
+Results that are never collected expire after JOB_RESULT_TTL_SECONDS.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from config import Config
+from image_processor import ImageValidator
+from memory_budget import MemoryBudget
+from quotas import charge_megapixels
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """One image or animation to process"""
+    operation: str  # 'image' or 'animation'
+    data: bytes
+    mode: str = 'full'
+    opacity: int = 100
+    preview_side: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class JobQueue(ABC):
+    """Interface of the queue backends; all methods block and may be called from any thread"""
+
+    @abstractmethod
+    def put(self, job: Job):
+        """Queue a job"""
+
+    @abstractmethod
+    def take(self, timeout: float) -> Optional[Job]:
+        """Claim the oldest queued job, waiting up to timeout seconds for one"""
+
+    @abstractmethod
+    def renew(self, job_id: str):
+        """Extend the lease of a claimed job that is still running"""
+
+    @abstractmethod
+    def finish(self, job_id: str, result: Optional[bytes]):
+        """Publish the result of a claimed job (None if it failed)"""
+
+    @abstractmethod
+    def collect(self, job_ids: List[str]) -> Dict[str, Optional[bytes]]:
+        """Remove and return the results of those jobs that are finished"""
+
+    @abstractmethod
+    def cancel(self, job_id: str):
+        """Drop a job nobody waits for any more, whatever its state"""
+
+    @abstractmethod
+    def depth(self) -> int:
+        """Jobs waiting for a worker"""
+
+
+class SqliteJobQueue(JobQueue):
+    """Job queue in a local SQLite database shared by the bot and the workers"""
+
+    def __init__(self, path: str, lease_seconds: float = 20.0, result_ttl_seconds: float = 3600.0,
+                 poll_interval: float = 0.05):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.poll_interval = poll_interval
+        # sqlite3 connections must not be shared between threads
+        self._local = threading.local()
+        db = self._connection()
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                operation TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                opacity INTEGER NOT NULL,
+                preview_side INTEGER NOT NULL,
+                data BLOB,
+                status TEXT NOT NULL,
+                result BLOB,
+                created REAL NOT NULL,
+                claimed REAL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created)")
+
+    def _connection(self) -> sqlite3.Connection:
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            # Autocommit; transactions that must be atomic are opened explicitly
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL lets workers claim jobs while the bot reads results
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def put(self, job: Job):
+        db = self._connection()
+        now = time.time()
+        db.execute(
+            "INSERT INTO jobs (id, operation, mode, opacity, preview_side, data, status, created) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job.id, job.operation, job.mode, job.opacity, job.preview_side, job.data, now)
+        )
+        db.execute("DELETE FROM jobs WHERE created < ?", (now - self.result_ttl_seconds,))
+
+    def take(self, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._claim()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(self.poll_interval)
+
+    def _claim(self) -> Optional[Job]:
+        db = self._connection()
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so two workers never claim the same job
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT id, operation, mode, opacity, preview_side, data FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND claimed < ?) "
+                "ORDER BY created LIMIT 1",
+                (now - self.lease_seconds,)
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = 'running', claimed = ? WHERE id = ?", (now, row[0]))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job_id, operation, mode, opacity, preview_side, data = row
+        return Job(operation, data, mode, opacity, preview_side, id=job_id)
+
+    def renew(self, job_id: str):
+        self._connection().execute(
+            "UPDATE jobs SET claimed = ? WHERE id = ? AND status = 'running'", (time.time(), job_id)
+        )
+
+    def finish(self, job_id: str, result: Optional[bytes]):
+        # A cancelled job has no row any more and the result is dropped
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, data = NULL WHERE id = ? AND status = 'running'",
+            ('done' if result is not None else 'failed', result, job_id)
+        )
+
+    def collect(self, job_ids: List[str]) -> Dict[str, Optional[bytes]]:
+        if not job_ids:
+            return {}
+        db = self._connection()
+        # Only the frontend that queued a job collects it, so reading and deleting need no lock
+        rows = db.execute(
+            f"SELECT id, status, result FROM jobs "
+            f"WHERE id IN ({','.join('?' * len(job_ids))}) AND status IN ('done', 'failed')",
+            job_ids
+        ).fetchall()
+        if rows:
+            finished = [row[0] for row in rows]
+            db.execute(f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(finished))})", finished)
+        return {job_id: result if status == 'done' else None for job_id, status, result in rows}
+
+    def cancel(self, job_id: str):
+        self._connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def depth(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Job queue in Redis, for workers on several hosts
+
+    Job ids wait in a list; a claimed job moves to a sorted set scored by the
+    claim time, from which expired leases are put back on the list. Both moves
+    run as Lua scripts, so a worker dying halfway can not lose a job: Redis
+    executes a script as a whole or not at all. Scripts can not block, so
+    take() polls like the SQLite backend.
+    """
+
+    # KEYS: queued list, running set; ARGV: claim time
+    _CLAIM_SCRIPT = """
+        local job_id = redis.call('RPOP', KEYS[1])
+        if job_id then
+            redis.call('ZADD', KEYS[2], ARGV[1], job_id)
+        end
+        return job_id
+    """
+    # KEYS: running set, queued list; ARGV: claim time of the oldest lease still valid
+    _REQUEUE_SCRIPT = """
+        local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        for _, job_id in ipairs(expired) do
+            redis.call('ZREM', KEYS[1], job_id)
+            redis.call('RPUSH', KEYS[2], job_id)
+        end
+        return #expired
+    """
+
+    # KEYS: job hash, result hash, running set, queued list; ARGV: status, result, TTL, job id
+    _FINISH_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 0 then
+            return 0
+        end
+        redis.call('HSET', KEYS[2], 'status', ARGV[1], 'result', ARGV[2])
+        redis.call('EXPIRE', KEYS[2], ARGV[3])
+        redis.call('DEL', KEYS[1])
+        redis.call('ZREM', KEYS[3], ARGV[4])
+        redis.call('LREM', KEYS[4], 0, ARGV[4])
+        return 1
+    """
+
+    def __init__(self, url: str, lease_seconds: float = 20.0, result_ttl_seconds: float = 3600.0,
+                 prefix: str = 'bgbot:jobs', poll_interval: float = 0.05):
+        try:
+            import redis
+        except ImportError:
+            raise ValueError("The Redis job queue needs the redis package: pip install redis")
+        self.redis = redis.Redis.from_url(url)
+        self.lease_seconds = lease_seconds
+        self.result_ttl = max(1, int(result_ttl_seconds))
+        self.prefix = prefix
+        self.poll_interval = poll_interval
+        self._claim_script = self.redis.register_script(self._CLAIM_SCRIPT)
+        self._requeue_script = self.redis.register_script(self._REQUEUE_SCRIPT)
+        self._finish_script = self.redis.register_script(self._FINISH_SCRIPT)
+
+    def _key(self, *parts: str) -> str:
+        return ':'.join((self.prefix,) + parts)
+
+    def put(self, job: Job):
+        pipeline = self.redis.pipeline()
+        pipeline.hset(self._key('job', job.id), mapping={
+            'operation': job.operation, 'mode': job.mode, 'opacity': job.opacity,
+            'preview_side': job.preview_side, 'data': job.data
+        })
+        pipeline.expire(self._key('job', job.id), self.result_ttl)
+        pipeline.lpush(self._key('queued'), job.id)
+        pipeline.execute()
+
+    def take(self, timeout: float) -> Optional[Job]:
+        deadline = time.monotonic() + timeout
+        # Put jobs of dead workers back before claiming, oldest first
+        self._requeue_script(
+            keys=[self._key('running'), self._key('queued')], args=[time.time() - self.lease_seconds]
+        )
+        while True:
+            job_id = self._claim_script(keys=[self._key('queued'), self._key('running')], args=[time.time()])
+            if job_id is not None or time.monotonic() >= deadline:
+                break
+            time.sleep(self.poll_interval)
+        if job_id is None:
+            return None
+        job_id = job_id.decode()
+        fields = self.redis.hgetall(self._key('job', job_id))
+        if not fields:
+            # Cancelled (or expired) while it was queued
+            self.redis.zrem(self._key('running'), job_id)
+            return None
+        return Job(
+            fields[b'operation'].decode(), fields[b'data'], fields[b'mode'].decode(),
+            int(fields[b'opacity']), int(fields[b'preview_side']), id=job_id
+        )
+
+    def renew(self, job_id: str):
+        # xx: a cancelled or finished job is not put back into the running set
+        self.redis.zadd(self._key('running'), {job_id: time.time()}, xx=True)
+
+    def finish(self, job_id: str, result: Optional[bytes]):
+        # Stored as long as the job exists, also when its lease expired and another worker
+        # runs it again; only a cancelled or already finished job drops the result
+        stored = self._finish_script(
+            keys=[self._key('job', job_id), self._key('result', job_id), self._key('running'), self._key('queued')],
+            args=['done' if result is not None else 'failed', result or b'', self.result_ttl, job_id]
+        )
+        if not stored:
+            logger.info(f"Dropping result of job {job_id}, it was cancelled or finished by another worker")
+
+    def collect(self, job_ids: List[str]) -> Dict[str, Optional[bytes]]:
+        if not job_ids:
+            return {}
+        pipeline = self.redis.pipeline()
+        for job_id in job_ids:
+            pipeline.hgetall(self._key('result', job_id))
+        results = {}
+        for job_id, fields in zip(job_ids, pipeline.execute()):
+            if fields:
+                results[job_id] = fields[b'result'] if fields[b'status'] == b'done' else None
+        if results:
+            self.redis.delete(*(self._key('result', job_id) for job_id in results))
+        return results
+
+    def cancel(self, job_id: str):
+        pipeline = self.redis.pipeline()
+        pipeline.delete(self._key('job', job_id), self._key('result', job_id))
+        pipeline.zrem(self._key('running'), job_id)
+        pipeline.lrem(self._key('queued'), 0, job_id)
+        pipeline.execute()
+
+    def depth(self) -> int:
+        return self.redis.llen(self._key('queued'))
+
+
+def open_job_queue(url: str) -> JobQueue:
+    """Open the queue backend for a 'sqlite:///path' (or plain path) or 'redis://...' URL"""
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobQueue(url, Config.JOB_LEASE_SECONDS, Config.JOB_RESULT_TTL_SECONDS)
+    path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else url
+    return SqliteJobQueue(path, Config.JOB_LEASE_SECONDS, Config.JOB_RESULT_TTL_SECONDS)
+
+
+class QueuedRemover(ImageValidator):
+    """
+    Frontend stand-in for BackgroundRemover that runs jobs on inference workers
+
+    It has the interface the bot uses: validation happens here, processing
+    goes through the queue. A single task polls the results of all waiting jobs.
+    """
+
+    def __init__(self, queue: JobQueue, poll_interval: Optional[float] = None):
+        self.queue = queue
+        self.poll_interval = poll_interval if poll_interval is not None else Config.JOB_QUEUE_POLL_SECONDS
+        # Images are decoded by the workers, which budget their own memory
+        self.memory_budget = MemoryBudget(0)
+        self.worker_pool = None
+        self._waiting: Dict[str, asyncio.Future] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    async def process_image(self, image_bytes: bytes, mode: str = 'full', opacity: int = 100,
+                            preview_side: int = 0) -> Optional[bytes]:
+        """Process an image on a worker, see BackgroundRemover.process_image"""
+        # CPU time is spent on the worker and not reported back, so only the pixels are charged here
+        try:
+            width, height = self.get_image_size(image_bytes)
+            scale = min(1.0, preview_side / max(width, height)) if preview_side else 1.0
+            charge_megapixels(int(width * scale), int(height * scale))
+        except Exception:
+            pass  # The worker reports the broken image
+        return await self._run(Job('image', image_bytes, mode, opacity, preview_side))
+
+    async def process_animation(self, data: bytes, mode: str = 'full', opacity: int = 100) -> Optional[bytes]:
+        """Process an animation on a worker, see BackgroundRemover.process_animation"""
+        return await self._run(Job('animation', data, mode, opacity))
+
+    async def _run(self, job: Job) -> Optional[bytes]:
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.queue.put, job)
+        except Exception as e:
+            logger.error(f"Error queueing job: {e}")
+            return None
+
+        future = loop.create_future()
+        self._waiting[job.id] = future
+        if self._poller is None or self._poller.done() or self._poller.get_loop() is not loop:
+            self._poller = asyncio.create_task(self._poll_results())
+        try:
+            return await future
+        finally:
+            if self._waiting.pop(job.id, None) is not None:
+                # Timed out or cancelled: workers can skip the job
+                loop.run_in_executor(None, self.queue.cancel, job.id)
+
+    async def _poll_results(self):
+        """Hand finished results to their waiting jobs until no job is waiting"""
+        loop = asyncio.get_running_loop()
+        while self._waiting:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                results = await loop.run_in_executor(None, self.queue.collect, list(self._waiting))
+            except Exception as e:
+                logger.error(f"Error collecting job results: {e}")
+                continue
+            for job_id, result in results.items():
+                future = self._waiting.pop(job_id, None)
+                if future is not None and not future.done():
+                    future.set_result(result)
@@ -0,0 +1,312 @@
+"""
+Offline load test for BackgroundRemovalBot
+
+Runs the real bot against a local fake Bot API server (fake_bot_api.py) and
+replays synthetic traffic: a configurable number of users sending images
+with Poisson arrivals at a given rate and a mix of sizes and photo/document
+uploads. Reports end-to-end latency (update queued -> result received),
+throughput, error rates and Bot API calls.
+
+Usage:
+    python load_test.py --stub --users 50 --rate 5 --duration 60
+    python load_test.py --mix 512x512:photo:3,2048x1536:document:1 --output load.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional
+
+from benchmark import StubRemover, make_synthetic_image, summarize
+from config import Config
+from fake_bot_api import FakeBotApi, SentRequest
+import image_processor
+
+DEFAULT_MIX = '640x480:photo:4,1280x960:photo:3,2048x1536:document:1'
+
+
+@dataclass
+class ImageKind:
+    """One entry of the traffic image mix"""
+    width: int
+    height: int
+    upload: str  # 'photo' (compressed JPEG) or 'document' (PNG file)
+    weight: float
+
+
+def parse_mix(spec: str) -> List[ImageKind]:
+    """Parse 'WIDTHxHEIGHT:photo|document:WEIGHT,...'"""
+    kinds = []
+    for entry in spec.split(','):
+        size, upload, weight = entry.strip().split(':')
+        width, height = size.lower().split('x')
+        if upload not in ('photo', 'document'):
+            raise ValueError(f"Unknown upload type '{upload}', use photo or document")
+        kinds.append(ImageKind(int(width), int(height), upload, float(weight)))
+    return kinds
+
+
+class ResultCollector:
+    """Match the bot's replies to the images each chat sent"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.sent = 0
+        self.first_sent: Optional[float] = None
+        self.last_completed: Optional[float] = None
+        self._pending: Dict[int, Deque[float]] = defaultdict(deque)
+        self._error_names = {text: name for name, text in Config.ERROR_MESSAGES.items()}
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(queue) for queue in self._pending.values())
+
+    def image_sent(self, chat_id: int):
+        with self._lock:
+            now = time.monotonic()
+            self._pending[chat_id].append(now)
+            self.sent += 1
+            if self.first_sent is None:
+                self.first_sent = now
+
+    def on_request(self, request: SentRequest):
+        """Called by the fake API for every call the bot makes"""
+        # editMessageMedia replaces a progressive preview, whose sendDocument already completed the image
+        if request.method == 'sendDocument':
+            self._complete(request, None)
+        elif request.method == 'sendMediaGroup':
+            # One reply for a whole album (images that failed are not in it)
+            for _ in json.loads(request.params.get('media', '[]')):
+                self._complete(request, None)
+        elif request.method in ('sendMessage', 'editMessageText'):
+            text = request.params.get('text', '')
+            if text.startswith('❌'):
+                self._complete(request, self._error_names.get(text, 'validation'))
+
+    def _complete(self, request: SentRequest, error: Optional[str]):
+        with self._lock:
+            queue = self._pending.get(request.chat_id)
+            if not queue:
+                return
+            sent_at = queue.popleft()
+            if error is None:
+                self.latencies.append(request.timestamp - sent_at)
+                self.last_completed = request.timestamp
+            else:
+                self.errors[error] += 1
+
+
+class TrafficGenerator:
+    """Send synthetic image updates to the fake API"""
+
+    def __init__(self, api: FakeBotApi, collector: ResultCollector, users: int, rate: float,
+                 mix: List[ImageKind], mode_change_probability: float = 0.1,
+                 album_probability: float = 0.0, variants: int = 4, seed: int = 0):
+        self.api = api
+        self.collector = collector
+        self.users = users
+        self.rate = rate
+        self.mix = mix
+        self.mode_change_probability = mode_change_probability
+        self.album_probability = album_probability
+        self._album_ids = itertools.count(1)
+        self.random = random.Random(seed)
+        # A few distinct images per kind, registered as downloadable files
+        self.files: Dict[int, List[str]] = {}
+        for index, kind in enumerate(mix):
+            image_format = 'JPEG' if kind.upload == 'photo' else 'PNG'
+            self.files[index] = []
+            for variant in range(variants):
+                file_id = f"{kind.upload}-{kind.width}x{kind.height}-{variant}"
+                api.add_file(file_id, make_synthetic_image(kind.width, kind.height, image_format, seed=variant))
+                self.files[index].append(file_id)
+
+    def _message(self, user_id: int, **fields) -> dict:
+        return {
+            'message_id': self.api.next_message_id(),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"},
+            **fields
+        }
+
+    def send_image(self, user_id: int, media_group_id: Optional[str] = None):
+        """Queue one image update from a user"""
+        index = self.random.choices(range(len(self.mix)), weights=[kind.weight for kind in self.mix])[0]
+        kind = self.mix[index]
+        file_id = self.random.choice(self.files[index])
+
+        if kind.upload == 'photo':
+            media = {'photo': [{
+                'file_id': file_id, 'file_unique_id': file_id,
+                'width': kind.width, 'height': kind.height
+            }]}
+        else:
+            media = {'document': {
+                'file_id': file_id, 'file_unique_id': file_id,
+                'file_name': f"{file_id}.png", 'mime_type': 'image/png',
+                'file_size': len(self.api.get_file(file_id))
+            }}
+
+        if media_group_id is not None:
+            media['media_group_id'] = media_group_id
+
+        self.collector.image_sent(user_id)
+        self.api.push_update({'message': self._message(user_id, **media)})
+
+    def send_album(self, user_id: int):
+        """Queue an album of 2-5 images, delivered as separate updates like Telegram does"""
+        media_group_id = f"album-{next(self._album_ids)}"
+        for _ in range(self.random.randint(2, 5)):
+            self.send_image(user_id, media_group_id)
+
+    async def run(self, duration: float):
+        """Send images with exponentially distributed gaps for the given time"""
+        deadline = time.monotonic() + duration
+        while True:
+            await asyncio.sleep(self.random.expovariate(self.rate))
+            if time.monotonic() >= deadline:
+                return
+            user_id = self.random.randint(1, self.users)
+            if self.random.random() < self.mode_change_probability:
+                mode = self.random.choice(list(Config.TRANSPARENCY_MODES))
+                self.api.push_update({'message': self._message(user_id, text=f"mode:{mode}")})
+            if self.random.random() < self.album_probability:
+                self.send_album(user_id)
+            else:
+                self.send_image(user_id)
+
+
+async def run_load_test(users: int = 20, rate: float = 2.0, duration: float = 30.0,
+                        mix: Optional[List[ImageKind]] = None, stub: bool = False,
+                        drain_timeout: float = 60.0, mode_change_probability: float = 0.1,
+                        album_probability: float = 0.0,
+                        mask_cache: bool = False, progressive: bool = False, seed: int = 0) -> Dict:
+    """Run the bot against generated traffic and return the report"""
+    mix = mix or parse_mix(DEFAULT_MIX)
+    api = FakeBotApi()
+    api.start()
+    collector = ResultCollector()
+    api.on_request = collector.on_request
+
+    Config.BOT_TOKEN = '123456:LOADTEST'
+    Config.TELEGRAM_API_BASE_URL = api.base_url
+    Config.TELEGRAM_API_FILE_URL = api.base_file_url
+    # Fake update ids restart at 1, so a run must not replay another run's journal
+    journal_dir = tempfile.TemporaryDirectory(prefix='bgbot-journal-')
+    Config.JOB_JOURNAL_DIR = journal_dir.name
+    if not mask_cache:
+        # Real traffic rarely repeats an image, so don't let the cache flatter the numbers
+        Config.MASK_CACHE_SIZE = 0
+    if progressive:
+        # Latency is then the time to the first (preview) result
+        Config.PROGRESSIVE_PREVIEW = True
+    if stub:
+        image_processor.set_background_remover(
+            image_processor.BackgroundRemover(remover=StubRemover(), model_mode='stub')
+        )
+
+    # The bot uses the shared remover set above; the model is only loaded if none is set
+    from bot import BackgroundRemovalBot
+
+    bot = BackgroundRemovalBot()
+    await bot.start()
+    generator = TrafficGenerator(api, collector, users, rate, mix, mode_change_probability,
+                                 album_probability=album_probability, seed=seed)
+    try:
+        await generator.run(duration)
+        deadline = time.monotonic() + drain_timeout
+        while collector.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+    finally:
+        await bot.stop()
+        api.stop()
+        journal_dir.cleanup()
+
+    api_calls = Counter(request.method for request in api.requests)
+    completed = len(collector.latencies)
+    errors = sum(collector.errors.values())
+    elapsed = (collector.last_completed or time.monotonic()) - (collector.first_sent or time.monotonic())
+    return {
+        'config': {
+            'users': users, 'rate': rate, 'duration': duration, 'stub': stub, 'progressive': progressive,
+            'album_probability': album_probability,
+            'mix': [vars(kind) for kind in mix], 'max_concurrent_updates': Config.MAX_CONCURRENT_UPDATES
+        },
+        'sent': collector.sent,
+        'completed': completed,
+        'errors': dict(collector.errors),
+        'unanswered': collector.pending,
+        'error_rate': round((errors + collector.pending) / collector.sent, 4) if collector.sent else 0.0,
+        'throughput_ips': round(completed / elapsed, 3) if completed and elapsed > 0 else 0.0,
+        'latency': summarize(collector.latencies) if collector.latencies else None,
+        'api_calls': dict(api_calls),
+        'api_calls_per_image': round(sum(api_calls.values()) / collector.sent, 2) if collector.sent else 0.0
+    }
+
+
+def print_report(report: Dict):
+    """Print a human readable summary"""
+    print(f"\n📨 Sent: {report['sent']}  ✅ Completed: {report['completed']}  "
+          f"⌛ Unanswered: {report['unanswered']}")
+    if report['latency']:
+        latency = report['latency']
+        print(f"⏱️  Latency p50 {latency['p50_ms']:.0f} ms | p90 {latency['p90_ms']:.0f} ms | "
+              f"p99 {latency['p99_ms']:.0f} ms | max {latency['max_ms']:.0f} ms")
+    print(f"🚀 Throughput: {report['throughput_ips']:.2f} images/s")
+    print(f"❌ Error rate: {report['error_rate'] * 100:.1f}% {report['errors'] or ''}")
+    print(f"📡 API calls per image: {report['api_calls_per_image']}  {report['api_calls']}")
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Load test the bot against a fake Bot API server")
+    parser.add_argument('--users', type=int, default=20, help="Number of simulated users")
+    parser.add_argument('--rate', type=float, default=2.0, help="Images per second across all users")
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds of traffic to generate")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Image mix as WIDTHxHEIGHT:photo|document:WEIGHT,...")
+    parser.add_argument('--mode-changes', type=float, default=0.1, help="Chance a user switches mode before an image")
+    parser.add_argument('--albums', type=float, default=0.0, help="Chance a send is an album of 2-5 images")
+    parser.add_argument('--drain-timeout', type=float, default=60.0, help="Seconds to wait for pending replies")
+    parser.add_argument('--mask-cache', action='store_true', help="Keep the mask cache enabled")
+    parser.add_argument('--progressive', action='store_true', help="Send previews first (time to first result)")
+    parser.add_argument('--stub', action='store_true', help="Use a stub model (no weights, no inference cost)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed for reproducible traffic")
+    parser.add_argument('--output', help="Save the report as JSON")
+    args = parser.parse_args()
+
+    print(f"🧪 Load test: {args.users} users, {args.rate} images/s for {args.duration:.0f}s\n")
+    report = asyncio.run(run_load_test(
+        users=args.users,
+        rate=args.rate,
+        duration=args.duration,
+        mix=parse_mix(args.mix),
+        stub=args.stub,
+        drain_timeout=args.drain_timeout,
+        mode_change_probability=args.mode_changes,
+        album_probability=args.albums,
+        mask_cache=args.mask_cache,
+        progressive=args.progressive,
+        seed=args.seed
+    ))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report saved to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
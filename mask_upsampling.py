@@ -0,0 +1,164 @@
+"""
+Edge-aware upsampling of low-resolution masks
+
+The model can run on a downscaled copy of a large image; its mask is then
+brought back to full size with a fast guided filter (He & Sun, 2015) that
+uses the full-resolution image as guide, so mask edges snap to the real
+object edges instead of being blurred by plain interpolation. All the
+filtering happens at the low resolution; at full size only the linear
+coefficients are interpolated and applied.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+def inference_size(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+    """Size to run the model at so that the longest side is at most max_side (0 = unchanged)"""
+    width, height = size
+    if max_side <= 0 or max(width, height) <= max_side:
+        return size
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _window_sums(x: np.ndarray, radius: int) -> np.ndarray:
+    """Sums over a (2 * radius + 1) window along axis 0, clipped at the borders"""
+    n = x.shape[0]
+    cumsum = np.cumsum(x, axis=0)
+    if n < 2 * radius + 2:
+        index = np.arange(n)
+        cumsum = np.concatenate([np.zeros_like(cumsum[:1]), cumsum])
+        return cumsum[np.minimum(index + radius + 1, n)] - cumsum[np.maximum(index - radius, 0)]
+
+    sums = np.empty_like(cumsum)
+    sums[:radius + 1] = cumsum[radius:2 * radius + 1]
+    sums[radius + 1:n - radius] = cumsum[2 * radius + 1:] - cumsum[:n - 2 * radius - 1]
+    sums[n - radius:] = cumsum[-1] - cumsum[n - 2 * radius - 1:n - radius - 1]
+    return sums
+
+
+def _window_counts(n: int, radius: int) -> np.ndarray:
+    index = np.arange(n)
+    return np.minimum(index + radius + 1, n) - np.maximum(index - radius, 0)
+
+
+def box_filter(x: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over a (2 * radius + 1) square window, clipped at the borders"""
+    sums = _window_sums(np.ascontiguousarray(_window_sums(x, radius).T), radius).T
+    counts = _window_counts(x.shape[0], radius)[:, None] * _window_counts(x.shape[1], radius)[None, :]
+    return sums / counts
+
+
+def _resize(array: np.ndarray, size: Tuple[int, int],
+            box: Optional[Tuple[float, float, float, float]] = None) -> np.ndarray:
+    """Bilinear resize of a float array (or of its box region) to (width, height)"""
+    return np.asarray(Image.fromarray(array.astype(np.float32), 'F').resize(size, Image.BILINEAR, box=box))
+
+
+def guided_coefficients(mask: Image.Image, low_guide: Image.Image, radius: int = 2,
+                        eps: float = 1e-4) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Smoothed linear coefficients (a, b) of the guided filter at the mask's resolution
+
+    Args:
+        mask: Low-resolution 'L' mask
+        low_guide: The image at the mask's resolution
+        radius: Filter window radius in low-resolution pixels
+        eps: Regularization; larger values follow the guide's edges less
+    """
+    low_guide = low_guide.convert('L')
+    if low_guide.size != mask.size:
+        low_guide = low_guide.resize(mask.size, Image.BILINEAR)
+    low_guide = np.asarray(low_guide, dtype=np.float32) / 255.0
+    low_mask = np.asarray(mask.convert('L'), dtype=np.float32) / 255.0
+
+    mean_guide = box_filter(low_guide, radius)
+    mean_mask = box_filter(low_mask, radius)
+    covariance = box_filter(low_guide * low_mask, radius) - mean_guide * mean_mask
+    variance = box_filter(low_guide * low_guide, radius) - mean_guide * mean_guide
+
+    a = covariance / (variance + eps)
+    b = mean_mask - a * mean_guide
+    return box_filter(a, radius), box_filter(b, radius)
+
+
+def apply_coefficients(mean_a: np.ndarray, mean_b: np.ndarray, guide_gray: Image.Image,
+                       box: Optional[Tuple[float, float, float, float]] = None) -> Image.Image:
+    """
+    Full-resolution mask from guided filter coefficients
+
+    Args:
+        mean_a, mean_b: Coefficients from guided_coefficients
+        guide_gray: 'L' guide at full resolution, or the part of it covered by box
+        box: Region of the coefficient arrays that guide_gray covers (default: all)
+    """
+    mean_a = _resize(mean_a, guide_gray.size, box)
+    mean_b = _resize(mean_b, guide_gray.size, box)
+    full_guide = np.asarray(guide_gray, dtype=np.float32) / 255.0
+    result = mean_a * full_guide + mean_b
+    return Image.fromarray((np.clip(result, 0.0, 1.0) * 255 + 0.5).astype(np.uint8), 'L')
+
+
+def guided_upsample(mask: Image.Image, guide: Image.Image, radius: int = 2, eps: float = 1e-4) -> Image.Image:
+    """
+    Upsample a low-resolution mask to the guide's size with a fast guided filter
+
+    Args:
+        mask: Low-resolution 'L' mask
+        guide: Full-resolution image the mask belongs to
+        radius: Filter window radius in low-resolution pixels
+        eps: Regularization; larger values follow the guide's edges less
+
+    Returns:
+        'L' mask at the guide's size
+    """
+    guide_gray = guide.convert('L')
+    mean_a, mean_b = guided_coefficients(mask, guide_gray, radius, eps)
+    return apply_coefficients(mean_a, mean_b, guide_gray)
+
+
+class StripUpsampler:
+    """
+    Upsample a low-resolution mask one horizontal strip at a time
+
+    The guided filter coefficients are computed once at the low resolution;
+    each strip only interpolates the rows of them it covers, so the result
+    matches upsampling the whole mask without a full-size copy of it.
+    """
+
+    def __init__(self, mask: Image.Image, low_guide: Image.Image, size: Tuple[int, int],
+                 method: str = 'guided', radius: int = 2, eps: float = 1e-4):
+        """
+        Args:
+            mask: Low-resolution 'L' mask
+            low_guide: The image at the mask's resolution (used by 'guided')
+            size: Full (width, height) the strips belong to
+            method: 'guided' or 'bilinear'
+        """
+        self.mask = mask.convert('L')
+        self.size = size
+        self._row_scale = self.mask.height / size[1]
+        self._coefficients = None
+        if method == 'guided' and self.mask.size != size:
+            self._coefficients = guided_coefficients(self.mask, low_guide, radius, eps)
+
+    def upsample(self, guide: Image.Image, top: int) -> Image.Image:
+        """'L' mask of the full-resolution rows top .. top + guide.height, guided by those rows"""
+        if self.mask.size == self.size:
+            return self.mask.crop((0, top, self.mask.width, top + guide.height))
+        box = (0, top * self._row_scale, self.mask.width, (top + guide.height) * self._row_scale)
+        if self._coefficients is not None:
+            return apply_coefficients(*self._coefficients, guide.convert('L'), box)
+        return self.mask.resize(guide.size, Image.BILINEAR, box=box)
+
+
+def upsample_mask(mask: Image.Image, guide: Image.Image, method: str = 'guided',
+                  radius: int = 2, eps: float = 1e-4) -> Image.Image:
+    """Bring a mask back to the guide's size with 'guided' or plain 'bilinear' upsampling"""
+    if mask.size == guide.size:
+        return mask
+    if method == 'guided':
+        return guided_upsample(mask, guide, radius, eps)
+    return mask.convert('L').resize(guide.size, Image.BILINEAR)
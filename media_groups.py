@@ -0,0 +1,83 @@
+"""
+Buffering of album (media group) messages into one job
+
+Telegram delivers every image of an album as a separate update sharing a
+media_group_id, without marking the last one. Items are collected until no
+new one arrived for a short while, then handed over together.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Set
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupBuffer:
+    """Collect the updates of each media group until it has been quiet for `wait` seconds"""
+
+    def __init__(self, wait: float, on_complete: Callable[[List[Update]], Awaitable[None]]):
+        """
+        Args:
+            wait: Seconds without a new item after which a group is complete
+            on_complete: Coroutine function called with the group's updates, in arrival order
+        """
+        self.wait = wait
+        self.on_complete = on_complete
+        self._groups: Dict[str, List[Update]] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._running: Set[asyncio.Task] = set()
+
+    @property
+    def pending_groups(self) -> int:
+        return len(self._groups)
+
+    def add(self, update: Update):
+        """Add an album item and restart its group's timer"""
+        group_id = update.message.media_group_id
+        self._groups.setdefault(group_id, []).append(update)
+        timer = self._timers.pop(group_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[group_id] = asyncio.create_task(self._complete_later(group_id))
+
+    async def _complete_later(self, group_id: str):
+        await asyncio.sleep(self.wait)
+        self._timers.pop(group_id, None)
+        self._start(group_id)
+
+    def _start(self, group_id: str):
+        """Hand a group over; items arriving later start a new group"""
+        updates = self._groups.pop(group_id)
+        task = asyncio.create_task(self._run(updates))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, updates: List[Update]):
+        try:
+            await self.on_complete(updates)
+        except Exception as e:
+            logger.error(f"Error handling media group: {e}")
+
+    async def flush(self):
+        """
+        Hand over every buffered group now and wait until all groups are handled
+
+        Items added while waiting (e.g. updates still being dispatched) are
+        flushed as well, until the buffer is empty.
+        """
+        while self._timers or self._running:
+            for group_id, timer in list(self._timers.items()):
+                timer.cancel()
+                del self._timers[group_id]
+                self._start(group_id)
+            if self._running:
+                await asyncio.gather(*self._running)
+
+    def cancel(self):
+        """Drop the buffered groups and cancel the ones being handled"""
+        for task in list(self._timers.values()) + list(self._running):
+            task.cancel()
+        self._timers.clear()
+        self._groups.clear()
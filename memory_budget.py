@@ -0,0 +1,159 @@
+"""
+Memory budget for image jobs
+
+Each job's peak memory is estimated from the image dimensions before it is
+decoded, and jobs are only started while the estimates of all running jobs
+fit in a global budget. Jobs wait in arrival order, so a large image is not
+starved by a stream of small ones; a job larger than the whole budget runs
+on its own.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Optional
+
+from config import Config
+from metrics import MEMORY_RESERVED
+from tiled import use_tiled_processing
+
+logger = logging.getLogger(__name__)
+
+
+# Full-size memory per pixel of a tiled job: the decoded RGB source and the PNG output
+TILED_BYTES_PER_PIXEL = 8
+
+
+def estimate_job_bytes(width: int, height: int) -> int:
+    """
+    Estimated peak memory of processing one image
+
+    Full-size copies (RGB image, RGBA result, model map, masks and alpha,
+    PNG buffer) scale with the pixel count; model activations depend on the
+    fixed inference resolution and are a constant. A tiled job only keeps
+    the source and the output at full size, the rest is per strip.
+    """
+    inference_bytes = Config.INFERENCE_MEMORY_MB * 2**20
+    if use_tiled_processing(width, height):
+        strip_bytes = width * Config.TILED_STRIP_ROWS * Config.JOB_BYTES_PER_PIXEL
+        return width * height * TILED_BYTES_PER_PIXEL + strip_bytes + inference_bytes
+    return width * height * Config.JOB_BYTES_PER_PIXEL + inference_bytes
+
+
+def default_budget_bytes() -> int:
+    """Half of the container's memory limit, or of the machine's memory"""
+    limit = None
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            if value.isdigit() and int(value) < 2**60:
+                limit = int(value)
+                break
+        except OSError:
+            continue
+    if limit is None:
+        try:
+            limit = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (ValueError, OSError, AttributeError):
+            return 0
+    return limit // 2
+
+
+class MemoryBudget:
+    """Admit jobs in arrival order while their estimated memory fits the budget"""
+
+    def __init__(self, limit_bytes: int):
+        """
+        Args:
+            limit_bytes: Budget for all running jobs, 0 disables the budget
+        """
+        self.limit = limit_bytes
+        self.used = 0
+        self._waiting: Deque[int] = deque()
+        self._tickets = itertools.count()
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def _get_condition(self) -> asyncio.Condition:
+        # asyncio primitives belong to one event loop; the shared remover may outlive one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    def _fits(self, ticket: int, nbytes: int) -> bool:
+        return self._waiting[0] == ticket and (self.used == 0 or self.used + nbytes <= self.limit)
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int) -> AsyncIterator[None]:
+        """Wait until the job fits in the budget and hold its share while it runs"""
+        if self.limit <= 0:
+            yield
+            return
+
+        condition = self._get_condition()
+        async with condition:
+            ticket = next(self._tickets)
+            self._waiting.append(ticket)
+            try:
+                await condition.wait_for(lambda: self._fits(ticket, nbytes))
+            except BaseException:
+                self._waiting.remove(ticket)
+                condition.notify_all()
+                raise
+            self._waiting.popleft()
+            self.used += nbytes
+            MEMORY_RESERVED.set(self.used)
+            # The next job in line may fit as well
+            condition.notify_all()
+
+        try:
+            yield
+        finally:
+            async with condition:
+                self.used -= nbytes
+                MEMORY_RESERVED.set(self.used)
+                condition.notify_all()
+
+
+class ThreadMemoryBudget:
+    """
+    Memory budget for jobs that move between threads (batch_process.py)
+
+    A reservation is taken with acquire() and given back with release(),
+    possibly from another thread, instead of spanning one coroutine.
+    """
+
+    def __init__(self, limit_bytes: int):
+        """
+        Args:
+            limit_bytes: Budget for all jobs in flight, 0 disables the budget
+        """
+        self.limit = limit_bytes
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int):
+        """Block until the job fits in the budget (a job larger than the budget waits until it is alone)"""
+        if self.limit <= 0:
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self.used == 0 or self.used + nbytes <= self.limit)
+            self.used += nbytes
+
+    def release(self, nbytes: int):
+        """Give back the share of a finished job"""
+        if self.limit <= 0:
+            return
+        with self._condition:
+            self.used -= nbytes
+            self._condition.notify_all()
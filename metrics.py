@@ -0,0 +1,143 @@
+"""
+Prometheus metrics for the Telegram Background Removal Bot
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from config import Config
+from profiling import current_session
+from quotas import current_cost
+
+logger = logging.getLogger(__name__)
+
+# Telegram Bot API usage
+API_CALLS = Counter(
+    'bgbot_api_calls_total',
+    'Telegram Bot API calls, including file downloads',
+    ['method']
+)
+API_RETRIES = Counter(
+    'bgbot_api_retries_total',
+    'Telegram Bot API calls retried after flood control or network errors',
+    ['method', 'reason']
+)
+API_CALLS_PER_JOB = Histogram(
+    'bgbot_api_calls_per_job',
+    'Telegram Bot API calls made to handle one image',
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15)
+)
+
+# Processing pipeline
+STAGE_SECONDS = Histogram(
+    'bgbot_stage_seconds',
+    'Time spent in each stage of handling an image',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+STAGE_CPU_SECONDS = Counter(
+    'bgbot_stage_cpu_seconds_total',
+    'CPU time spent in each processing stage',
+    ['stage']
+)
+JOB_SECONDS = Histogram(
+    'bgbot_job_seconds',
+    'End-to-end time to handle one image, from download to upload',
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+)
+INFERENCE_SECONDS = Histogram(
+    'bgbot_inference_seconds',
+    'Model inference time per model variant',
+    ['model'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+)
+MODEL_REQUESTS = Counter(
+    'bgbot_model_requests_total',
+    'Images processed per model variant, with the reason the variant was chosen',
+    ['model', 'reason']
+)
+ANIMATION_FRAMES = Counter(
+    'bgbot_animation_frames_total',
+    'Animation frames processed, by whether the model ran (keyframe) or the mask was reused',
+    ['kind']
+)
+JOBS_IN_FLIGHT = Gauge('bgbot_jobs_in_flight', 'Images currently being handled')
+QUEUE_DEPTH = Gauge('bgbot_queue_depth', 'Updates waiting to be handled', ['queue'])
+CACHE_REQUESTS = Counter('bgbot_cache_requests_total', 'Cache lookups', ['cache', 'result'])
+
+MEMORY_RESERVED = Gauge('bgbot_memory_reserved_bytes', 'Estimated memory of the jobs admitted by the memory budget')
+WORKER_RECYCLES = Counter('bgbot_worker_recycles_total', 'Inference worker pools replaced', ['reason'])
+
+# Cost accounting (see quotas.py)
+COST_UNITS = Counter('bgbot_cost_units_total', 'Cost units charged for finished jobs')
+MEGAPIXELS = Counter('bgbot_megapixels_total', 'Megapixels processed')
+QUOTA_REFUSALS = Counter('bgbot_quota_refusals_total', 'Jobs refused because a cost budget was spent', ['scope'])
+
+# Memory. Current RSS is exported by the default process collector as
+# process_resident_memory_bytes; the peak is only available from getrusage.
+try:
+    import resource
+
+    PEAK_RSS = Gauge('bgbot_peak_rss_bytes', 'Peak resident set size of the bot process')
+    PEAK_RSS.set_function(lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+except ImportError:  # Not available on Windows
+    PEAK_RSS = None
+
+
+def current_rss_bytes() -> Optional[int]:
+    """Current resident set size, or None if it cannot be read on this platform"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@contextmanager
+def track_stage(stage: str, cpu_profile: bool = True, cpu_threads: int = 1) -> Iterator[None]:
+    """
+    Time a block of code as one pipeline stage
+
+    Args:
+        stage: Stage name
+        cpu_profile: Whether the stage may run under cProfile when its job is
+            being profiled, and whether its CPU time is measured. Pass False
+            for stages that await.
+        cpu_threads: Threads sharing the stage's work evenly (intra-op threads
+            of inference); the calling thread's CPU time is scaled by it
+    """
+    session = current_session()
+    start = time.perf_counter()
+    cpu_start = time.thread_time() if cpu_profile else 0.0
+    try:
+        if session is None:
+            yield
+        else:
+            with session.profile_stage(stage, cpu_profile):
+                yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - start)
+        if cpu_profile:
+            cpu_seconds = (time.thread_time() - cpu_start) * cpu_threads
+            STAGE_CPU_SECONDS.labels(stage=stage).inc(cpu_seconds)
+            cost = current_cost()
+            if cost is not None:
+                cost.add_cpu(stage, cpu_seconds)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    """Count a cache hit or miss"""
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def start_metrics_server():
+    """Expose metrics over HTTP if a metrics port is configured"""
+    if not Config.METRICS_PORT:
+        return
+
+    start_http_server(Config.METRICS_PORT)
+    logger.info(f"Metrics available on port {Config.METRICS_PORT}")
@@ -0,0 +1,82 @@
+"""
+Adaptive choice of the InSPyReNet variant used for each request
+"""
+import logging
+import threading
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Variants from best to lowest quality, with a rough inference time (seconds on CPU)
+# used until real measurements come in
+VARIANT_QUALITY_ORDER = ['base-nightly', 'base', 'fast']
+PRIOR_INFERENCE_SECONDS = {'base-nightly': 2.0, 'base': 2.0, 'fast': 0.5}
+
+
+class ModelSelector:
+    """
+    Pick a model variant per request from image size, queue depth and a latency target
+
+    Large uploads and requests arriving while the bot is idle always get the
+    best variant. Under load, the best variant that is expected to finish
+    within the latency target is used, falling back to the fastest one.
+    Expected latency is the waiting jobs per inference worker times a moving
+    average of the measured inference time of each variant.
+    """
+
+    def __init__(self, variants: List[str], latency_target: float, large_image_megapixels: float,
+                 smoothing: float = 0.2, workers: int = 1):
+        """
+        Args:
+            variants: Loaded variants
+            latency_target: Seconds a request should take at most
+            large_image_megapixels: Images at least this large always use the best variant
+            smoothing: Weight of a new measurement in the moving average
+            workers: Inferences that run in parallel
+        """
+        self.variants = sorted(
+            variants,
+            key=lambda v: VARIANT_QUALITY_ORDER.index(v) if v in VARIANT_QUALITY_ORDER else len(VARIANT_QUALITY_ORDER)
+        )
+        self.latency_target = latency_target
+        self.large_image_megapixels = large_image_megapixels
+        self.smoothing = smoothing
+        self.workers = max(1, workers)
+        self._inference_seconds: Dict[str, float] = {
+            variant: PRIOR_INFERENCE_SECONDS.get(variant, 1.0) for variant in variants
+        }
+        self._lock = threading.Lock()
+
+    def expected_seconds(self, variant: str, queue_depth: int) -> float:
+        """Expected time until a new request on this variant finishes"""
+        return (queue_depth // self.workers + 1) * self._inference_seconds[variant]
+
+    def choose(self, width: int, height: int, queue_depth: int) -> Tuple[str, str]:
+        """
+        Choose a variant for an image
+
+        Args:
+            width, height: Image size in pixels
+            queue_depth: Jobs already waiting for or running inference
+
+        Returns:
+            Tuple of (variant, reason)
+        """
+        best = self.variants[0]
+        if len(self.variants) == 1:
+            return best, 'only'
+        if width * height >= self.large_image_megapixels * 1_000_000:
+            return best, 'large_image'
+        if queue_depth == 0:
+            return best, 'idle'
+
+        for variant in self.variants:
+            if self.expected_seconds(variant, queue_depth) <= self.latency_target:
+                return variant, 'within_target' if variant == best else 'load'
+        return self.variants[-1], 'overloaded'
+
+    def record(self, variant: str, seconds: float):
+        """Update the moving average with a measured inference time"""
+        with self._lock:
+            previous = self._inference_seconds.get(variant, seconds)
+            self._inference_seconds[variant] = (1 - self.smoothing) * previous + self.smoothing * seconds
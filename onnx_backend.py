@@ -0,0 +1,225 @@
+"""
+ONNX Runtime inference backend for CPU-only hosts
+
+Exports the InSPyReNet network of transparent_background.Remover to ONNX
+(optionally with dynamic int8 weight quantization) and runs it with ONNX
+Runtime. OnnxRemover has the same process(image, type=...) interface as
+Remover, so BackgroundRemover can use either one (INFERENCE_BACKEND=onnx).
+
+Usage:
+    python onnx_backend.py export --model-mode base --quantize
+    python onnx_backend.py compare --model-mode base --sizes 512x512,1024x768
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+from inference_threads import resolve_thread_settings
+
+# Network input size of each variant in static resize mode
+BASE_SIZES = {'base': 1024, 'base-nightly': 1024, 'fast': 384}
+# ImageNet normalization used by transparent_background
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+
+def model_path(model_mode: str, quantized: bool, model_dir: Optional[str] = None) -> Path:
+    """Where the exported model of a variant is stored"""
+    suffix = '.int8' if quantized else ''
+    return Path(model_dir or Config.ONNX_MODEL_DIR) / f"inspyrenet-{model_mode}{suffix}.onnx"
+
+
+def export_model(model_mode: str, quantize: bool = False, model_dir: Optional[str] = None) -> Path:
+    """
+    Export a variant to ONNX, loading it through transparent_background
+
+    Args:
+        model_mode: InSPyReNet variant
+        quantize: Also write a copy with int8 weights (dynamic quantization)
+        model_dir: Output directory, defaults to Config.ONNX_MODEL_DIR
+
+    Returns:
+        Path of the model to use (the quantized one if requested)
+    """
+    import torch
+    from transparent_background import Remover
+
+    path = model_path(model_mode, quantized=False, model_dir=model_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Export the eager model, tracing a TorchScript module gives worse graphs
+    remover = Remover(mode=model_mode, jit=False, device='cpu')
+    size = BASE_SIZES.get(model_mode, 1024)
+    dummy = torch.rand(1, 3, size, size)
+    with torch.no_grad():
+        torch.onnx.export(
+            remover.model.eval(), dummy, str(path),
+            input_names=['image'], output_names=['mask'],
+            opset_version=17, do_constant_folding=True
+        )
+
+    if not quantize:
+        return path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized_path = model_path(model_mode, quantized=True, model_dir=model_dir)
+    quantize_dynamic(str(path), str(quantized_path), weight_type=QuantType.QInt8)
+    return quantized_path
+
+
+class OnnxRemover:
+    """ONNX Runtime replacement for transparent_background.Remover"""
+
+    def __init__(self, path: str, input_size: int, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        """
+        Args:
+            path: Exported .onnx model
+            input_size: Square input size the model was exported with
+            intra_op_threads: Threads used inside one operator (0 = ONNX Runtime default)
+            inter_op_threads: Threads running independent operators (0 = default)
+        """
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        self.input_size = input_size
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @classmethod
+    def for_variant(cls, model_mode: str) -> 'OnnxRemover':
+        """Load a variant with the Config settings, exporting it on first use"""
+        path = model_path(model_mode, Config.ONNX_QUANTIZE)
+        if not path.exists():
+            path = export_model(model_mode, Config.ONNX_QUANTIZE)
+        return cls(
+            path,
+            BASE_SIZES.get(model_mode, 1024),
+            # Default to the per-worker thread budget so concurrent sessions don't oversubscribe
+            intra_op_threads=Config.ONNX_INTRA_OP_THREADS or resolve_thread_settings()[1],
+            inter_op_threads=Config.ONNX_INTER_OP_THREADS
+        )
+
+    def predict(self, img: Image.Image) -> np.ndarray:
+        """Foreground probability per pixel (float32, 0-1) at the image's size"""
+        resized = img.convert('RGB').resize((self.input_size, self.input_size), Image.BILINEAR)
+        x = (np.asarray(resized, dtype=np.float32) / 255.0 - MEAN) / STD
+        x = x.transpose(2, 0, 1)[None]
+
+        pred = self.session.run(None, {self.input_name: x})[0][0, 0]
+        mask = Image.fromarray(pred.astype(np.float32), 'F').resize(img.size, Image.BILINEAR)
+        return np.clip(np.asarray(mask), 0.0, 1.0)
+
+    def process(self, img: Image.Image, type: str = 'rgba') -> Image.Image:
+        """Mimic Remover.process for the 'map' and 'rgba' output types"""
+        mask = Image.fromarray((self.predict(img) * 255).astype(np.uint8), 'L')
+        if type == 'map':
+            return mask.convert('RGB')
+
+        result = img.convert('RGBA')
+        result.putalpha(mask)
+        return result
+
+
+def compare_backends(model_mode: str, images: List[Image.Image], quantize: bool = False,
+                     iterations: int = 3) -> Dict:
+    """
+    Compare mask accuracy and speed of the ONNX backend against torch
+
+    The torch masks are the reference; accuracy is the mean absolute error
+    (0-255) and the IoU of the foreground (mask >= 128).
+    """
+    from benchmark import mask_metrics, summarize
+    from transparent_background import Remover
+
+    torch_remover = Remover(mode=model_mode, jit=Config.USE_JIT, resize=Config.RESIZE_MODE)
+    onnx_path = model_path(model_mode, quantize)
+    if not onnx_path.exists():
+        onnx_path = export_model(model_mode, quantize)
+    onnx_remover = OnnxRemover(
+        onnx_path, BASE_SIZES.get(model_mode, 1024),
+        intra_op_threads=Config.ONNX_INTRA_OP_THREADS,
+        inter_op_threads=Config.ONNX_INTER_OP_THREADS
+    )
+
+    timings = {'torch': [], 'onnx': []}
+    accuracy = []
+    for image in images:
+        masks = {}
+        for name, remover in (('torch', torch_remover), ('onnx', onnx_remover)):
+            remover.process(image, type='map')  # warm up
+            for _ in range(iterations):
+                start = time.perf_counter()
+                masks[name] = remover.process(image, type='map').convert('L')
+                timings[name].append(time.perf_counter() - start)
+        accuracy.append(mask_metrics(masks['torch'], masks['onnx']))
+
+    return {
+        'model_mode': model_mode,
+        'quantized': quantize,
+        'model_file': str(onnx_path),
+        'model_size_mb': round(os.path.getsize(onnx_path) / 2**20, 1),
+        'latency': {name: summarize(values) for name, values in timings.items()},
+        'speedup': round(float(np.median(timings['torch']) / np.median(timings['onnx'])), 2),
+        'mask_mae': round(float(np.mean([m['mae'] for m in accuracy])), 3),
+        'mask_iou': round(float(np.mean([m['iou'] for m in accuracy])), 4)
+    }
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Export and evaluate the ONNX Runtime backend")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Export a model variant to ONNX")
+    compare_parser = subparsers.add_parser('compare', help="Compare masks and speed against torch")
+    for sub in (export_parser, compare_parser):
+        sub.add_argument('--model-mode', default=Config.MODEL_MODE, choices=list(BASE_SIZES),
+                         help="InSPyReNet variant")
+        sub.add_argument('--quantize', action='store_true', default=Config.ONNX_QUANTIZE,
+                         help="Use dynamic int8 weight quantization")
+    compare_parser.add_argument('--sizes', default='512x512,1024x768', help="Synthetic image sizes")
+    compare_parser.add_argument('--images', nargs='*', default=[], help="Real images to compare on")
+    compare_parser.add_argument('--iterations', type=int, default=3, help="Timed runs per image")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        print(f"📦 Exporting '{args.model_mode}' to ONNX{' (int8)' if args.quantize else ''}...")
+        path = export_model(args.model_mode, args.quantize)
+        print(f"✅ Saved {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+        return 0
+
+    from benchmark import make_synthetic_image, parse_sizes
+
+    if args.images:
+        images = [Image.open(path).convert('RGB') for path in args.images]
+    else:
+        images = [
+            Image.open(io.BytesIO(make_synthetic_image(width, height))).convert('RGB')
+            for width, height in parse_sizes(args.sizes)
+        ]
+
+    print(f"📊 Comparing torch and ONNX Runtime on {len(images)} image(s)...")
+    report = compare_backends(args.model_mode, images, args.quantize, args.iterations)
+    print(f"⏱️  torch p50 {report['latency']['torch']['p50_ms']:.0f} ms | "
+          f"onnx p50 {report['latency']['onnx']['p50_ms']:.0f} ms | speedup {report['speedup']:.2f}x")
+    print(f"🎯 Mask MAE {report['mask_mae']:.2f}/255 | IoU {report['mask_iou']:.4f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
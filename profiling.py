@@ -0,0 +1,145 @@
+"""
+Opt-in profiling of individual image jobs
+
+A sampled (PROFILE_SAMPLE_RATE) or admin-requested (/profile) job runs every
+pipeline stage under cProfile and writes the results to
+PROFILE_DIR/<request_id>/<stage>.prof, together with a summary.json of stage
+timings. Open the .prof files with `python -m pstats` or snakeviz. When
+profiling is off, the only cost per stage is one context variable lookup.
+"""
+import cProfile
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_current_session: ContextVar[Optional['ProfileSession']] = ContextVar('profile_session', default=None)
+
+# Jobs still to be profiled because an admin asked for it
+_armed_jobs = 0
+_armed_lock = threading.Lock()
+
+
+class ProfileSession:
+    """Profiles collected for one request"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.directory = os.path.join(Config.PROFILE_DIR, request_id)
+        self.stage_seconds: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile_stage(self, stage: str, cpu_profile: bool = True) -> Iterator[None]:
+        """
+        Profile one stage of the request
+
+        Args:
+            stage: Stage name, used as file name
+            cpu_profile: Run the stage under cProfile. Disable for stages that
+                await, since other tasks on the event loop would show up too.
+        """
+        with ExitStack() as stack:
+            profiler = self._start_cpu_profiler() if cpu_profile else None
+            if stage == 'inference' and Config.PROFILE_TORCH:
+                self._enter_torch_profiler(stack, stage)
+
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                elapsed = time.perf_counter() - start
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.dump_stats(self._stage_path(stage, '.prof'))
+                with self._lock:
+                    self.stage_seconds.setdefault(stage, []).append(elapsed)
+
+    def _start_cpu_profiler(self) -> Optional[cProfile.Profile]:
+        """Start cProfile for the current thread, unless another profiler is running"""
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            logger.warning(f"Skipping cProfile for request {self.request_id}: {e}")
+            return None
+        return profiler
+
+    def _enter_torch_profiler(self, stack: ExitStack, stage: str):
+        """Record operator-level timings of the model with the torch profiler"""
+        try:
+            import torch.profiler
+        except ImportError:
+            logger.warning("PROFILE_TORCH is set but torch is not installed")
+            return
+
+        trace_path = self._stage_path(stage, '.trace.json')
+        profiler = torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            record_shapes=True,
+            on_trace_ready=lambda prof: prof.export_chrome_trace(trace_path)
+        )
+        stack.enter_context(profiler)
+
+    def _stage_path(self, stage: str, suffix: str) -> str:
+        """File path for a stage, numbered if the stage already ran in this request"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            runs = len(self.stage_seconds.get(stage, []))
+        name = stage if runs == 0 else f"{stage}_{runs + 1}"
+        return os.path.join(self.directory, name + suffix)
+
+    def write_summary(self):
+        """Write the stage timings of the request next to the profiles"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'summary.json'), 'w') as f:
+            json.dump({'request_id': self.request_id, 'stage_seconds': self.stage_seconds}, f, indent=2)
+
+
+def arm_profiling(jobs: int = 1):
+    """Profile the next `jobs` image jobs regardless of the sample rate"""
+    global _armed_jobs
+    with _armed_lock:
+        _armed_jobs += jobs
+
+
+def _should_profile() -> bool:
+    """Decide whether the next job is profiled"""
+    global _armed_jobs
+    if _armed_jobs > 0:
+        with _armed_lock:
+            if _armed_jobs > 0:
+                _armed_jobs -= 1
+                return True
+    return Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE
+
+
+def current_session() -> Optional[ProfileSession]:
+    """Profile session of the job running in this context, if it is being profiled"""
+    return _current_session.get()
+
+
+@contextmanager
+def profile_request(request_id: str) -> Iterator[Optional[ProfileSession]]:
+    """Profile a whole job if it is sampled or an admin asked for it"""
+    if not _should_profile():
+        yield None
+        return
+
+    session = ProfileSession(request_id)
+    token = _current_session.set(session)
+    try:
+        yield session
+    finally:
+        _current_session.reset(token)
+        session.write_summary()
+        logger.info(f"Profile of request {request_id} written to {session.directory}")
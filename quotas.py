@@ -0,0 +1,183 @@
+"""
+Cost accounting and cost-based quotas
+
+Jobs are charged by what they cost instead of being counted: COST_PER_JOB
+units of fixed overhead, COST_PER_MEGAPIXEL units per megapixel processed
+and one unit per CPU-second of the processing stages (the thread CPU time
+measured by metrics.track_stage). Each user may spend USER_COST_BUDGET units
+per QUOTA_WINDOW_SECONDS, and all users together GLOBAL_COST_BUDGET.
+
+A job's cost is only known once it has run, so jobs are admitted while the
+spending in the window is below the budget and charged afterwards. Messages
+of one chat, albums included, are handled in order, so a user's next job is
+checked only after the previous one was charged.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+_current_cost: ContextVar[Optional['JobCost']] = ContextVar('job_cost', default=None)
+
+
+class JobCost:
+    """Resources used by one job, collected from the threads its stages run in"""
+
+    def __init__(self):
+        self.megapixels = 0.0
+        self.cpu_seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_cpu(self, stage: str, seconds: float):
+        with self._lock:
+            self.cpu_seconds[stage] = self.cpu_seconds.get(stage, 0.0) + seconds
+
+    def add_megapixels(self, megapixels: float):
+        with self._lock:
+            self.megapixels += megapixels
+
+    def merge(self, snapshot: Dict):
+        """Add the cost reported by a worker process (see snapshot)"""
+        self.add_megapixels(snapshot['megapixels'])
+        for stage, seconds in snapshot['cpu_seconds'].items():
+            self.add_cpu(stage, seconds)
+
+    def snapshot(self) -> Dict:
+        """Plain copy that can be sent between processes"""
+        with self._lock:
+            return {'megapixels': self.megapixels, 'cpu_seconds': dict(self.cpu_seconds)}
+
+    @property
+    def total_cpu_seconds(self) -> float:
+        with self._lock:
+            return sum(self.cpu_seconds.values())
+
+    @property
+    def units(self) -> float:
+        """Cost of the job in quota units"""
+        return Config.COST_PER_JOB + self.megapixels * Config.COST_PER_MEGAPIXEL + self.total_cpu_seconds
+
+
+def current_cost() -> Optional[JobCost]:
+    """Cost of the job running in this context, if it is being accounted"""
+    return _current_cost.get()
+
+
+@contextmanager
+def track_cost() -> Iterator[JobCost]:
+    """Account the resources used in this context (and executor jobs run in a copy of it)"""
+    cost = JobCost()
+    token = _current_cost.set(cost)
+    try:
+        yield cost
+    finally:
+        _current_cost.reset(token)
+
+
+def charge_megapixels(width: int, height: int):
+    """Charge the pixels of an image (or frame) to the current job"""
+    cost = current_cost()
+    if cost is not None:
+        cost.add_megapixels(width * height / 1_000_000)
+
+
+@dataclass
+class Usage:
+    """Lifetime resource usage of one user"""
+    jobs: int = 0
+    refused: int = 0
+    units: float = 0.0
+    megapixels: float = 0.0
+    cpu_seconds: float = 0.0
+
+
+class QuotaLedger:
+    """Rolling-window spending per user and in total, with lifetime usage per user"""
+
+    def __init__(self, user_budget: float, global_budget: float, window_seconds: float,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            user_budget: Units one user may spend per window (0 = unlimited)
+            global_budget: Units all users together may spend per window (0 = unlimited)
+            window_seconds: Length of the rolling window
+            clock: Time source, for tests
+        """
+        self.user_budget = user_budget
+        self.global_budget = global_budget
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.usage: Dict[int, Usage] = defaultdict(Usage)
+        self._user_charges: Dict[int, Deque[Tuple[float, float]]] = defaultdict(deque)
+        self._global_charges: Deque[Tuple[float, float]] = deque()
+
+    def _expire(self, charges: Deque[Tuple[float, float]]) -> float:
+        """Drop charges older than the window and return the rest's total"""
+        horizon = self.clock() - self.window_seconds
+        while charges and charges[0][0] <= horizon:
+            charges.popleft()
+        return sum(units for _, units in charges)
+
+    def _retry_after(self, charges: Deque[Tuple[float, float]], budget: float) -> float:
+        """Seconds until enough charges leave the window to get below the budget"""
+        spent = sum(units for _, units in charges)
+        for charged_at, units in charges:
+            spent -= units
+            if spent < budget:
+                return max(0.0, charged_at + self.window_seconds - self.clock())
+        return 0.0
+
+    def check(self, user_id: int) -> Tuple[Optional[str], float]:
+        """
+        Decide whether a user may start a job
+
+        Returns:
+            (None, 0) if admitted, otherwise the exhausted budget ('user' or
+            'global') and the seconds until it has room again
+        """
+        if self.global_budget > 0 and self._expire(self._global_charges) >= self.global_budget:
+            scope, retry_after = 'global', self._retry_after(self._global_charges, self.global_budget)
+        elif self.user_budget > 0 and self._expire(self._user_charges[user_id]) >= self.user_budget:
+            scope, retry_after = 'user', self._retry_after(self._user_charges[user_id], self.user_budget)
+        else:
+            return None, 0.0
+        self.usage[user_id].refused += 1
+        return scope, retry_after
+
+    def charge(self, user_id: int, cost: JobCost) -> float:
+        """Charge a finished job to its user, returning its cost in units"""
+        units = cost.units
+        now = self.clock()
+        self._user_charges[user_id].append((now, units))
+        self._global_charges.append((now, units))
+
+        usage = self.usage[user_id]
+        usage.jobs += 1
+        usage.units += units
+        usage.megapixels += cost.megapixels
+        usage.cpu_seconds += cost.total_cpu_seconds
+        return units
+
+    def spent(self, user_id: Optional[int] = None) -> float:
+        """Units spent in the current window by a user, or by everyone"""
+        if user_id is None:
+            return self._expire(self._global_charges)
+        if user_id not in self._user_charges:
+            return 0.0
+        return self._expire(self._user_charges[user_id])
+
+    def top_users(self, count: int = 10) -> List[Tuple[int, float]]:
+        """Users with the highest spending in the current window, as (user_id, units)"""
+        spending = []
+        for user_id in list(self._user_charges):
+            units = self.spent(user_id)
+            if units > 0:
+                spending.append((user_id, units))
+            else:
+                del self._user_charges[user_id]
+        return sorted(spending, key=lambda item: item[1], reverse=True)[:count]
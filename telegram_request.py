@@ -0,0 +1,171 @@
+"""
+HTTP request layer for talking to the Telegram Bot API
+"""
+import asyncio
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional, Tuple
+
+import httpx
+from telegram.error import NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+
+from config import Config
+from metrics import API_CALLS, API_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class ApiCallCounter:
+    """Number of Bot API calls made while handling one job"""
+
+    def __init__(self):
+        self.count = 0
+
+
+_current_counter: ContextVar[Optional[ApiCallCounter]] = ContextVar('api_call_counter', default=None)
+
+
+@contextmanager
+def count_api_calls() -> Iterator[ApiCallCounter]:
+    """Count every Bot API call made by the current task inside this block"""
+    counter = ApiCallCounter()
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
+
+
+def _api_method(url: str) -> str:
+    """Extract the Bot API method name from a request URL"""
+    if '/file/bot' in url:
+        return 'downloadFile'
+    return url.rsplit('/', 1)[-1]
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records every Bot API round-trip"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        """Count the call, then perform it"""
+        API_CALLS.labels(method=_api_method(url)).inc()
+        counter = _current_counter.get()
+        if counter is not None:
+            counter.count += 1
+        return await super().do_request(url, method, *args, **kwargs)
+
+
+def _is_idempotent(api_method: str) -> bool:
+    """Whether repeating a call can never cause a duplicate message"""
+    return api_method.startswith('get') or api_method == 'downloadFile'
+
+
+def _was_not_sent(error: NetworkError) -> bool:
+    """
+    Whether the request failed before it reached Telegram
+
+    Only a pool timeout (no connection was free) or a failed or timed out
+    connect are certain; read errors, dropped connections and 5xx answers may
+    come after Telegram already handled the call.
+    """
+    return isinstance(error.__cause__, (httpx.PoolTimeout, httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class TelegramRequest(InstrumentedRequest):
+    """
+    Bot API client with a tuned connection pool and a retry layer
+
+    Flood control (429 / RetryAfter) is retried after the delay Telegram asks
+    for. Network errors are retried with exponential backoff when repeating
+    the call is safe: read-only calls and requests that provably never reached
+    Telegram (pool timeouts and failed or timed out connects).
+    """
+
+    def __init__(
+        self,
+        connection_pool_size: int = Config.TELEGRAM_POOL_SIZE,
+        keepalive_expiry: float = Config.TELEGRAM_KEEPALIVE_SECONDS,
+        max_retries: int = Config.TELEGRAM_MAX_RETRIES,
+        connect_timeout: float = Config.TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout: float = Config.TELEGRAM_READ_TIMEOUT,
+        write_timeout: float = Config.TELEGRAM_WRITE_TIMEOUT,
+        media_write_timeout: float = Config.TELEGRAM_MEDIA_WRITE_TIMEOUT,
+        pool_timeout: float = Config.TELEGRAM_POOL_TIMEOUT
+    ):
+        # HTTPXRequest has no keep-alive setting, so the client is built from these (_build_client)
+        self._httpx_settings = {
+            'timeout': httpx.Timeout(
+                connect=connect_timeout, read=read_timeout, write=write_timeout, pool=pool_timeout
+            ),
+            'limits': httpx.Limits(
+                max_connections=connection_pool_size,
+                max_keepalive_connections=connection_pool_size,
+                keepalive_expiry=keepalive_expiry
+            ),
+            'http1': True,
+            'http2': False
+        }
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout,
+            media_write_timeout=media_write_timeout,
+            pool_timeout=pool_timeout
+        )
+        self._max_retries = max_retries
+
+    def _build_client(self) -> httpx.AsyncClient:
+        """Client with our own settings, also when HTTPXRequest rebuilds it after a shutdown"""
+        return httpx.AsyncClient(**self._httpx_settings)
+
+    async def post(self, url: str, *args, **kwargs):
+        """Make a Bot API call, retrying on flood control and safe network errors"""
+        api_method = _api_method(url)
+        attempt = 0
+        while True:
+            try:
+                return await super().post(url, *args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self._max_retries or e.retry_after > Config.TELEGRAM_MAX_RETRY_AFTER_SECONDS:
+                    raise
+                delay = e.retry_after + random.uniform(0, Config.TELEGRAM_RETRY_BACKOFF_SECONDS)
+                reason = 'retry_after'
+            except NetworkError as e:
+                if attempt >= self._max_retries or not (_is_idempotent(api_method) or _was_not_sent(e)):
+                    raise
+                delay = self._backoff(attempt)
+                reason = 'network'
+
+            attempt += 1
+            API_RETRIES.labels(method=api_method, reason=reason).inc()
+            logger.warning(f"Retrying {api_method} in {delay:.1f}s ({reason}, attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        """Perform an HTTP request, retrying file downloads on network errors"""
+        if _api_method(url) != 'downloadFile':
+            return await super().do_request(url, method, *args, **kwargs)
+
+        attempt = 0
+        while True:
+            try:
+                return await super().do_request(url, method, *args, **kwargs)
+            except NetworkError:
+                if attempt >= self._max_retries:
+                    raise
+                delay = self._backoff(attempt)
+
+            attempt += 1
+            API_RETRIES.labels(method='downloadFile', reason='network').inc()
+            logger.warning(f"Retrying file download in {delay:.1f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Exponential backoff with jitter"""
+        base = Config.TELEGRAM_RETRY_BACKOFF_SECONDS * (2 ** attempt)
+        return base + random.uniform(0, Config.TELEGRAM_RETRY_BACKOFF_SECONDS)
@@ -0,0 +1,61 @@
+"""
+Tests for the animation pipeline (stub model)
+"""
+import io
+
+from PIL import Image
+
+from animation import ApngWriter, is_animated_image, process_animation
+from benchmark import StubRemover
+from config import Config
+from image_processor import BackgroundRemover
+
+
+def _gif(colors, size=(64, 48)) -> bytes:
+    frames = [Image.new('RGB', size, color) for color in colors]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)
+    return buffer.getvalue()
+
+
+def test_apng_writer_streams_frames():
+    """Frames written one by one read back as an animation with alpha and durations"""
+    buffer = io.BytesIO()
+    writer = ApngWriter(buffer)
+    for alpha in (0, 128, 255):
+        writer.add(Image.new('RGBA', (20, 10), (255, 0, 0, alpha)), 50)
+    writer.close()
+
+    image = Image.open(io.BytesIO(buffer.getvalue()))
+    assert image.n_frames == 3
+    alphas = []
+    for index in range(3):
+        image.seek(index)
+        alphas.append(image.convert('RGBA').getpixel((0, 0))[3])
+        assert image.info['duration'] == 50
+    assert alphas == [0, 128, 255]
+
+
+def test_model_runs_only_on_keyframes_and_scene_changes(monkeypatch):
+    monkeypatch.setattr(Config, 'ANIMATION_KEYFRAME_INTERVAL', 4)
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    # Ten frames: a scene change at frame 5, keyframe interval after frame 4 and 9
+    # (slightly different colours, or the GIF encoder merges identical frames)
+    data = _gif([(200 + i, 200, 200) for i in range(5)] + [(10 + i, 10, 10) for i in range(5)])
+    assert is_animated_image(data)
+
+    output = io.BytesIO()
+    stats = process_animation(remover, data, 'full', 100, output)
+
+    assert stats == {'frames': 10, 'keyframes': 4}  # frames 0, 4, 5 (scene change), 9
+    result = Image.open(io.BytesIO(output.getvalue()))
+    assert result.n_frames == 10
+    assert result.size == (64, 48)
+
+
+def test_validate_animation_limits_frames(monkeypatch):
+    monkeypatch.setattr(Config, 'ANIMATION_MAX_FRAMES', 3)
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+
+    assert remover.validate_animation(_gif([(0, 0, 0), (255, 255, 255)])) == (True, "")
+    assert remover.validate_animation(_gif([(0, 0, 0), (255, 255, 255)] * 2))[0] is False
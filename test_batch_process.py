@@ -0,0 +1,133 @@
+"""
+Tests for the batch processing CLI (stub model, no weights needed)
+"""
+import json
+import zipfile
+
+import pytest
+
+from PIL import Image
+
+from batch_process import MANIFEST_NAME, BatchProcessor
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from image_processor import BackgroundRemover
+from memory_budget import ThreadMemoryBudget, estimate_job_bytes
+
+
+def make_processor(output_dir, **settings):
+    return BatchProcessor(
+        BackgroundRemover(remover=StubRemover(), model_mode='stub'),
+        str(output_dir), workers=2, queue_size=2, progress_every=0, **settings
+    )
+
+
+def read_manifest(output_dir):
+    with open(output_dir / MANIFEST_NAME) as f:
+        return {entry['name']: entry for entry in map(json.loads, f)}
+
+
+def test_directory_batch_and_resume(tmp_path):
+    """Images are processed once, failures recorded, and a rerun skips finished images"""
+    source = tmp_path / 'in'
+    (source / 'sub').mkdir(parents=True)
+    (source / 'a.jpg').write_bytes(make_synthetic_image(64, 48))
+    (source / 'sub' / 'b.png').write_bytes(make_synthetic_image(48, 64, 'PNG'))
+    (source / 'broken.jpg').write_bytes(b'not an image')
+    (source / 'notes.txt').write_text('ignored')
+    output = tmp_path / 'out'
+
+    stats = make_processor(output).run(str(source))
+
+    assert (stats['processed'], stats['failed'], stats['skipped']) == (2, 1, 0)
+    assert Image.open(output / 'sub' / 'b.png.png').mode == 'RGBA'
+    manifest = read_manifest(output)
+    assert manifest['a.jpg']['status'] == 'ok'
+    assert manifest['broken.jpg']['status'] == 'error'
+
+    stats = make_processor(output).run(str(source))
+    assert (stats['processed'], stats['failed'], stats['skipped']) == (0, 1, 2)
+
+
+def test_zip_source(tmp_path):
+    """Images inside a zip archive are processed without extracting it"""
+    archive_path = tmp_path / 'images.zip'
+    with zipfile.ZipFile(archive_path, 'w') as archive:
+        for i in range(5):
+            archive.writestr(f"catalog/item{i}.jpg", make_synthetic_image(40, 30, seed=i))
+    output = tmp_path / 'out'
+
+    stats = make_processor(output).run(str(archive_path))
+
+    assert stats['processed'] == 5
+    assert sorted(p.name for p in (output / 'catalog').iterdir()) == [f"item{i}.jpg.png" for i in range(5)]
+
+
+def test_inputs_differing_in_extension_keep_separate_results(tmp_path):
+    """a.jpg, a.png and a.webp each get their own result file"""
+    source = tmp_path / 'in'
+    source.mkdir()
+    for seed, extension in enumerate(('jpg', 'png', 'webp')):
+        (source / f"a.{extension}").write_bytes(
+            make_synthetic_image(32 + seed, 24, 'JPEG' if extension == 'jpg' else extension.upper(), seed=seed)
+        )
+    output = tmp_path / 'out'
+
+    stats = make_processor(output).run(str(source))
+
+    assert stats['processed'] == 3
+    assert sorted(p.name for p in output.glob('*.png')) == ['a.jpg.png', 'a.png.png', 'a.webp.png']
+    assert Image.open(output / 'a.webp.png').width == 34
+
+
+def test_resume_with_other_settings_is_refused(tmp_path):
+    """Resuming into a directory made with another mode would mix results of both modes"""
+    source = tmp_path / 'in'
+    source.mkdir()
+    (source / 'a.jpg').write_bytes(make_synthetic_image(32, 24))
+    output = tmp_path / 'out'
+    make_processor(output, mode='soft').run(str(source))
+
+    with pytest.raises(ValueError, match='--mode soft'):
+        make_processor(output, mode='full').run(str(source))
+    assert make_processor(output, mode='soft').run(str(source))['skipped'] == 1
+
+
+def test_large_images_are_tiled_and_budgeted(monkeypatch, tmp_path):
+    """Large inputs take the strip path, and images in flight never exceed the memory budget"""
+    monkeypatch.setattr(Config, 'TILED_MIN_MEGAPIXELS', 0.01)
+    monkeypatch.setattr(Config, 'TILED_MASK_MAX_SIDE', 64)
+    monkeypatch.setattr(Config, 'INFERENCE_MEMORY_MB', 0)
+    source = tmp_path / 'in'
+    source.mkdir()
+    for i in range(4):
+        (source / f"big{i}.jpg").write_bytes(make_synthetic_image(160, 120, seed=i))
+    (source / 'small.jpg').write_bytes(make_synthetic_image(40, 30))
+    seen = []
+
+    class RecordingStub(StubRemover):
+        def process(self, img, type='rgba'):
+            seen.append(img.size)
+            return super().process(img, type)
+
+    class RecordingBudget(ThreadMemoryBudget):
+        peak = 0
+
+        def acquire(self, nbytes):
+            super().acquire(nbytes)
+            RecordingBudget.peak = max(RecordingBudget.peak, self.used)
+
+    processor = BatchProcessor(
+        BackgroundRemover(remover=RecordingStub(), model_mode='stub'),
+        str(tmp_path / 'out'), workers=2, queue_size=2, progress_every=0
+    )
+    one_image = estimate_job_bytes(160, 120)
+    processor.memory_budget = RecordingBudget(one_image * 2)
+
+    stats = processor.run(str(source))
+
+    assert stats['processed'] == 5
+    assert seen.count((64, 48)) == 4 and (40, 30) in seen
+    assert 0 < RecordingBudget.peak <= one_image * 2
+    assert processor.memory_budget.used == 0
+    assert Image.open(tmp_path / 'out' / 'big0.jpg.png').size == (160, 120)
@@ -0,0 +1,52 @@
+"""
+Tests for the benchmark suite (stub model, no weights needed)
+"""
+import copy
+
+from PIL import Image
+
+from benchmark import STAGES, compare_results, mask_metrics, run_benchmark
+
+
+def test_stub_benchmark_reports_every_stage():
+    """A stub run produces latency, stage and throughput numbers for each case"""
+    results = run_benchmark(
+        model_modes=['base'], modes=['full', 'soft'], sizes=[(64, 48)],
+        iterations=2, warmup=0, stub=True
+    )
+
+    assert [(case['model_mode'], case['mode'], case['size']) for case in results['results']] == [
+        ('stub', 'full', '64x48'), ('stub', 'soft', '64x48')
+    ]
+    for case in results['results']:
+        assert set(case['stages']) == set(STAGES)
+        assert case['latency']['p50_ms'] > 0
+        assert case['throughput_ips'] > 0
+
+
+def test_compare_flags_slower_runs():
+    """Latency growth above the threshold is reported as a regression"""
+    baseline = run_benchmark(
+        model_modes=['base'], modes=['full'], sizes=[(64, 48)],
+        iterations=2, warmup=0, stub=True
+    )
+    current = copy.deepcopy(baseline)
+    current['results'][0]['latency']['p50_ms'] *= 2
+
+    assert compare_results(baseline, baseline) == []
+    regressions = compare_results(current, baseline, threshold=0.10)
+    assert len(regressions) == 1
+    assert 'p50 latency' in regressions[0]
+
+
+def test_mask_metrics():
+    """Identical masks agree fully, a half-covered mask has IoU 0.5"""
+    reference = Image.new('L', (10, 10), 0)
+    reference.paste(255, (0, 0, 10, 10))
+    half = Image.new('L', (10, 10), 0)
+    half.paste(255, (0, 0, 5, 10))
+
+    assert mask_metrics(reference, reference) == {'mae': 0.0, 'iou': 1.0}
+    metrics = mask_metrics(reference, half)
+    assert metrics['iou'] == 0.5
+    assert metrics['mae'] == 127.5
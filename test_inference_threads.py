@@ -0,0 +1,28 @@
+"""
+Tests for the inference thread budget
+"""
+from benchmark import run_thread_sweep, thread_configurations
+from inference_threads import cpu_slices, resolve_thread_settings
+
+
+def test_auto_settings_split_cores_between_workers():
+    assert resolve_thread_settings(0, 0, cores=16) == (4, 4)
+    assert resolve_thread_settings(2, 0, cores=16) == (2, 8)
+    assert resolve_thread_settings(3, 2, cores=16) == (3, 2)
+    assert resolve_thread_settings(0, 0, cores=2) == (1, 2)
+
+
+def test_cpu_slices_do_not_overlap():
+    assert cpu_slices(2, 2, cpus=[0, 1, 2, 3]) == [[0, 1], [2, 3]]
+    # More threads than cores wrap around instead of failing
+    assert cpu_slices(2, 2, cpus=[0, 1]) == [[0, 1], [0, 1]]
+
+
+def test_thread_sweep_reports_best_setting():
+    """The stub sweep measures every configuration and picks the fastest"""
+    assert thread_configurations(4) == [(1, 4), (2, 2), (4, 1), (4, 4)]
+
+    sweep = run_thread_sweep('base', (64, 48), iterations=2, configs=[(1, 1), (2, 1)], stub=True)
+
+    assert [(case['workers'], case['threads_per_worker']) for case in sweep['thread_sweep']] == [(1, 1), (2, 1)]
+    assert sweep['best'] in sweep['thread_sweep']
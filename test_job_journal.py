@@ -0,0 +1,287 @@
+"""
+Tests for the job journal and graceful drain (stub model, fake Bot API)
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+from telegram import Update
+
+import image_processor
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from fake_bot_api import FakeBotApi
+from job_journal import JobJournal, is_job_update
+from media_groups import MediaGroupBuffer
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def make_photo_update(update_id: int, user_id: int = 1, file_id: str = 'photo-1', **fields) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+            'photo': [{'file_id': file_id, 'file_unique_id': file_id, 'width': 96, 'height': 64}],
+            **fields
+        }
+    }
+
+
+def test_journal_keeps_unfinished_jobs_in_order(tmp_path):
+    """Entries stay until completed and are replayed in update order"""
+    journal = JobJournal(str(tmp_path))
+    for update_id in (3, 1, 2):
+        journal.record(Update.de_json(make_photo_update(update_id), None))
+    journal.complete(1)
+
+    assert len(journal) == 2
+    assert [update['update_id'] for update in JobJournal(str(tmp_path)).pending()] == [3, 2]
+
+
+def test_held_entries_survive_their_handler(tmp_path):
+    """An album item's entry outlives its handler until the album job completes it"""
+    journal = JobJournal(str(tmp_path))
+    journal.record(Update.de_json(make_photo_update(1, media_group_id='album'), None))
+    journal.hold(1)
+    journal.finish(1)
+    assert len(journal) == 1
+    journal.complete(1)
+    assert len(journal) == 0
+
+
+def test_closed_journal_keeps_everything(tmp_path):
+    """After the drain deadline no entry is removed, so abandoned jobs are replayed"""
+    journal = JobJournal(str(tmp_path))
+    journal.record(Update.de_json(make_photo_update(1), None))
+    journal.close()
+    journal.finish(1)
+    assert len(journal) == 1
+
+
+def test_stale_and_broken_entries_are_dropped(tmp_path):
+    """Entries older than the maximum age and unreadable files are deleted, not replayed"""
+    journal = JobJournal(str(tmp_path), max_age_seconds=60)
+    journal.record(Update.de_json(make_photo_update(1), None))
+    path = tmp_path / '1.json'
+    entry = json.loads(path.read_text())
+    entry['received'] -= 120
+    path.write_text(json.dumps(entry))
+    (tmp_path / '2.json').write_text('{"received": ')
+
+    assert journal.pending() == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_redelivered_replayed_update_is_dropped(tmp_path):
+    """After a replay, Telegram's second delivery of the same update is refused"""
+    JobJournal(str(tmp_path)).record(Update.de_json(make_photo_update(7), None))
+    journal = JobJournal(str(tmp_path))
+    replayed = [Update.de_json(data, None) for data in journal.replay()]
+
+    assert [update.update_id for update in replayed] == [7]
+    assert journal.record(replayed[0])
+    assert not journal.record(Update.de_json(make_photo_update(7), None))
+    assert journal.record(Update.de_json(make_photo_update(8), None))
+
+
+def test_only_media_updates_are_jobs():
+    """Only updates carrying media are journaled"""
+    assert is_job_update(Update.de_json(make_photo_update(1), None))
+    text = make_photo_update(2)
+    del text['message']['photo']
+    text['message']['text'] = 'mode:semi'
+    assert not is_job_update(Update.de_json(text, None))
+
+
+@pytest.mark.asyncio
+async def test_processor_journals_until_the_handler_returns(tmp_path):
+    """Updates are journaled on arrival, also while waiting behind their chat"""
+    journal = JobJournal(str(tmp_path))
+    processor = ChatOrderedUpdateProcessor(8, journal=journal)
+    release = asyncio.Event()
+
+    async def handler():
+        await release.wait()
+
+    # The second update waits behind the first one of its chat, and is journaled already
+    tasks = [
+        asyncio.create_task(processor.process_update(Update.de_json(make_photo_update(update_id), None), handler()))
+        for update_id in (1, 2)
+    ]
+    await asyncio.sleep(0.01)
+    assert len(journal) == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert len(journal) == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_job_stays_journaled(tmp_path):
+    """A handler cancelled at shutdown leaves its entry for the replay"""
+    journal = JobJournal(str(tmp_path))
+    processor = ChatOrderedUpdateProcessor(8, journal=journal)
+    task = asyncio.create_task(
+        processor.process_update(Update.de_json(make_photo_update(1), None), asyncio.sleep(10))
+    )
+    await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    assert [update['update_id'] for update in journal.pending()] == [1]
+
+
+@pytest.mark.asyncio
+async def test_flush_also_handles_albums_that_arrive_while_draining():
+    """Album items dispatched during the drain start new groups, which the flush waits for too"""
+    handled = []
+
+    async def on_complete(updates):
+        handled.append([update.update_id for update in updates])
+        if len(handled) == 1:
+            # A queued update of another album is dispatched while the first one runs
+            buffer.add(Update.de_json(make_photo_update(2, media_group_id='late'), None))
+
+    buffer = MediaGroupBuffer(60, on_complete)
+    buffer.add(Update.de_json(make_photo_update(1, media_group_id='first'), None))
+    await asyncio.wait_for(buffer.flush(), timeout=5)
+    assert handled == [[1], [2]]
+
+
+@pytest.mark.asyncio
+async def test_cancel_stops_buffered_and_running_albums():
+    """At the drain deadline album timers and album jobs are cancelled"""
+    started = asyncio.Event()
+    finished = []
+
+    async def on_complete(updates):
+        started.set()
+        await asyncio.sleep(10)
+        finished.append(updates)
+
+    buffer = MediaGroupBuffer(0, on_complete)
+    buffer.add(Update.de_json(make_photo_update(1, media_group_id='running'), None))
+    await asyncio.wait_for(started.wait(), timeout=5)
+    buffer.wait = 60
+    buffer.add(Update.de_json(make_photo_update(2, media_group_id='buffered'), None))
+
+    buffer.cancel()
+    await asyncio.sleep(0.01)
+    assert finished == [] and buffer.pending_groups == 0
+    assert all(task.done() for task in asyncio.all_tasks() if task is not asyncio.current_task())
+
+
+class SlowStubRemover(StubRemover):
+    """Stub model that takes a while and tells when it started"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.started = threading.Event()
+
+    def process(self, img, type='rgba'):
+        self.started.set()
+        time.sleep(self.delay)
+        return super().process(img, type)
+
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    api = FakeBotApi(poll_timeout=0.2)
+    api.start()
+    api.add_file('photo-1', make_synthetic_image(96, 64))
+    monkeypatch.setattr(Config, 'BOT_TOKEN', '123456:JOURNAL')
+    monkeypatch.setattr(Config, 'TELEGRAM_API_BASE_URL', api.base_url)
+    monkeypatch.setattr(Config, 'TELEGRAM_API_FILE_URL', api.base_file_url)
+    monkeypatch.setattr(Config, 'JOB_JOURNAL_DIR', str(tmp_path / 'journal'))
+    monkeypatch.setattr(Config, 'STATUS_MESSAGE_MODE', 'none')
+    monkeypatch.setattr(Config, 'MASK_CACHE_SIZE', 0)
+    yield api
+    api.stop()
+
+
+def _use_model(monkeypatch, model):
+    """Make the bot use a stub model, whether or not bot was imported before"""
+    remover = image_processor.BackgroundRemover(remover=model, model_mode='stub')
+    monkeypatch.setattr(image_processor, '_background_remover', remover)
+    import bot
+    return bot
+
+
+async def _wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def _results(api):
+    return [request for request in api.requests if request.method == 'sendDocument']
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_running_jobs(monkeypatch, fake_api):
+    """A job running at stop() finishes and is answered before shutdown"""
+    model = SlowStubRemover(0.5)
+    bot = _use_model(monkeypatch, model)
+    monkeypatch.setattr(Config, 'DRAIN_TIMEOUT_SECONDS', 10.0)
+
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    fake_api.push_update({'message': make_photo_update(0, user_id=101)['message']})
+    await _wait_for(model.started.is_set)
+    await instance.stop()
+
+    assert len(_results(fake_api)) == 1
+    assert len(instance.journal) == 0
+
+
+@pytest.mark.asyncio
+async def test_jobs_past_the_drain_deadline_are_replayed(monkeypatch, fake_api):
+    """A job cut off by the drain deadline is answered by the next start"""
+    model = SlowStubRemover(1.0)
+    bot = _use_model(monkeypatch, model)
+    monkeypatch.setattr(Config, 'DRAIN_TIMEOUT_SECONDS', 0.1)
+
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    fake_api.push_update({'message': make_photo_update(0, user_id=102)['message']})
+    await _wait_for(model.started.is_set)
+    await instance.stop()
+    assert _results(fake_api) == []
+    assert len(instance.journal) == 1
+
+    # The next start picks the job up from the journal; Telegram will not send it again
+    _use_model(monkeypatch, StubRemover())
+    restarted = bot.BackgroundRemovalBot()
+    await restarted.start()
+    try:
+        await _wait_for(lambda: _results(fake_api))
+    finally:
+        monkeypatch.setattr(Config, 'DRAIN_TIMEOUT_SECONDS', 10.0)
+        await restarted.stop()
+    assert _results(fake_api)[0].chat_id == 102
+    assert len(restarted.journal) == 0
+    # The abandoned handler of the first run was cancelled, not left running
+    await _wait_for(lambda: len(asyncio.all_tasks()) == 1)
+
+
+@pytest.mark.asyncio
+async def test_replayed_update_polled_again_runs_once(monkeypatch, fake_api):
+    """An update both replayed from the journal and redelivered by Telegram gets one result"""
+    bot = _use_model(monkeypatch, StubRemover())
+    update_id = fake_api.push_update({'message': make_photo_update(0, user_id=103)['message']})
+    JobJournal(Config.JOB_JOURNAL_DIR).record(Update.de_json(make_photo_update(update_id, user_id=103), None))
+
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    try:
+        await _wait_for(lambda: _results(fake_api) and len(instance.journal) == 0)
+        await asyncio.sleep(0.5)
+    finally:
+        await instance.stop()
+    assert len(_results(fake_api)) == 1
@@ -0,0 +1,176 @@
+"""
+Tests for the job queue and the split frontend / worker deployment (stub model)
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmark import StubRemover, make_synthetic_image
+from image_processor import BackgroundRemover
+from job_queue import Job, JobQueue, QueuedRemover, SqliteJobQueue, open_job_queue
+from worker import run_worker
+
+
+def test_jobs_are_taken_in_order_and_results_collected(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    first, second = Job('image', b'one'), Job('image', b'two', mode='soft')
+    queue.put(first)
+    queue.put(second)
+    assert queue.depth() == 2
+
+    taken = queue.take(timeout=0)
+    assert (taken.id, taken.data) == (first.id, b'one')
+    assert queue.take(timeout=0).mode == 'soft'
+    assert queue.take(timeout=0) is None
+
+    queue.finish(first.id, b'result')
+    queue.finish(second.id, None)
+    assert queue.collect([first.id, second.id]) == {first.id: b'result', second.id: None}
+    assert queue.collect([first.id, second.id]) == {}
+
+
+def test_job_of_a_dead_worker_is_handed_out_again(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'), lease_seconds=0.1)
+    job = Job('image', b'data')
+    queue.put(job)
+    assert queue.take(timeout=0).id == job.id
+    assert queue.take(timeout=0) is None
+
+    time.sleep(0.15)
+    assert queue.take(timeout=0).id == job.id
+
+
+def test_result_of_a_slow_worker_is_kept_after_its_lease_expired(tmp_path):
+    """A worker finishing after its lease was handed on still delivers the result"""
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'), lease_seconds=0.05)
+    job = Job('image', b'data')
+    queue.put(job)
+    queue.take(timeout=0)
+    time.sleep(0.1)
+    assert queue.take(timeout=0).id == job.id
+
+    queue.finish(job.id, b'first')
+    queue.finish(job.id, b'second')
+    assert queue.collect([job.id]) == {job.id: b'first'}
+
+
+def test_renewed_lease_keeps_the_job_with_its_worker(tmp_path):
+    """A worker renewing its lease keeps the job, even past the original lease"""
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'), lease_seconds=0.2)
+    job = Job('image', b'data')
+    queue.put(job)
+    queue.take(timeout=0)
+    for _ in range(3):
+        time.sleep(0.1)
+        queue.renew(job.id)
+        assert queue.take(timeout=0) is None
+
+    time.sleep(0.25)
+    assert queue.take(timeout=0).id == job.id
+
+
+@pytest.mark.asyncio
+async def test_worker_renews_the_lease_of_slow_jobs(tmp_path):
+    """A job running longer than the lease is not handed to a second worker"""
+    class SlowRemover:
+        async def process_image(self, data, **options):
+            await asyncio.sleep(0.5)
+            return b'result'
+
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'), lease_seconds=0.15)
+    job = Job('image', b'data')
+    queue.put(job)
+    stop = asyncio.Event()
+    worker = asyncio.create_task(
+        run_worker(queue, SlowRemover(), concurrency=1, stop=stop, poll_timeout=0.02, renew_interval=0.05)
+    )
+    await asyncio.sleep(0.3)
+    assert queue.take(timeout=0) is None
+    stop.set()
+    assert await worker == 1
+    assert queue.collect([job.id]) == {job.id: b'result'}
+
+
+def test_cancelled_job_is_skipped(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    job = Job('image', b'data')
+    queue.put(job)
+    queue.cancel(job.id)
+    assert queue.take(timeout=0) is None
+
+    queue.put(running := Job('image', b'data'))
+    queue.take(timeout=0)
+    queue.cancel(running.id)
+    queue.finish(running.id, b'late')
+    assert queue.collect([running.id]) == {}
+
+
+def test_queue_url_selects_the_backend(tmp_path):
+    assert isinstance(open_job_queue(f"sqlite:///{tmp_path}/jobs.db"), SqliteJobQueue)
+    assert isinstance(open_job_queue(str(tmp_path / 'other.db')), SqliteJobQueue)
+
+
+def test_backend_must_implement_the_whole_interface():
+    """A backend missing a method fails when it is created, not when a worker calls it"""
+    class PartialQueue(JobQueue):
+        def put(self, job):
+            pass
+
+    with pytest.raises(TypeError, match='renew'):
+        PartialQueue()
+
+
+@pytest.mark.asyncio
+async def test_frontend_gets_results_from_workers(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'), poll_interval=0.01)
+    frontend = QueuedRemover(queue, poll_interval=0.01)
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    stop = asyncio.Event()
+    worker = asyncio.create_task(run_worker(queue, remover, concurrency=2, stop=stop, poll_timeout=0.05))
+
+    image = make_synthetic_image(64, 48)
+    results = await asyncio.gather(
+        frontend.process_image(image, mode='full'),
+        frontend.process_image(image, mode='soft'),
+        frontend.process_image(image, mode='full', preview_side=32),
+        frontend.process_image(b'not an image')
+    )
+    stop.set()
+    assert await worker == 4
+
+    assert all(result.startswith(b'\x89PNG') for result in results[:3])
+    assert results[3] is None
+    assert frontend.validate_image(image) == (True, "")
+
+
+@pytest.mark.asyncio
+async def test_frontend_timeout_cancels_the_job(tmp_path):
+    queue = SqliteJobQueue(str(tmp_path / 'jobs.db'))
+    frontend = QueuedRemover(queue, poll_interval=0.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(frontend.process_image(b'data'), timeout=0.05)
+    await asyncio.sleep(0.05)
+    assert queue.depth() == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_process_serves_the_queue(tmp_path):
+    """A separate worker.py process picks up jobs from the shared SQLite queue"""
+    url = f"sqlite:///{tmp_path}/jobs.db"
+    frontend = QueuedRemover(open_job_queue(url), poll_interval=0.02)
+    env = dict(os.environ, METRICS_PORT='0', MEMORY_BUDGET_MB='-1')
+    worker = subprocess.Popen(
+        [sys.executable, 'worker.py', '--queue', url, '--stub', '--concurrency', '1'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        result = await asyncio.wait_for(frontend.process_image(make_synthetic_image(64, 48)), timeout=30)
+        assert result.startswith(b'\x89PNG')
+    finally:
+        worker.terminate()
+        assert worker.wait(timeout=10) == 0
@@ -0,0 +1,243 @@
+"""
+End-to-end test of the bot against the fake Bot API server (stub model)
+"""
+import asyncio
+import io
+import json
+import time
+
+import pytest
+from PIL import Image
+
+import image_processor
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from fake_bot_api import FakeBotApi
+from load_test import parse_mix, run_load_test
+
+
+@pytest.mark.asyncio
+async def test_bot_answers_every_image(monkeypatch):
+    """Every generated image gets a document back through the fake API"""
+    # run_load_test reconfigures the bot; restore the settings afterwards
+    for name in ('BOT_TOKEN', 'TELEGRAM_API_BASE_URL', 'TELEGRAM_API_FILE_URL', 'MASK_CACHE_SIZE',
+                 'JOB_JOURNAL_DIR'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(image_processor, '_background_remover', None)
+
+    report = await run_load_test(
+        users=3, rate=8.0, duration=1.0, stub=True, drain_timeout=10.0,
+        mix=parse_mix('96x64:photo:1,128x96:document:1'), mode_change_probability=0.3
+    )
+
+    assert report['sent'] > 0
+    assert report['completed'] == report['sent'] - sum(report['errors'].values())
+    assert report['errors'].get('general_error', 0) == 0
+    assert report['unanswered'] == 0
+    assert report['api_calls']['sendDocument'] == report['completed']
+
+
+@pytest.mark.asyncio
+async def test_progressive_preview_is_replaced_by_full_result(monkeypatch):
+    """Each image first gets a preview document, which is then edited into the full result"""
+    for name in ('BOT_TOKEN', 'TELEGRAM_API_BASE_URL', 'TELEGRAM_API_FILE_URL', 'MASK_CACHE_SIZE',
+                 'JOB_JOURNAL_DIR', 'PROGRESSIVE_PREVIEW'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(Config, 'PREVIEW_MIN_MEGAPIXELS', 0.0)
+    monkeypatch.setattr(image_processor, '_background_remover', None)
+
+    report = await run_load_test(
+        users=2, rate=6.0, duration=1.0, stub=True, drain_timeout=10.0, progressive=True,
+        mix=parse_mix('128x96:document:1'), mode_change_probability=0.0
+    )
+
+    assert report['completed'] > 0, report
+    assert report['unanswered'] == 0, report
+    assert report['api_calls']['sendDocument'] == report['completed'], report
+    assert report['api_calls']['editMessageMedia'] == report['completed'], report
+
+
+@pytest.mark.asyncio
+async def test_album_is_answered_with_one_media_group(monkeypatch):
+    """Albums are processed as one job and answered with a single sendMediaGroup"""
+    for name in ('BOT_TOKEN', 'TELEGRAM_API_BASE_URL', 'TELEGRAM_API_FILE_URL', 'MASK_CACHE_SIZE',
+                 'JOB_JOURNAL_DIR'):
+        monkeypatch.setattr(Config, name, getattr(Config, name))
+    monkeypatch.setattr(Config, 'MEDIA_GROUP_WAIT_SECONDS', 0.2)
+    monkeypatch.setattr(image_processor, '_background_remover', None)
+
+    report = await run_load_test(
+        users=50, rate=3.0, duration=1.0, stub=True, drain_timeout=10.0, album_probability=1.0,
+        mix=parse_mix('96x64:photo:1'), mode_change_probability=0.0, seed=1
+    )
+
+    assert report['completed'] == report['sent'] > 0, report
+    assert report['unanswered'] == 0, report
+    assert 'sendDocument' not in report['api_calls']
+    assert report['api_calls']['sendMediaGroup'] < report['sent']
+
+
+class _FlakyRemover(image_processor.BackgroundRemover):
+    """Stub remover whose previews work but whose full-resolution jobs fail or hang"""
+
+    def __init__(self, full_result: str):
+        super().__init__(remover=StubRemover(), model_mode='stub')
+        self.full_result = full_result
+        self.cancelled = asyncio.Event()
+
+    async def process_image(self, image_bytes, mode='full', opacity=100, preview_side=0):
+        if preview_side:
+            return await super().process_image(image_bytes, mode, opacity, preview_side)
+        if self.full_result == 'fail':
+            return None
+        try:
+            await asyncio.sleep(30)
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    api = FakeBotApi(poll_timeout=0.2)
+    api.start()
+    api.add_file('photo-1', make_synthetic_image(128, 96))
+    monkeypatch.setattr(Config, 'BOT_TOKEN', '123456:FAKE')
+    monkeypatch.setattr(Config, 'TELEGRAM_API_BASE_URL', api.base_url)
+    monkeypatch.setattr(Config, 'TELEGRAM_API_FILE_URL', api.base_file_url)
+    monkeypatch.setattr(Config, 'JOB_JOURNAL_DIR', str(tmp_path / 'journal'))
+    yield api
+    api.stop()
+
+
+async def _send_photo(api):
+    photo = [{'file_id': 'photo-1', 'file_unique_id': 'photo-1', 'width': 128, 'height': 96}]
+    api.push_update({'message': {
+        'message_id': 1, 'date': int(time.time()), 'chat': {'id': 5, 'type': 'private'},
+        'from': {'id': 5, 'is_bot': False, 'first_name': 'User'}, 'photo': photo
+    }})
+    deadline = time.monotonic() + 10
+    while not any(r.method in ('editMessageCaption', 'sendMessage') for r in api.requests):
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+@pytest.mark.asyncio
+async def test_failed_full_job_marks_the_preview(monkeypatch, fake_api):
+    """When the full result fails after a preview was sent, the preview's caption reports the error"""
+    monkeypatch.setattr(Config, 'PROGRESSIVE_PREVIEW', True)
+    monkeypatch.setattr(Config, 'PREVIEW_MIN_MEGAPIXELS', 0.0)
+    remover = _FlakyRemover('fail')
+    monkeypatch.setattr(image_processor, '_background_remover', remover)
+    import bot
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    try:
+        await _send_photo(fake_api)
+    finally:
+        await instance.stop()
+
+    methods = [r.method for r in fake_api.requests]
+    assert methods.count('sendDocument') == 1 and 'editMessageMedia' not in methods
+    captions = [r.params['caption'] for r in fake_api.requests if r.method == 'editMessageCaption']
+    assert captions == [Config.ERROR_MESSAGES['processing_error']]
+
+
+@pytest.mark.asyncio
+async def test_full_job_is_cancelled_when_sending_the_preview_fails(monkeypatch, fake_api):
+    """An error while sending the status or preview does not leave the full job running"""
+    monkeypatch.setattr(Config, 'PROGRESSIVE_PREVIEW', True)
+    monkeypatch.setattr(Config, 'PREVIEW_MIN_MEGAPIXELS', 0.0)
+    remover = _FlakyRemover('hang')
+    monkeypatch.setattr(image_processor, '_background_remover', remover)
+    import bot
+    instance = bot.BackgroundRemovalBot()
+
+    async def broken_preview(*args):
+        raise RuntimeError("preview upload failed")
+
+    monkeypatch.setattr(instance, '_send_preview', broken_preview)
+    await instance.start()
+    try:
+        await _send_photo(fake_api)
+        await asyncio.wait_for(remover.cancelled.wait(), timeout=5)
+    finally:
+        await instance.stop()
+
+    texts = [r.params['text'] for r in fake_api.requests if r.method == 'sendMessage']
+    assert texts == [Config.ERROR_MESSAGES['general_error']]
+
+
+@pytest.mark.asyncio
+async def test_album_reports_skipped_images(monkeypatch, fake_api):
+    """Album items that can not be used are listed in the reply with the reason"""
+    monkeypatch.setattr(Config, 'MEDIA_GROUP_WAIT_SECONDS', 0.1)
+    monkeypatch.setattr(Config, 'ALBUM_REPLY', 'media_group')
+    fake_api.add_file('broken', b'not an image')
+    remover = image_processor.BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    monkeypatch.setattr(image_processor, '_background_remover', remover)
+    import bot
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    try:
+        for message_id, file_id in enumerate(['photo-1', 'broken', 'photo-1'], 1):
+            photo = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 128, 'height': 96}]
+            fake_api.push_update({'message': {
+                'message_id': message_id, 'date': int(time.time()), 'chat': {'id': 6, 'type': 'private'},
+                'from': {'id': 6, 'is_bot': False, 'first_name': 'User'}, 'photo': photo,
+                'media_group_id': 'album'
+            }})
+        deadline = time.monotonic() + 10
+        while not any(r.method == 'sendMediaGroup' for r in fake_api.requests):
+            assert time.monotonic() < deadline, "timed out"
+            await asyncio.sleep(0.02)
+    finally:
+        await instance.stop()
+
+    reply = next(r for r in fake_api.requests if r.method == 'sendMediaGroup')
+    caption = json.loads(reply.params['media'])[0]['caption']
+    assert '1 image(s) skipped' in caption
+    assert 'Image 2: Invalid image file' in caption
+
+
+@pytest.mark.asyncio
+async def test_gif_sent_as_a_file_reaches_the_animation_handler(monkeypatch, fake_api):
+    """A GIF document matches both handlers and is handled as an animation"""
+    frames = [Image.new('RGB', (64, 48), color) for color in ('red', 'blue')]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)
+    fake_api.add_file('gif-1', buffer.getvalue())
+    remover = image_processor.BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    monkeypatch.setattr(image_processor, '_background_remover', remover)
+    import bot
+    handled = []
+
+    def spy(name):
+        handler = getattr(bot.BackgroundRemovalBot, name)
+
+        async def wrapper(self, update, context):
+            handled.append(name)
+            await handler(self, update, context)
+        monkeypatch.setattr(bot.BackgroundRemovalBot, name, wrapper)
+
+    spy('handle_animation')
+    spy('handle_document')
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    try:
+        media = {'file_id': 'gif-1', 'file_unique_id': 'gif-1', 'file_name': 'cat.gif', 'mime_type': 'image/gif'}
+        fake_api.push_update({'message': {
+            'message_id': 1, 'date': int(time.time()), 'chat': {'id': 7, 'type': 'private'},
+            'from': {'id': 7, 'is_bot': False, 'first_name': 'User'},
+            'animation': dict(media, width=64, height=48, duration=1), 'document': media
+        }})
+        deadline = time.monotonic() + 10
+        while not any(r.method in ('sendDocument', 'sendMessage') for r in fake_api.requests):
+            assert time.monotonic() < deadline, "timed out"
+            await asyncio.sleep(0.02)
+    finally:
+        await instance.stop()
+
+    assert handled == ['handle_animation']
+    reply = next(r for r in fake_api.requests if r.method == 'sendDocument')
+    assert Image.open(io.BytesIO(reply.files['document'])).n_frames == 2
@@ -0,0 +1,56 @@
+"""
+Tests for low-resolution mask inference and guided upsampling
+"""
+import numpy as np
+from PIL import Image, ImageDraw
+
+from benchmark import StubRemover, mask_metrics
+from image_processor import BackgroundRemover
+from mask_upsampling import box_filter, inference_size, upsample_mask
+
+
+def _scene(width: int = 400, height: int = 300) -> Image.Image:
+    image = Image.new('RGB', (width, height), (60, 90, 140))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse([width * 0.2, height * 0.2, width * 0.7, height * 0.9], fill=(235, 210, 170))
+    draw.polygon([(width * 0.6, height * 0.1), (width * 0.9, height * 0.5), (width * 0.55, height * 0.6)],
+                 fill=(240, 225, 200))
+    return image
+
+
+def _threshold_mask(image: Image.Image) -> Image.Image:
+    """A 'model' that is exact at any resolution: bright pixels are foreground"""
+    return image.convert('L').point(lambda value: 255 if value > 150 else 0)
+
+
+def test_box_filter_matches_windowed_mean():
+    x = np.arange(30, dtype=np.float64).reshape(5, 6)
+    expected = np.array([[x[max(0, i - 1):i + 2, max(0, j - 1):j + 2].mean() for j in range(6)] for i in range(5)])
+    assert np.allclose(box_filter(x, 1), expected)
+
+
+def test_guided_upsampling_recovers_edges():
+    """Guided upsampling of a 4x smaller mask is closer to the full mask than bilinear"""
+    image = _scene()
+    reference = _threshold_mask(image)
+    low = _threshold_mask(image.resize(inference_size(image.size, 100), Image.BILINEAR))
+
+    guided = mask_metrics(reference, upsample_mask(low, image, 'guided'))
+    bilinear = mask_metrics(reference, upsample_mask(low, image, 'bilinear'))
+
+    assert guided['mae'] < bilinear['mae']
+    assert guided['iou'] > 0.98
+
+
+def test_low_resolution_inference_returns_full_size_mask():
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    remover.mask_max_side = 128
+    image = _scene()
+
+    mask = remover._get_mask(image)
+    soft = remover._composite(image, mask, 'soft', 100)
+
+    assert mask.size == image.size
+    assert soft.size == image.size
+    assert inference_size((400, 300), 128) == (128, 96)
+    assert inference_size((400, 300), 0) == (400, 300)
@@ -0,0 +1,201 @@
+"""
+Tests for the memory budget and the recycling worker pool (stub model)
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from image_processor import BackgroundRemover
+from memory_budget import MemoryBudget, estimate_job_bytes
+import worker_pool
+from worker_pool import WorkerPool
+
+
+def test_job_estimate_scales_with_pixels(monkeypatch):
+    """The estimate of an untiled job grows linearly with its pixel count"""
+    monkeypatch.setattr(Config, 'JOB_BYTES_PER_PIXEL', 24)
+    monkeypatch.setattr(Config, 'INFERENCE_MEMORY_MB', 0)
+    assert estimate_job_bytes(4096, 4096) == 4096 * 4096 * 24
+    assert estimate_job_bytes(2048, 2048) * 4 == estimate_job_bytes(4096, 4096)
+
+
+@pytest.mark.asyncio
+async def test_budget_admits_jobs_in_order_while_they_fit():
+    """Jobs start in arrival order as long as their estimates fit in the budget"""
+    budget = MemoryBudget(100)
+    started = []
+    release = asyncio.Event()
+
+    async def job(name, nbytes):
+        async with budget.reserve(nbytes):
+            started.append(name)
+            await release.wait()
+
+    tasks = [asyncio.create_task(job(name, nbytes)) for name, nbytes in
+             [('a', 60), ('b', 30), ('big', 50), ('small', 5)]]
+    await asyncio.sleep(0.01)
+    # 'small' would fit, but does not overtake the large job waiting before it
+    assert started == ['a', 'b']
+    assert budget.used == 90
+    assert budget.waiting == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert started == ['a', 'b', 'big', 'small']
+    assert budget.used == 0
+    assert budget.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_job_larger_than_budget_runs_alone():
+    """A job above the whole budget still runs, but only once nothing else does"""
+    budget = MemoryBudget(100)
+    running = []
+    peak = []
+
+    async def job(name, nbytes):
+        async with budget.reserve(nbytes):
+            running.append(name)
+            peak.append(list(running))
+            await asyncio.sleep(0.01)
+            running.remove(name)
+
+    await asyncio.gather(job('huge', 500), job('small', 10))
+    assert peak == [['huge'], ['small']]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_block_the_queue():
+    """A job cancelled while waiting gives up its place in the queue"""
+    budget = MemoryBudget(100)
+    async with budget.reserve(80):
+        waiter = asyncio.create_task(budget.reserve(50).__aenter__())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert budget.waiting == 0
+    async with budget.reserve(100):
+        assert budget.used == 100
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_is_replaced_above_rss_limit_without_dropping_jobs(monkeypatch):
+    """A pool whose worker exceeds the RSS limit is replaced and all jobs still finish"""
+    monkeypatch.setattr(Config, 'MASK_CACHE_SIZE', 0)
+    # Every worker is over a 1 byte limit, so the pool is replaced after each job
+    pool = WorkerPool(1, max_jobs=0, max_rss_bytes=1, remover=StubRemover(),
+                      model_mode='base', variants=['base'], threads=1)
+    try:
+        first_pool = pool._pool
+        image = make_synthetic_image(64, 48, 'PNG')
+        results = await asyncio.gather(*[
+            pool.run('process', image, 'full', 100, 0, 'base') for _ in range(3)
+        ])
+        assert all(result and result.startswith(b'\x89PNG') for result in results)
+        assert pool._pool is not first_pool
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_image_in_worker_processes(monkeypatch):
+    """With INFERENCE_PROCESSES set, images are processed in recycled worker processes"""
+    monkeypatch.setattr(Config, 'INFERENCE_PROCESSES', 1)
+    monkeypatch.setattr(Config, 'WORKER_MAX_JOBS', 1)
+    monkeypatch.setattr(Config, 'MEMORY_BUDGET_MB', 64)
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='base')
+    try:
+        assert remover.removers == {}
+        image = make_synthetic_image(64, 48)
+        outputs = await asyncio.gather(*[remover.process_image(image, mode='full') for _ in range(2)])
+        assert all(output and output.startswith(b'\x89PNG') for output in outputs)
+        assert remover.memory_budget.used == 0
+        # One job per worker: each job went to a fresh pool
+        assert remover.worker_pool._pool_jobs == 0
+    finally:
+        remover.worker_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_shutdown_without_waiting_cancels_queued_jobs_before_python_3_9(monkeypatch):
+    """Without cancel_futures (Python 3.8) jobs not yet picked up are cancelled by hand"""
+    monkeypatch.setattr(worker_pool, '_HAS_CANCEL_FUTURES', False)
+    pool = WorkerPool(1, max_jobs=0, max_rss_bytes=0, remover=StubRemover(),
+                      model_mode='base', variants=['base'], threads=1)
+    image = make_synthetic_image(64, 48, 'PNG')
+    jobs = [asyncio.ensure_future(pool.run('process', image, 'full', 100, 0, 'base')) for _ in range(6)]
+    await asyncio.sleep(0)
+    pool.shutdown(wait=False)
+
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    assert any(isinstance(result, asyncio.CancelledError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_job_keeps_its_budget_until_the_thread_finishes(monkeypatch):
+    """A job cancelled by a timeout still holds its memory while its executor thread runs"""
+    monkeypatch.setattr(Config, 'MEMORY_BUDGET_MB', 64)
+    finished = threading.Event()
+
+    class SlowStub(StubRemover):
+        def process(self, img, type='rgba'):
+            time.sleep(0.3)
+            result = super().process(img, type)
+            finished.set()
+            return result
+
+    remover = BackgroundRemover(remover=SlowStub(), model_mode='stub')
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(remover.process_image(make_synthetic_image(64, 48)), timeout=0.05)
+
+    assert remover.memory_budget.used > 0 and remover._active_jobs == 1
+    await asyncio.get_running_loop().run_in_executor(None, finished.wait, 5)
+    await asyncio.sleep(0.05)
+    assert remover.memory_budget.used == 0 and remover._active_jobs == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_job_waiting_for_the_budget_never_starts():
+    """A job cancelled before it fits in the budget is dropped instead of run later"""
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    remover.memory_budget = MemoryBudget(100)
+    started = []
+
+    async def run():
+        started.append(True)
+
+    async with remover.memory_budget.reserve(100):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(remover._run_in_budget(50, run), timeout=0.05)
+    await asyncio.sleep(0.01)
+    assert started == [] and remover.memory_budget.waiting == 0
+
+
+def _worker_state():
+    """Run in a pool worker: whether the re-imported main module built a remover of its own"""
+    import image_processor
+    return image_processor._background_remover is None, sys.modules['__mp_main__'].__file__
+
+
+def test_workers_spawned_from_bot_do_not_build_a_remover(monkeypatch):
+    """Spawn workers re-import bot.py as __mp_main__, which must not load a model or start a pool"""
+    import __main__
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+    # As if the bot had been started with `python bot.py`
+    monkeypatch.setattr(__main__, '__file__', bot_path)
+    monkeypatch.setattr(__main__, '__spec__', None)
+    monkeypatch.setenv('INFERENCE_PROCESSES', '1')
+    pool = WorkerPool(1, max_jobs=0, max_rss_bytes=0, remover=StubRemover(),
+                      model_mode='base', variants=['base'], threads=1)
+    try:
+        no_remover, main_file = pool._pool.submit(_worker_state).result(timeout=60)
+    finally:
+        pool.shutdown()
+    assert main_file == bot_path
+    assert no_remover
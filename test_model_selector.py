@@ -0,0 +1,71 @@
+"""
+Tests for adaptive model variant selection
+"""
+import asyncio
+import time
+
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from image_processor import BackgroundRemover
+from model_selector import ModelSelector
+
+
+def test_best_variant_when_idle_or_large():
+    """Idle requests and large images get the highest quality variant"""
+    selector = ModelSelector(['fast', 'base'], latency_target=3, large_image_megapixels=4)
+
+    assert selector.choose(640, 480, queue_depth=0) == ('base', 'idle')
+    assert selector.choose(3000, 2000, queue_depth=10) == ('base', 'large_image')
+
+
+def test_degrades_under_load():
+    """A queue that would miss the latency target switches to the fast variant"""
+    selector = ModelSelector(['base', 'fast'], latency_target=3, large_image_megapixels=4)
+    selector.record('base', 2.0)
+    selector.record('fast', 0.5)
+
+    assert selector.choose(640, 480, queue_depth=0)[0] == 'base'
+    assert selector.choose(640, 480, queue_depth=3) == ('fast', 'load')
+    assert selector.choose(640, 480, queue_depth=50) == ('fast', 'overloaded')
+
+
+def test_single_variant_is_always_used():
+    selector = ModelSelector(['fast'], latency_target=0.1, large_image_megapixels=4)
+    assert selector.choose(640, 480, queue_depth=100) == ('fast', 'only')
+
+
+def test_remover_records_model_measurements():
+    """BackgroundRemover feeds inference times back to its selector"""
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='base', variants=['base', 'fast'])
+    before = remover.selector.expected_seconds('base', 0)
+
+    result = asyncio.run(remover.process_image(make_synthetic_image(64, 64), 'full'))
+
+    assert result is not None
+    assert remover.selector.expected_seconds('base', 0) < before
+
+
+class SleepyStub(StubRemover):
+    """Stub model with a known inference time"""
+
+    def process(self, img, type='rgba'):
+        time.sleep(0.05)
+        return super().process(img, type)
+
+
+def test_worker_processes_report_inference_time_only(monkeypatch):
+    """With worker processes the selector learns model time, not IPC, decoding and encoding"""
+    monkeypatch.setattr(Config, 'INFERENCE_PROCESSES', 1)
+    monkeypatch.setattr(Config, 'MEMORY_BUDGET_MB', -1)
+    remover = BackgroundRemover(remover=SleepyStub(), model_mode='base')
+    recorded = []
+    monkeypatch.setattr(remover.selector, 'record', lambda variant, seconds: recorded.append((variant, seconds)))
+    try:
+        # The first job also waits for the worker process to start
+        result = asyncio.run(remover.process_image(make_synthetic_image(64, 64), 'full'))
+    finally:
+        remover.worker_pool.shutdown()
+
+    assert result is not None
+    assert [variant for variant, _ in recorded] == ['base']
+    assert 0.05 <= recorded[0][1] < 0.25
@@ -0,0 +1,44 @@
+"""
+Tests for opt-in job profiling
+"""
+import json
+
+from config import Config
+from metrics import track_stage
+from profiling import arm_profiling, current_session, profile_request
+
+
+def test_unsampled_job_is_not_profiled(tmp_path, monkeypatch):
+    """With profiling off, no session is created and nothing is written"""
+    monkeypatch.setattr(Config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'PROFILE_SAMPLE_RATE', 0.0)
+
+    with profile_request('req1') as session:
+        with track_stage('decode'):
+            assert current_session() is None
+
+    assert session is None
+    assert not any(tmp_path.iterdir())
+
+
+def test_armed_job_writes_stage_profiles(tmp_path, monkeypatch):
+    """An admin-armed job gets one profile per stage and a summary"""
+    monkeypatch.setattr(Config, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(Config, 'PROFILE_SAMPLE_RATE', 0.0)
+    arm_profiling(1)
+
+    with profile_request('req2'):
+        with track_stage('decode'):
+            sum(range(1000))
+        with track_stage('upload', cpu_profile=False):
+            pass
+
+    request_dir = tmp_path / 'req2'
+    assert (request_dir / 'decode.prof').exists()
+    assert not (request_dir / 'upload.prof').exists()
+    summary = json.loads((request_dir / 'summary.json').read_text())
+    assert set(summary['stage_seconds']) == {'decode', 'upload'}
+
+    # Arming covered a single job only
+    with profile_request('req3') as session:
+        assert session is None
@@ -0,0 +1,161 @@
+"""
+Tests for cost accounting and cost-based quotas (stub model, fake Bot API)
+"""
+import asyncio
+import time
+
+import pytest
+
+import image_processor
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from fake_bot_api import FakeBotApi
+from metrics import track_stage
+from quotas import JobCost, QuotaLedger, charge_megapixels, track_cost
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _cost(megapixels: float = 0.0, cpu_seconds: float = 0.0) -> JobCost:
+    cost = JobCost()
+    cost.add_megapixels(megapixels)
+    cost.add_cpu('inference', cpu_seconds)
+    return cost
+
+
+def test_job_cost_in_units(monkeypatch):
+    """A job costs its fixed overhead, its megapixels and the CPU-seconds of all stages"""
+    monkeypatch.setattr(Config, 'COST_PER_JOB', 2.0)
+    monkeypatch.setattr(Config, 'COST_PER_MEGAPIXEL', 0.5)
+    cost = _cost(megapixels=12, cpu_seconds=3)
+    cost.add_cpu('encode', 1)
+    assert cost.total_cpu_seconds == 4
+    assert cost.units == 2 + 6 + 4
+
+
+def test_user_budget_refuses_until_charges_leave_the_window(monkeypatch):
+    """A user over budget is refused until enough of their charges are older than the window"""
+    monkeypatch.setattr(Config, 'COST_PER_JOB', 0.0)
+    clock = FakeClock()
+    ledger = QuotaLedger(user_budget=10, global_budget=0, window_seconds=60, clock=clock)
+
+    assert ledger.check(1) == (None, 0.0)
+    ledger.charge(1, _cost(megapixels=4))
+    clock.now += 20
+    ledger.charge(1, _cost(cpu_seconds=7))
+    # Over budget by the last job; another user is not affected
+    assert ledger.check(1) == ('user', 40.0)
+    assert ledger.check(2) == (None, 0.0)
+
+    clock.now += 40
+    assert ledger.spent(1) == 7
+    assert ledger.check(1) == (None, 0.0)
+
+    usage = ledger.usage[1]
+    assert (usage.jobs, usage.refused, usage.units, usage.megapixels, usage.cpu_seconds) == (2, 1, 11, 4, 7)
+
+
+def test_global_budget_applies_to_everyone(monkeypatch):
+    """Once all users together spent the global budget, new users are refused too"""
+    monkeypatch.setattr(Config, 'COST_PER_JOB', 1.0)
+    clock = FakeClock()
+    ledger = QuotaLedger(user_budget=100, global_budget=3, window_seconds=60, clock=clock)
+    for user_id in (1, 2, 3):
+        ledger.charge(user_id, JobCost())
+    assert ledger.check(4) == ('global', 60.0)
+    assert ledger.top_users(2) == [(1, 1.0), (2, 1.0)]
+
+
+def test_stages_charge_their_cpu_time_to_the_job():
+    """Profiled stages add their thread CPU time, unprofiled ones (waiting on I/O) do not"""
+    with track_cost() as cost:
+        with track_stage('composite'):
+            sum(i * i for i in range(200_000))
+        with track_stage('upload', cpu_profile=False):
+            time.sleep(0.01)
+        charge_megapixels(2000, 1500)
+    assert cost.cpu_seconds['composite'] > 0
+    assert 'upload' not in cost.cpu_seconds
+    assert cost.megapixels == 3.0
+
+
+@pytest.mark.asyncio
+async def test_processing_is_charged_per_stage(monkeypatch):
+    """Processing an image charges its pixels and every stage it ran through"""
+    monkeypatch.setattr(Config, 'MASK_CACHE_SIZE', 0)
+    remover = image_processor.BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    with track_cost() as cost:
+        result = await remover.process_image(make_synthetic_image(400, 250), mode='semi')
+    assert result is not None
+    assert cost.megapixels == pytest.approx(0.1)
+    assert {'decode', 'inference', 'composite', 'encode'} <= set(cost.cpu_seconds)
+
+
+@pytest.fixture
+def fake_api(monkeypatch, tmp_path):
+    api = FakeBotApi(poll_timeout=0.2)
+    api.start()
+    api.add_file('photo-1', make_synthetic_image(96, 64))
+    monkeypatch.setattr(Config, 'BOT_TOKEN', '123456:QUOTAS')
+    monkeypatch.setattr(Config, 'TELEGRAM_API_BASE_URL', api.base_url)
+    monkeypatch.setattr(Config, 'TELEGRAM_API_FILE_URL', api.base_file_url)
+    monkeypatch.setattr(Config, 'JOB_JOURNAL_DIR', str(tmp_path / 'journal'))
+    monkeypatch.setattr(Config, 'STATUS_MESSAGE_MODE', 'none')
+    monkeypatch.setattr(Config, 'ADMIN_USER_IDS', [900])
+    remover = image_processor.BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    monkeypatch.setattr(image_processor, '_background_remover', remover)
+    yield api
+    api.stop()
+
+
+def _message(user_id: int, **fields) -> dict:
+    return {
+        'message_id': 1,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+        **fields
+    }
+
+
+async def _wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.02)
+
+
+def _texts(api, chat_id: int):
+    return [r.params['text'] for r in api.requests if r.method == 'sendMessage' and r.chat_id == chat_id]
+
+
+@pytest.mark.asyncio
+async def test_user_over_budget_is_refused_and_shows_in_usage(monkeypatch, fake_api):
+    """The bot refuses a user over budget, and /usage reports them to admins only"""
+    monkeypatch.setattr(Config, 'USER_COST_BUDGET', 1.0)
+    import bot
+    instance = bot.BackgroundRemovalBot()
+    await instance.start()
+    try:
+        photo = [{'file_id': 'photo-1', 'file_unique_id': 'photo-1', 'width': 96, 'height': 64}]
+        fake_api.push_update({'message': _message(301, photo=photo)})
+        await _wait_for(lambda: any(r.method == 'sendDocument' for r in fake_api.requests))
+        fake_api.push_update({'message': _message(301, photo=photo)})
+        await _wait_for(lambda: _texts(fake_api, 301))
+        assert 'processing budget' in _texts(fake_api, 301)[0]
+
+        command = [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        fake_api.push_update({'message': _message(301, text='/usage', entities=command)})
+        fake_api.push_update({'message': _message(900, text='/usage', entities=command)})
+        await _wait_for(lambda: _texts(fake_api, 900) and len(_texts(fake_api, 301)) == 2)
+        report = _texts(fake_api, 900)[0]
+        assert '• 301:' in report and '1 jobs' in report and '1 refused' in report
+        assert _texts(fake_api, 301)[-1] == Config.ERROR_MESSAGES['admin_only']
+    finally:
+        await instance.stop()
@@ -0,0 +1,147 @@
+"""
+Tests for the Telegram Bot API request layer
+"""
+import json
+
+import httpx
+import pytest
+from telegram.error import NetworkError, TimedOut
+
+import telegram_request
+from config import Config
+from telegram_request import InstrumentedRequest, TelegramRequest, count_api_calls
+
+API_URL = 'https://api.telegram.org/bot123:ABC'
+
+
+def make_request(handler, request_class=InstrumentedRequest):
+    """Create a request object whose HTTP traffic goes to a handler function"""
+    request = request_class()
+    request._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return request
+
+
+def ok_response(request):
+    """Answer every Bot API call successfully"""
+    return httpx.Response(200, content=json.dumps({'ok': True, 'result': True}).encode())
+
+
+@pytest.mark.asyncio
+async def test_counts_calls_per_job():
+    """Only calls made inside the block are attributed to the job"""
+    request = make_request(ok_response)
+
+    await request.post(f'{API_URL}/getUpdates')
+    with count_api_calls() as api_calls:
+        await request.post(f'{API_URL}/getFile')
+        await request.retrieve('https://api.telegram.org/file/bot123:ABC/photos/file_1.jpg')
+        await request.post(f'{API_URL}/sendDocument')
+
+    assert api_calls.count == 3
+
+
+@pytest.mark.asyncio
+async def test_retries_after_flood_control(monkeypatch):
+    """A 429 answer is retried instead of failing the reply"""
+    monkeypatch.setattr(Config, 'TELEGRAM_RETRY_BACKOFF_SECONDS', 0.0)
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(telegram_request.asyncio, 'sleep', sleep)
+    responses = [
+        httpx.Response(429, content=json.dumps({
+            'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+            'parameters': {'retry_after': 3}
+        }).encode()),
+    ]
+
+    def handler(request):
+        return responses.pop(0) if responses else ok_response(request)
+
+    request = make_request(handler, TelegramRequest)
+    with count_api_calls() as api_calls:
+        assert await request.post(f'{API_URL}/sendDocument') is True
+
+    assert api_calls.count == 2
+    assert delays == [3]
+
+
+@pytest.mark.asyncio
+async def test_timed_out_send_is_not_retried(monkeypatch):
+    """A send that may have reached Telegram is not repeated"""
+    monkeypatch.setattr(Config, 'TELEGRAM_RETRY_BACKOFF_SECONDS', 0.0)
+
+    def handler(request):
+        raise httpx.ReadTimeout('timed out', request=request)
+
+    request = make_request(handler, TelegramRequest)
+    with count_api_calls() as api_calls:
+        with pytest.raises(TimedOut):
+            await request.post(f'{API_URL}/sendDocument')
+        with pytest.raises(TimedOut):
+            await request.post(f'{API_URL}/getFile')
+
+    assert api_calls.count == 1 + 1 + Config.TELEGRAM_MAX_RETRIES
+
+
+@pytest.mark.asyncio
+async def test_send_with_a_dropped_connection_is_not_retried(monkeypatch):
+    """A read error may come after Telegram handled the call, so the send is not repeated"""
+    monkeypatch.setattr(Config, 'TELEGRAM_RETRY_BACKOFF_SECONDS', 0.0)
+
+    def handler(request):
+        raise httpx.ReadError('connection reset', request=request)
+
+    request = make_request(handler, TelegramRequest)
+    with count_api_calls() as api_calls:
+        with pytest.raises(NetworkError):
+            await request.post(f'{API_URL}/sendDocument')
+
+    assert api_calls.count == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('failure', [httpx.ConnectError, httpx.ConnectTimeout])
+async def test_send_that_could_not_connect_is_retried(monkeypatch, failure):
+    """A failed or timed out connect never reached Telegram, so even a send is retried"""
+    monkeypatch.setattr(Config, 'TELEGRAM_RETRY_BACKOFF_SECONDS', 0.0)
+    failures = [failure]
+
+    def handler(request):
+        if failures:
+            raise failures.pop()('connection refused', request=request)
+        return ok_response(request)
+
+    request = make_request(handler, TelegramRequest)
+    with count_api_calls() as api_calls:
+        assert await request.post(f'{API_URL}/sendDocument') is True
+
+    assert api_calls.count == 2
+
+
+@pytest.mark.asyncio
+async def test_client_uses_our_keepalive_settings(monkeypatch):
+    """The HTTP client is built from our settings, also when rebuilt after a shutdown"""
+    built = []
+
+    class RecordingClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            built.append(kwargs)
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(telegram_request.httpx, 'AsyncClient', RecordingClient)
+    request = TelegramRequest(connection_pool_size=3, keepalive_expiry=7.0, connect_timeout=2.0)
+    assert isinstance(request._client, RecordingClient)
+    await request.initialize()
+    await request.shutdown()
+    await request.initialize()
+    await request.shutdown()
+
+    assert len(built) == 2
+    for kwargs in built:
+        assert kwargs['limits'] == httpx.Limits(
+            max_connections=3, max_keepalive_connections=3, keepalive_expiry=7.0
+        )
+        assert kwargs['timeout'].connect == 2.0
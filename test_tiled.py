@@ -0,0 +1,115 @@
+"""
+Tests for strip-wise processing of very large images (stub model)
+"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from benchmark import StubRemover, make_synthetic_image
+from config import Config
+from image_processor import BackgroundRemover
+from mask_upsampling import StripUpsampler, upsample_mask
+from memory_budget import estimate_job_bytes
+from tiled import StripPngWriter
+
+
+def _decode(png: bytes) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(png)).convert('RGBA'))
+
+
+def test_strip_writer_output_decodes_to_the_input():
+    """A PNG written strip by strip decodes to exactly the pixels that were written"""
+    image = Image.open(io.BytesIO(make_synthetic_image(203, 157))).convert('RGBA')
+    # Flat areas, a gradient and noise exercise every PNG filter
+    image.putalpha(Image.linear_gradient('L').resize(image.size))
+    pixels = np.asarray(image)
+
+    output = io.BytesIO()
+    writer = StripPngWriter(output, image.width, image.height, chunk_size=4096)
+    for top in range(0, image.height, 40):
+        writer.write(pixels[top:top + 40])
+    writer.close()
+
+    assert np.array_equal(_decode(output.getvalue()), pixels)
+
+
+def test_strip_writer_needs_every_row():
+    """Closing a PNG before all rows were written is an error"""
+    writer = StripPngWriter(io.BytesIO(), 10, 10)
+    writer.write(np.zeros((4, 10, 4), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        writer.close()
+
+
+def test_strip_upsampling_matches_whole_mask_upsampling():
+    """Upsampling the mask strip by strip gives nearly the same mask as upsampling it whole"""
+    image = Image.open(io.BytesIO(make_synthetic_image(400, 300))).convert('RGB')
+    low_image = image.resize((100, 75), Image.BILINEAR)
+    low_mask = StubRemover().process(low_image, type='map').convert('L')
+
+    for method in ('guided', 'bilinear'):
+        upsampler = StripUpsampler(low_mask, low_image, image.size, method)
+        strips = [
+            np.asarray(upsampler.upsample(image.crop((0, top, 400, min(300, top + 64))), top), dtype=np.int16)
+            for top in range(0, 300, 64)
+        ]
+        whole = np.asarray(upsample_mask(low_mask, image, method), dtype=np.int16)
+        # The whole-image path downscales the guide itself, the strips use the model input
+        assert np.abs(np.vstack(strips) - whole).mean() < 1.0
+
+
+@pytest.mark.parametrize('mode', ['full', 'semi', 'soft', 'subject', 'custom'])
+def test_tiled_result_matches_whole_image_processing(monkeypatch, mode):
+    """With the mask at full resolution, strips only change how the result is produced"""
+    image_bytes = make_synthetic_image(240, 180, image_format='PNG')
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    monkeypatch.setattr(Config, 'MASK_CACHE_SIZE', 0)
+    whole = remover._run_job(image_bytes, mode, 40, 0, 'stub')
+
+    monkeypatch.setattr(Config, 'TILED_MIN_MEGAPIXELS', 0.01)
+    monkeypatch.setattr(Config, 'TILED_MASK_MAX_SIDE', 240)
+    monkeypatch.setattr(Config, 'TILED_STRIP_ROWS', 50)
+    tiled = remover._run_job(image_bytes, mode, 40, 0, 'stub')
+
+    assert np.array_equal(_decode(tiled), _decode(whole))
+
+
+def test_large_image_gets_a_bounded_mask(monkeypatch):
+    """The model of a tiled job runs on the image scaled down to TILED_MASK_MAX_SIDE"""
+    monkeypatch.setattr(Config, 'TILED_MIN_MEGAPIXELS', 0.1)
+    monkeypatch.setattr(Config, 'TILED_MASK_MAX_SIDE', 128)
+    monkeypatch.setattr(Config, 'MASK_CACHE_SIZE', 0)
+    seen = []
+
+    class RecordingStub(StubRemover):
+        def process(self, img, type='rgba'):
+            seen.append(img.size)
+            return super().process(img, type)
+
+    remover = BackgroundRemover(remover=RecordingStub(), model_mode='stub')
+    result = _decode(remover._run_job(make_synthetic_image(640, 480), 'full', 100, 0, 'stub'))
+
+    assert seen == [(128, 96)]
+    assert result.shape == (480, 640, 4)
+    assert result[240, 320, 3] == 255 and result[5, 5, 3] == 0
+
+
+def test_dimension_cap_is_configurable(monkeypatch):
+    """MAX_IMAGE_DIMENSION decides which images are too large to process"""
+    remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    image = make_synthetic_image(300, 200)
+    assert remover.validate_image(image) == (True, "")
+    monkeypatch.setattr(Config, 'MAX_IMAGE_DIMENSION', 256)
+    valid, message = remover.validate_image(image)
+    assert not valid and '256x256' in message
+
+
+def test_tiled_jobs_are_estimated_without_full_size_buffers(monkeypatch):
+    """Tiled jobs are budgeted for the source image and strips, not full-size results"""
+    monkeypatch.setattr(Config, 'TILED_MIN_MEGAPIXELS', 20)
+    monkeypatch.setattr(Config, 'INFERENCE_MEMORY_MB', 0)
+    untiled = estimate_job_bytes(5000, 3999)
+    tiled = estimate_job_bytes(5000, 4000)
+    assert tiled < untiled / 2
@@ -0,0 +1,89 @@
+"""
+Tests for per-chat ordered concurrent update processing
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(chat_id):
+    """Create a minimal update-like object for a chat"""
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+async def record(events, name, delay=0.0):
+    """Simulate a handler that takes some time and records when it finishes"""
+    events.append(f"{name}:start")
+    await asyncio.sleep(delay)
+    events.append(f"{name}:end")
+
+
+@pytest.mark.asyncio
+async def test_same_chat_updates_keep_order():
+    """A slow 'mode:semi' text must finish before the following photo starts"""
+    processor = ChatOrderedUpdateProcessor(8)
+    events = []
+
+    await asyncio.gather(
+        processor.process_update(make_update(1), record(events, 'mode', delay=0.05)),
+        processor.process_update(make_update(1), record(events, 'photo')),
+    )
+
+    assert events == ['mode:start', 'mode:end', 'photo:start', 'photo:end']
+
+
+@pytest.mark.asyncio
+async def test_different_chats_run_concurrently():
+    """A slow job in one chat must not delay another chat"""
+    processor = ChatOrderedUpdateProcessor(8)
+    events = []
+
+    await asyncio.gather(
+        processor.process_update(make_update(1), record(events, 'slow', delay=0.05)),
+        processor.process_update(make_update(2), record(events, 'fast')),
+    )
+
+    assert events.index('fast:end') < events.index('slow:end')
+
+
+@pytest.mark.asyncio
+async def test_failing_update_does_not_block_chat():
+    """An exception in one update must not drop the queued updates of that chat"""
+    processor = ChatOrderedUpdateProcessor(8)
+    events = []
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    await asyncio.gather(
+        processor.process_update(make_update(1), fail()),
+        processor.process_update(make_update(1), record(events, 'photo')),
+    )
+
+    assert events == ['photo:start', 'photo:end']
+    assert processor.queued_updates == 0
+
+
+@pytest.mark.asyncio
+async def test_album_job_runs_in_order_with_its_chat():
+    """An album job waits for the chat's running update, and the next photo waits for the album"""
+    processor = ChatOrderedUpdateProcessor(8)
+    events = []
+
+    async def album_then_photo():
+        await processor.run_in_chat(make_update(1), record(events, 'album', delay=0.02))
+        events.append('album:returned')
+
+    await asyncio.gather(
+        processor.process_update(make_update(1), record(events, 'photo1', delay=0.05)),
+        album_then_photo(),
+        processor.process_update(make_update(1), record(events, 'photo2')),
+    )
+
+    assert events.index('album:returned') > events.index('album:end')
+    events.remove('album:returned')
+    assert events == ['photo1:start', 'photo1:end', 'album:start', 'album:end', 'photo2:start', 'photo2:end']
@@ -0,0 +1,171 @@
+"""
+Strip-wise processing of very large images
+
+Images of at least TILED_MIN_MEGAPIXELS are not composited as a whole. The
+model runs on a copy scaled down to TILED_MASK_MAX_SIDE, and the result is
+produced TILED_STRIP_ROWS rows at a time: each horizontal strip of the mask
+is upsampled, composited with the matching rows of the image and compressed
+into the PNG stream before the next strip is touched. Besides the decoded
+source and the compressed output, no full-size buffer (RGBA result, mask,
+alpha channel, encoder copy) is ever held.
+"""
+import logging
+import struct
+import zlib
+from typing import BinaryIO, Optional
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from animation import PNG_SIGNATURE, _chunk
+from config import Config
+from mask_upsampling import StripUpsampler, inference_size
+from metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+
+def use_tiled_processing(width: int, height: int) -> bool:
+    """Whether an image of this size goes through the strip-wise path"""
+    return Config.TILED_MIN_MEGAPIXELS > 0 and width * height >= Config.TILED_MIN_MEGAPIXELS * 1_000_000
+
+
+def _paeth_predictor(left: np.ndarray, up: np.ndarray, up_left: np.ndarray) -> np.ndarray:
+    estimate_left = np.abs(up - up_left)
+    estimate_up = np.abs(left - up_left)
+    estimate_up_left = np.abs(left + up - 2 * up_left)
+    return np.where(
+        (estimate_left <= estimate_up) & (estimate_left <= estimate_up_left),
+        left,
+        np.where(estimate_up <= estimate_up_left, up, up_left)
+    )
+
+
+class StripPngWriter:
+    """
+    Write an 8-bit RGBA PNG from consecutive strips of rows
+
+    PIL only encodes whole images, so the rows are filtered here and fed to
+    a single zlib stream that is written out as IDAT chunks while it grows.
+    Every row gets the filter with the smallest sum of absolute differences,
+    the adaptive heuristic the PNG specification recommends. The filters only
+    look at unfiltered bytes, so a whole strip is filtered at once.
+    """
+
+    BYTES_PER_PIXEL = 4
+
+    def __init__(self, fp: BinaryIO, width: int, height: int, compress_level: int = 6,
+                 chunk_size: int = 1 << 20):
+        self.fp = fp
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.chunk_size = chunk_size
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = bytearray()
+        # Row above the current strip (zeros above the first row)
+        self._previous = np.zeros(width * self.BYTES_PER_PIXEL, dtype=np.uint8)
+
+        header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)  # 8 bit RGBA, no interlacing
+        self.fp.write(PNG_SIGNATURE + _chunk(b'IHDR', header))
+
+    def write(self, strip: np.ndarray):
+        """Append rows given as a (rows, width, 4) uint8 array"""
+        rows = strip.reshape(strip.shape[0], -1)
+        if rows.shape[1] != self.width * self.BYTES_PER_PIXEL:
+            raise ValueError(f"Strip is {strip.shape[1]} pixels wide, the image {self.width}")
+        if self.rows + len(rows) > self.height:
+            raise ValueError("More rows than the image height")
+
+        current = rows.astype(np.int16)
+        up = np.vstack([self._previous[None].astype(np.int16), current[:-1]])
+        left = np.zeros_like(current)
+        left[:, self.BYTES_PER_PIXEL:] = current[:, :-self.BYTES_PER_PIXEL]
+        up_left = np.zeros_like(up)
+        up_left[:, self.BYTES_PER_PIXEL:] = up[:, :-self.BYTES_PER_PIXEL]
+
+        best = best_types = best_scores = None
+        predictors = (
+            (0, None),
+            (1, lambda: left),
+            (2, lambda: up),
+            (3, lambda: (left + up) // 2),
+            (4, lambda: _paeth_predictor(left, up, up_left))
+        )
+        for filter_type, predictor in predictors:
+            filtered = current if predictor is None else (current - predictor()) & 0xFF
+            # Filtered bytes read as signed values; smaller means better compression
+            scores = np.minimum(filtered, 256 - filtered).sum(axis=1)
+            if best is None:
+                best, best_scores = filtered, scores
+                best_types = np.zeros(len(rows), dtype=np.uint8)
+            else:
+                better = scores < best_scores
+                best = np.where(better[:, None], filtered, best)
+                best_scores = np.where(better, scores, best_scores)
+                best_types[better] = filter_type
+
+        data = np.empty((len(rows), rows.shape[1] + 1), dtype=np.uint8)
+        data[:, 0] = best_types
+        data[:, 1:] = best
+        self._write_data(self._compressor.compress(data.tobytes()))
+        self._previous = rows[-1].copy()
+        self.rows += len(rows)
+
+    def _write_data(self, data: bytes, final: bool = False):
+        self._pending += data
+        while len(self._pending) >= self.chunk_size or (final and self._pending):
+            self.fp.write(_chunk(b'IDAT', bytes(self._pending[:self.chunk_size])))
+            del self._pending[:self.chunk_size]
+
+    def close(self):
+        """Finish the file; every row must have been written"""
+        if self.rows != self.height:
+            raise ValueError(f"Only {self.rows} of {self.height} rows were written")
+        self._write_data(self._compressor.flush(), final=True)
+        self.fp.write(_chunk(b'IEND', b''))
+
+
+def process_tiled(remover, image: Image.Image, mode: str, opacity: int, fp: BinaryIO,
+                  cache_key: Optional[str] = None, model: Optional[str] = None):
+    """
+    Remove the background of a large image strip by strip, writing the PNG result to fp
+
+    Args:
+        remover: BackgroundRemover providing _get_mask, _composite and the upsampling settings
+        image: Decoded RGB image
+        mode: Transparency mode
+        opacity: Opacity level for custom mode
+        fp: Output stream
+        cache_key: Key of the source image in the mask cache, or None to skip the cache
+        model: Model variant to use
+    """
+    width, height = image.size
+    low_size = inference_size(image.size, Config.TILED_MASK_MAX_SIDE)
+    low_image = image.resize(low_size, Image.BILINEAR, reducing_gap=3.0)
+    if cache_key is not None:
+        # The cached mask has the bounded resolution, not the image's
+        cache_key = f"tiled:{cache_key}"
+    mask = remover._get_mask(low_image, cache_key, model)
+
+    method = remover.mask_upsample
+    if mode == 'soft':
+        # Feathered at the mask resolution, as soft mode does with low-resolution masks
+        mask = mask.filter(ImageFilter.GaussianBlur(radius=3 * low_size[0] / width))
+        mode, method = 'full', 'bilinear'
+    upsampler = StripUpsampler(
+        mask, low_image, image.size, method,
+        radius=Config.GUIDED_FILTER_RADIUS, eps=Config.GUIDED_FILTER_EPS
+    )
+
+    writer = StripPngWriter(fp, width, height)
+    strip_rows = max(1, Config.TILED_STRIP_ROWS)
+    # Upsampling, compositing and encoding alternate per strip and are timed as one stage
+    with track_stage('composite'):
+        for top in range(0, height, strip_rows):
+            strip = image.crop((0, top, width, min(height, top + strip_rows)))
+            strip_mask = upsampler.upsample(strip, top)
+            result = remover._composite(strip, strip_mask, mode, opacity)
+            writer.write(np.asarray(result))
+    writer.close()
+    logger.info(f"Processed {width}x{height} image in strips of {strip_rows} rows, mask at {low_size}")
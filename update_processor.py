@@ -0,0 +1,125 @@
+"""
+Update processor that handles updates concurrently while keeping per-chat order
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Deque, Dict, Optional, Set, Tuple
+
+from telegram.ext import BaseUpdateProcessor
+
+from job_journal import JobJournal, is_job_update
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Process updates from different chats concurrently, but updates from the
+    same chat strictly one after another in the order they arrived.
+
+    The first update of a chat runs as usual. Updates for that chat that arrive
+    while it is still running are queued and drained by the same task, so a
+    busy chat occupies a single concurrency slot instead of one per message.
+
+    With a journal, job updates are recorded as soon as they arrive and
+    completed when their handler returns, so updates that are queued or
+    running when the bot stops are replayed on the next start.
+    """
+
+    def __init__(self, max_concurrent_updates: int, journal: Optional[JobJournal] = None):
+        super().__init__(max_concurrent_updates)
+        self.journal = journal
+        self._chat_queues: Dict[int, Deque[Tuple[object, Awaitable[Any]]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @staticmethod
+    def _get_chat_id(update: object) -> Optional[int]:
+        """Return the chat id of an update, or None if it has no chat"""
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat is not None else None
+
+    @property
+    def queued_updates(self) -> int:
+        """Number of updates waiting behind another update of the same chat"""
+        return sum(len(queue) for queue in self._chat_queues.values())
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Journal job updates before they wait for a free slot"""
+        if self.journal is not None and is_job_update(update) and not self.journal.record(update):
+            logger.info(f"Dropping update {update.update_id}, it was already replayed from the journal")
+            coroutine.close()
+            return
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            await super().process_update(update, coroutine)
+        except asyncio.CancelledError:
+            # Cancelled while waiting for a slot, the handler never started
+            coroutine.close()
+            raise
+        finally:
+            self._tasks.discard(task)
+
+    async def run_in_chat(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """
+        Run a job that is not an update of its own (e.g. an album) in order with its chat's updates
+
+        The job takes a concurrency slot like an update and returns once it has run,
+        also when it had to wait behind the chat's running update.
+        """
+        finished = asyncio.Event()
+
+        async def job():
+            try:
+                await coroutine
+            finally:
+                finished.set()
+
+        await super().process_update(update, job())
+        await finished.wait()
+
+    def cancel(self):
+        """Cancel every update that is waiting or running, e.g. when a shutdown deadline passed"""
+        for task in self._tasks:
+            task.cancel()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Run the update now, or queue it behind the running update of its chat"""
+        chat_id = self._get_chat_id(update)
+        if chat_id is None:
+            await coroutine
+            return
+
+        queue = self._chat_queues.get(chat_id)
+        if queue is not None:
+            queue.append((update, coroutine))
+            return
+
+        queue = deque()
+        self._chat_queues[chat_id] = queue
+        try:
+            await self._run(update, coroutine)
+            while queue:
+                await self._run(*queue.popleft())
+        finally:
+            del self._chat_queues[chat_id]
+            # Only reached with items left if this task was cancelled
+            while queue:
+                queue.popleft()[1].close()
+
+    async def _run(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Await a queued coroutine so one failure does not stall the chat"""
+        try:
+            await coroutine
+        except Exception as e:
+            logger.error(f"Error processing queued update: {e}")
+        # Not reached when cancelled (shutdown deadline), so the job stays journaled
+        if self.journal is not None and is_job_update(update):
+            self.journal.finish(update.update_id)
+
+    async def initialize(self) -> None:
+        """Nothing to set up"""
+
+    async def shutdown(self) -> None:
+        """Nothing to tear down"""
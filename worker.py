@@ -0,0 +1,137 @@
+"""
+Inference worker for the split frontend / worker deployment
+
+Takes jobs from the job queue (JOB_QUEUE_URL), runs them through the local
+BackgroundRemover and publishes the results for the bot to send. Workers keep
+no state of their own, so any number of them can run on this host or others
+sharing the queue. SIGTERM stops taking jobs and finishes the running ones.
+
+Usage:
+    JOB_QUEUE_URL=sqlite:///data/jobs.db python worker.py
+    python worker.py --queue redis://queue-host:6379/0 --concurrency 2
+    python worker.py --stub   # no model weights, for testing the setup
+"""
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+from typing import Optional
+
+from config import Config
+from image_processor import BackgroundRemover
+from job_queue import JobQueue, open_job_queue
+from metrics import QUEUE_DEPTH, start_metrics_server
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+async def _renew_lease(queue: JobQueue, job_id: str, interval: float):
+    """Keep renewing a running job's lease so it is not handed to another worker"""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, queue.renew, job_id)
+        except Exception as e:
+            logger.warning(f"Error renewing lease of job {job_id}: {e}")
+
+
+async def run_worker(queue: JobQueue, remover: BackgroundRemover, concurrency: int,
+                     stop: Optional[asyncio.Event] = None, poll_timeout: float = 1.0,
+                     renew_interval: Optional[float] = None) -> int:
+    """
+    Process jobs until stop is set
+
+    Each of the `concurrency` consumers takes a job only once it is free, so
+    a worker never holds more jobs than it runs and idle workers pick up the rest.
+    While a job runs its lease is renewed every renew_interval seconds
+    (default: a third of JOB_LEASE_SECONDS).
+
+    Returns:
+        Number of jobs processed
+    """
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    renew_interval = renew_interval if renew_interval is not None else Config.JOB_LEASE_SECONDS / 3
+    processed = 0
+
+    async def consume():
+        nonlocal processed
+        while not stop.is_set():
+            try:
+                job = await loop.run_in_executor(None, queue.take, poll_timeout)
+                if job is None:
+                    continue
+                heartbeat = asyncio.create_task(_renew_lease(queue, job.id, renew_interval))
+                try:
+                    if job.operation == 'animation':
+                        result = await remover.process_animation(job.data, mode=job.mode, opacity=job.opacity)
+                    else:
+                        result = await remover.process_image(
+                            job.data, mode=job.mode, opacity=job.opacity, preview_side=job.preview_side
+                        )
+                finally:
+                    heartbeat.cancel()
+                await loop.run_in_executor(None, queue.finish, job.id, result)
+                processed += 1
+            except Exception as e:
+                # The queue may be briefly unreachable; an unfinished job is retried after its lease
+                logger.error(f"Error running job: {e}")
+                await asyncio.sleep(poll_timeout)
+
+    await asyncio.gather(*(consume() for _ in range(concurrency)))
+    return processed
+
+
+async def serve(queue_url: str, remover: BackgroundRemover, concurrency: int) -> int:
+    """Run a worker until SIGTERM or Ctrl+C"""
+    queue = open_job_queue(queue_url)
+    start_metrics_server()
+    QUEUE_DEPTH.labels(queue='jobs').set_function(queue.depth)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    logger.info(f"Worker taking jobs from {queue_url} with {concurrency} consumer(s)")
+    processed = await run_worker(queue, remover, concurrency, stop)
+    logger.info(f"Worker stopped after {processed} job(s)")
+    if remover.worker_pool is not None:
+        await loop.run_in_executor(None, remover.worker_pool.shutdown)
+    return processed
+
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Run background removal jobs from the job queue")
+    parser.add_argument('--queue', default=Config.JOB_QUEUE_URL,
+                        help="Queue URL: sqlite:///path/jobs.db or redis://host:6379/0 (default: JOB_QUEUE_URL)")
+    parser.add_argument('--concurrency', type=int, default=0,
+                        help="Jobs processed at once (default: the inference workers or processes)")
+    parser.add_argument('--stub', action='store_true', help="Use a stub model (no weights, no inference cost)")
+    args = parser.parse_args()
+
+    if not args.queue:
+        print("❌ No job queue configured. Set JOB_QUEUE_URL or pass --queue.")
+        return 1
+
+    if args.stub:
+        from benchmark import StubRemover
+        remover = BackgroundRemover(remover=StubRemover(), model_mode='stub')
+    else:
+        remover = BackgroundRemover()
+    concurrency = args.concurrency or remover.inference_workers
+
+    print(f"🛠️  Inference worker: {concurrency} job(s) at a time from {args.queue}")
+    asyncio.run(serve(args.queue, remover, concurrency))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
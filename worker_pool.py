@@ -0,0 +1,143 @@
+"""
+Inference in recyclable worker processes
+
+Memory freed by PIL, numpy and torch is not always returned to the OS, so a
+long-running process slowly grows. With INFERENCE_PROCESSES set, jobs run
+in a pool of worker processes that each load the model, and the pool is
+replaced:
+
+- after WORKER_MAX_JOBS jobs per worker,
+- when a worker reports an RSS above WORKER_MAX_RSS_MB,
+- when a worker died (e.g. killed by the OOM killer), in which case its job
+  is retried.
+
+A replaced pool finishes the jobs already submitted to it, so no request is
+dropped.
+"""
+import asyncio
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from metrics import WORKER_RECYCLES, current_rss_bytes
+from quotas import current_cost, track_cost
+
+logger = logging.getLogger(__name__)
+
+# ProcessPoolExecutor.shutdown(cancel_futures=...) is new in Python 3.9
+_HAS_CANCEL_FUTURES = sys.version_info >= (3, 9)
+
+# BackgroundRemover of this worker process
+_worker_remover = None
+
+
+def _initialize_worker(remover: Any, model_mode: str, variants: List[str], threads: int):
+    """Load the model in a new worker process"""
+    global _worker_remover
+    # The worker runs its jobs itself, one at a time, with its share of the cores
+    Config.INFERENCE_PROCESSES = 0
+    Config.INFERENCE_WORKERS = 1
+    Config.INFERENCE_THREADS_PER_WORKER = threads
+    Config.MEMORY_BUDGET_MB = -1
+
+    from image_processor import BackgroundRemover
+    _worker_remover = BackgroundRemover(remover=remover, model_mode=model_mode, variants=variants)
+
+
+def _run_in_worker(operation: str, args: tuple) -> Tuple[Any, Optional[int], Dict, List[Tuple[str, float]]]:
+    """Run one job and report the worker's RSS, the job's cost and its inference times afterwards"""
+    _worker_remover.inference_log = []
+    with track_cost() as cost:
+        if operation == 'animation':
+            result = _worker_remover._run_animation(*args)
+        else:
+            result = _worker_remover._run_job(*args)
+    return result, current_rss_bytes(), cost.snapshot(), _worker_remover.inference_log
+
+
+class WorkerPool:
+    """Pool of inference processes that is replaced when workers grow too large or die"""
+
+    def __init__(self, processes: int, max_jobs: int, max_rss_bytes: int,
+                 remover: Any, model_mode: str, variants: List[str], threads: int,
+                 on_inference: Optional[Callable[[str, float], None]] = None):
+        """
+        Args:
+            processes: Worker processes
+            max_jobs: Jobs per worker after which the pool is replaced (0 = never)
+            max_rss_bytes: RSS above which the pool is replaced (0 = never)
+            remover: Model object to use in the workers instead of loading InSPyReNet
+                (e.g. a stub), must be picklable
+            model_mode, variants: Model variants to load in each worker
+            threads: Intra-op threads per worker
+            on_inference: Called with (variant, seconds) for each model run in a worker,
+                so the parent learns from the same timings as with inference threads
+        """
+        self.processes = processes
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = max_rss_bytes
+        self._initargs = (remover, model_mode, variants, threads)
+        self.on_inference = on_inference
+        self._pool = self._new_pool()
+        self._pool_jobs = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # Spawned, not forked: a fork would copy the parent's torch threads and memory
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_initialize_worker,
+            initargs=self._initargs
+        )
+
+    async def run(self, operation: str, *args) -> Any:
+        """Run 'process' (BackgroundRemover._run_job) or 'animation' in a worker"""
+        loop = asyncio.get_running_loop()
+        pool = self._pool
+        try:
+            future = loop.run_in_executor(pool, _run_in_worker, operation, args)
+            self._pool_jobs += 1
+            if self.max_jobs and self._pool_jobs >= self.max_jobs * self.processes:
+                # That was the pool's last job, later ones go to a fresh pool
+                self._replace(pool, 'jobs')
+            result, rss, cost, inference_log = await future
+        except BrokenProcessPool:
+            logger.warning("Inference worker died, replacing the pool and retrying the job")
+            self._replace(pool, 'crash')
+            pool = self._pool
+            result, rss, cost, inference_log = await loop.run_in_executor(pool, _run_in_worker, operation, args)
+
+        # The job's CPU time was measured in the worker; charge it to the job here
+        if current_cost() is not None:
+            current_cost().merge(cost)
+        if self.on_inference is not None:
+            for variant, seconds in inference_log:
+                self.on_inference(variant, seconds)
+        if self.max_rss_bytes and rss and rss > self.max_rss_bytes:
+            logger.info(f"Inference worker RSS {rss / 2**20:.0f} MB over the limit, replacing the pool")
+            self._replace(pool, 'rss')
+        return result
+
+    def _replace(self, pool: ProcessPoolExecutor, reason: str):
+        """Send new jobs to a fresh pool and let the old one finish its jobs and exit"""
+        if pool is not self._pool:
+            return  # Another job already replaced it
+        self._pool = self._new_pool()
+        self._pool_jobs = 0
+        pool.shutdown(wait=False)
+        WORKER_RECYCLES.labels(reason=reason).inc()
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers, waiting for their jobs, or cancelling queued ones if not waiting"""
+        if _HAS_CANCEL_FUTURES:
+            self._pool.shutdown(wait=wait, cancel_futures=not wait)
+            return
+        if not wait:
+            # Drop the jobs no worker has picked up yet, as cancel_futures does
+            for work_item in list(self._pool._pending_work_items.values()):
+                work_item.future.cancel()
+        self._pool.shutdown(wait=wait)